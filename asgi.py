@@ -0,0 +1,429 @@
+"""ASGI serving mode for the catalog (Python 3.7+ only).
+
+    uvicorn --factory asgi:create_app [--host 0.0.0.0] [--port 5000]
+
+The JSON API - /category/JSON, /category/<id>/JSON and
+/category/<id>/items/json - runs on the event loop, reading through async
+SQLAlchemy (SQLAlchemy 1.4+, with aiosqlite for SQLite or asyncpg for
+PostgreSQL) from the same models database_setup defines. At most
+ASGI_DB_CONCURRENCY requests query the database at once; the rest wait on
+the loop without holding a thread, however many connections are open. The
+responses are those of the Flask views: the same JSON, paging, streaming
+ETag / Last-Modified validators and MessagePack negotiation.
+
+Every other route - the pages, sign in, edits, search, images and
+/metrics - is passed to the Flask app from main.create_app(), which runs
+in a pool of ASGI_WSGI_THREADS threads; a slow OAuth call or a large page
+holds one of those threads, not the loop. With API_SNAPSHOT on, the JSON
+API is answered from memory by the Flask app, so it goes there too.
+"""
+import asyncio
+import hashlib
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qsl, urlencode
+
+from sqlalchemy import event, func, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.exceptions import NotFound
+from werkzeug.http import http_date, parse_accept_header, parse_date
+from werkzeug.http import parse_etags, quote_etag
+
+import instrumentation
+import main
+import serializers
+from config import Config
+from database_setup import Category, Item, _sqlite_wal
+
+# Async driver used for each database backend
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite',
+                 'postgresql': 'postgresql+asyncpg'}
+
+JSON_HEADERS = [(b'content-type', serializers.JSON.encode('ascii'))]
+NDJSON_HEADERS = [(b'content-type', serializers.NDJSON.encode('ascii'))]
+
+
+def async_url(url):
+    """Returns the SQLAlchemy URL url with its backend's async driver"""
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError('No async driver known for %s; set '
+                         'CATALOG_ASGI_DATABASE_URL' % url.drivername)
+    return url.set(drivername=driver)
+
+
+def make_async_engine(config=Config):
+    """Returns an async engine for config.ASGI_DATABASE_URL, or else for
+    DATABASE_URL, pooling ASGI_DB_CONCURRENCY connections.
+    """
+    url = make_url(config.ASGI_DATABASE_URL or
+                   async_url(config.DATABASE_URL))
+    options = {'pool_size': config.ASGI_DB_CONCURRENCY, 'max_overflow': 0,
+               'pool_recycle': config.DB_POOL_RECYCLE,
+               'pool_pre_ping': config.DB_POOL_PRE_PING}
+    is_sqlite = url.get_backend_name() == 'sqlite'
+    if is_sqlite:
+        # aiosqlite would otherwise open a connection, and a thread, per
+        # session
+        options['poolclass'] = AsyncAdaptedQueuePool
+    engine = create_async_engine(url, **options)
+    if is_sqlite and config.SQLITE_WAL:
+        event.listen(engine.sync_engine, 'connect', _sqlite_wal)
+    instrumentation.instrument_engine(engine.sync_engine,
+                                      config.SLOW_QUERY_MS)
+    return engine
+
+
+class Request(object):
+    """What the JSON routes need of an ASGI HTTP request"""
+
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.root_path = scope.get('root_path', '')
+        self.query_string = scope['query_string'].decode('latin-1')
+        self.args = dict(parse_qsl(self.query_string,
+                                   keep_blank_values=True))
+        self.headers = dict((name.decode('latin-1'), value.decode('latin-1'))
+                            for name, value in scope['headers'])
+        self.mimetype = serializers.mimetype(parse_accept_header(
+            self.headers.get('accept'), MIMEAccept))
+
+    def int_arg(self, name, default=None):
+        """Returns query argument name as an int; default if it is
+        missing or not a number, as request.args.get(type=int) does.
+        """
+        try:
+            return int(self.args[name])
+        except (KeyError, ValueError):
+            return default
+
+    def page_args(self):
+        """Returns after_id and limit, as main.pageArgs() does"""
+        limit = self.int_arg('limit', main.API_PAGE_SIZE)
+        return (self.int_arg('after_id'),
+                max(1, min(limit, main.API_MAX_PAGE_SIZE)))
+
+    def next_url(self, last_id, limit):
+        """Returns the URL of the page after last_id"""
+        return '%s%s?%s' % (self.root_path, self.path,
+                            urlencode([('after_id', last_id),
+                                       ('limit', limit)]))
+
+    def is_fresh(self, etag, last_modified):
+        """True if the client's copy is current, as in main.conditional()"""
+        if 'if-none-match' in self.headers:
+            return parse_etags(self.headers['if-none-match']).contains(etag)
+        since = parse_date(self.headers.get('if-modified-since'))
+        return (last_modified is not None and since is not None and
+                since.replace(tzinfo=None) >=
+                last_modified.replace(microsecond=0))
+
+
+class CatalogASGI(object):
+    """The ASGI application: JSON routes on the loop, the rest in Flask"""
+
+    # Path patterns of the JSON routes, with the rule /metrics labels
+    # them by and the method that answers them
+    ROUTES = [
+        (re.compile(r'/category/JSON\Z'), '/category/JSON', 'categories'),
+        (re.compile(r'/category/(\d+)/JSON\Z'),
+         '/category/<int:category_id>/JSON', 'category'),
+        (re.compile(r'/category/(\d+)/items/json\Z'),
+         '/category/<int:category_id>/items/json', 'items'),
+    ]
+
+    def __init__(self, config=Config):
+        self.config = config
+        self.flask_app = main.create_app(config)
+        self.wsgi = WSGIBridge(self.flask_app, config.ASGI_WSGI_THREADS)
+        self.engine = make_async_engine(config)
+        self._slots = None
+        self.native = not config.API_SNAPSHOT
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        if self.native and scope['method'] in ('GET', 'HEAD'):
+            for pattern, rule, name in self.ROUTES:
+                match = pattern.match(scope['path'])
+                if match:
+                    return await self.respond(
+                        scope, send, rule, getattr(self, name),
+                        *[int(arg) for arg in match.groups()])
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                self.wsgi.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def db_slots(self):
+        """Returns the semaphore bounding database use; it is made on
+        first use, so it belongs to the server's event loop.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.config.ASGI_DB_CONCURRENCY)
+        return self._slots
+
+    async def respond(self, scope, send, rule, handler, *args):
+        """Runs handler(request, db, *args) and sends what it returns: a
+        status, headers and body, which is bytes or an async iterator of
+        bytes.
+        """
+        started = time.time()
+        request = Request(scope)
+        async with self.db_slots():
+            async with AsyncSession(self.engine) as db:
+                status, headers, body = await handler(request, db, *args)
+                if isinstance(body, bytes):
+                    headers.append((b'content-length',
+                                    str(len(body)).encode('ascii')))
+                await send({'type': 'http.response.start',
+                            'status': status, 'headers': headers})
+                if request.method == 'HEAD':
+                    body = b''
+                if isinstance(body, bytes):
+                    await send({'type': 'http.response.body', 'body': body})
+                else:
+                    async for chunk in body:
+                        await send({'type': 'http.response.body',
+                                    'body': chunk, 'more_body': True})
+                    await send({'type': 'http.response.body'})
+        instrumentation.request_seconds.observe(
+            time.time() - started, rule, request.method, str(status))
+
+    def conditional(self, request, validators, last_modified):
+        """Returns 304 and the validator headers if the client's copy is
+        current; otherwise None and those headers. As main.apiConditional()
+        does, the negotiated type counts as a validator.
+        """
+        if request.mimetype != serializers.JSON:
+            validators = (request.mimetype,) + tuple(validators)
+        full_path = '%s?%s' % (request.path, request.query_string)
+        etag = hashlib.sha1(repr((full_path,) + tuple(validators))
+                            .encode('utf-8')).hexdigest()
+        headers = [(b'etag', quote_etag(etag).encode('latin-1')),
+                   (b'cache-control', b'private, no-cache'),
+                   (b'vary', b'Accept')]
+        if last_modified is not None:
+            headers.append((b'last-modified',
+                            http_date(last_modified).encode('latin-1')))
+        return (304 if request.is_fresh(etag, last_modified) else None,
+                headers)
+
+    async def listing(self, request, db, key, model, query, id_column):
+        """Returns one page of query's rows as main.jsonPage() does, or
+        all of them as main.jsonStream() does with ?stream=.
+
+        Args:
+            request: the Request
+            db: AsyncSession to read with
+            key: name of the list in the response
+            model: model whose serialized_fields query selects
+            query: serializers.select_fields() query, filtered
+            id_column: model's id column, which pages follow
+        """
+        if 'stream' in request.args:
+            ndjson = request.args['stream'] == 'ndjson'
+            result = await db.stream(query.order_by(id_column))
+            return (NDJSON_HEADERS if ndjson else JSON_HEADERS,
+                    self.stream(key, model, result, ndjson))
+        after_id, limit = request.page_args()
+        if after_id is not None:
+            query = query.where(id_column > after_id)
+        query = query.order_by(id_column).limit(limit)
+        rows = serializers.rows(model, await db.execute(query))
+        next_url = None
+        if len(rows) == limit:
+            next_url = request.next_url(rows[-1][id_column.key], limit)
+        return self.content_headers(request), serializers.encode(
+            {key: rows, 'next': next_url}, request.mimetype)
+
+    def content_headers(self, request):
+        """Returns the Content-Type header for the negotiated type"""
+        return [(b'content-type', request.mimetype.encode('ascii'))]
+
+    async def stream(self, key, model, result, ndjson):
+        """Yields the rows of an async result as JSON, a batch at a time"""
+        if not ndjson:
+            yield ('{"%s":[' % key).encode('ascii')
+        first = True
+        dumps = serializers.dumps
+        async for batch in result.partitions(main.API_STREAM_BATCH):
+            encoded = [dumps(row) for row in serializers.rows(model, batch)]
+            if ndjson:
+                yield b''.join(row + b'\n' for row in encoded)
+            else:
+                yield (b'' if first else b',') + b','.join(encoded)
+            first = False
+        if not ndjson:
+            yield b']}'
+
+    async def categories(self, request, db):
+        """main.categoryAllJSON()"""
+        count, updated_at = (await db.execute(select(
+            func.count(Category.category_id),
+            func.max(Category.updated_at)))).one()
+        status, headers = self.conditional(request, (count, updated_at),
+                                           updated_at)
+        if status:
+            return status, headers, b''
+        content_headers, body = await self.listing(
+            request, db, 'categories', Category,
+            serializers.select_fields(Category), Category.category_id)
+        return 200, headers + content_headers, body
+
+    async def category(self, request, db, category_id):
+        """main.categoryJSON()"""
+        category = await db.get(Category, category_id)
+        if category is None:
+            error = NotFound()
+            headers = [(name.lower().encode('latin-1'),
+                        value.encode('latin-1'))
+                       for name, value in error.get_headers()]
+            return 404, headers, error.get_body().encode('utf-8')
+        status, headers = self.conditional(
+            request, (category.updated_at,), category.updated_at)
+        if status:
+            return status, headers, b''
+        body = serializers.encode({'category': category.serialize},
+                                  request.mimetype)
+        return 200, headers + self.content_headers(request), body
+
+    async def items(self, request, db, category_id):
+        """main.itemJSON()"""
+        # Item changes touch their category, so its stamp covers the items
+        updated_at = await db.scalar(
+            select(Category.updated_at).filter_by(category_id=category_id))
+        status, headers = self.conditional(request, (updated_at,),
+                                           updated_at)
+        if status:
+            return status, headers, b''
+        content_headers, body = await self.listing(
+            request, db, 'items', Item, serializers.select_fields(Item).where(
+                Item.category_id == category_id), Item.item_id)
+        return 200, headers + content_headers, body
+
+
+class WSGIBridge(object):
+    """Runs a WSGI app for ASGI requests, each on one thread of a pool.
+
+    A whole request, body iteration and close included, stays on the
+    thread that started it, as the thread-scoped database session needs;
+    the response is handed to the loop chunk by chunk.
+    """
+
+    def __init__(self, app, threads):
+        self.app = app
+        self.executor = ThreadPoolExecutor(threads,
+                                           thread_name_prefix='wsgi')
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    async def __call__(self, scope, receive, send):
+        body = BytesIO()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        body.seek(0)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.run, scope, body,
+                                   send, loop)
+
+    def run(self, scope, body, send, loop):
+        """Calls the app on this pool thread, sending its response"""
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response and response[0] is None:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response[:] = [int(status.split(' ', 1)[0]), [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers]]
+
+        def start():
+            emit({'type': 'http.response.start', 'status': response[0],
+                  'headers': response[1]})
+            response[0] = None  # sent
+
+        chunks = self.app(environ(scope, body), start_response)
+        try:
+            for chunk in chunks:
+                if chunk:
+                    if response[0] is not None:
+                        start()
+                    emit({'type': 'http.response.body', 'body': chunk,
+                          'more_body': True})
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        if response[0] is not None:
+            start()
+        emit({'type': 'http.response.body'})
+
+
+def environ(scope, body):
+    """Returns the WSGI environ for an ASGI HTTP scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    result = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8')
+        .decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope['http_version'],
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        if name in result:
+            value = result[name] + ',' + value
+        result[name] = value
+    return result
+
+
+def create_app(config=Config):
+    """Returns the catalog as an ASGI application
+
+    Arg:
+        config: settings object, such as config.Config or a subclass
+    """
+    return CatalogASGI(config)
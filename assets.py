@@ -0,0 +1,206 @@
+"""Built, fingerprinted and precompressed static assets.
+
+'python manage.py build-assets' minifies and bundles the stylesheets the
+templates use, copies the images they reference, and writes each file to
+static/dist under a name carrying a hash of its contents, with .gz (and,
+if the brotli package is installed, .br) siblings for text files. A
+manifest.json maps each logical name to its built file.
+
+Templates ask for assets by logical name through asset_url() and
+asset_urls(). Once a manifest exists those resolve to /assets/<built name>,
+served precompressed with year-long immutable caching - the name changes
+whenever the content does. Without a build they fall back to the source
+files under /static, so development needs no build step.
+"""
+from __future__ import print_function
+
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+
+from flask import Blueprint, abort, current_app, request, send_file, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Logical name: the files under static/ it is built from, in order
+BUNDLES = {
+    'css/site.css': ['css/bootstrap.min.css', 'css/styles.css'],
+    'img/udacity.svg': ['img/udacity.svg'],
+    'img/sm_trash_can.png': ['img/sm_trash_can.png'],
+}
+
+# Extensions worth precompressing; images other than SVG already are
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json')
+
+# File suffix of each precompressed variant
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+ONE_YEAR = 365 * 24 * 3600
+
+assets = Blueprint('assets', __name__)
+
+
+def minify_css(css):
+    """Strips comments (except /*! licences) and needless whitespace"""
+    parts = re.split(r'(/\*!.*?\*/)', css, flags=re.S)
+    for i in range(0, len(parts), 2):
+        rules = re.sub(r'/\*.*?\*/', '', parts[i], flags=re.S)
+        rules = re.sub(r'\s+', ' ', rules)
+        rules = re.sub(r'\s*([{};,>])\s*', r'\1', rules)
+        rules = re.sub(r':\s+', ':', rules)
+        parts[i] = rules.replace(';}', '}').strip()
+    return ''.join(parts)
+
+
+def bundle_css(sources):
+    """Joins stylesheets into one, minified. @import rules only work at the
+    top of a stylesheet, so those of every source are moved there.
+    """
+    imports = []
+    bodies = []
+    for source in sources:
+        imports.extend(re.findall(r'@import[^;]+;', source))
+        bodies.append(re.sub(r'@import[^;]+;', '', source))
+    return minify_css('\n'.join(imports + bodies))
+
+
+def fingerprint(name, content):
+    """Returns name with a hash of content before its extension"""
+    root, ext = os.path.splitext(name)
+    return '%s.%s%s' % (root, hashlib.sha1(content).hexdigest()[:10], ext)
+
+
+def _write(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def _gzip(content):
+    """Returns content gzipped reproducibly (no timestamp)"""
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9,
+                       mtime=0) as f:
+        f.write(content)
+    return buf.getvalue()
+
+
+def build(static_dir, out_dir, bundles=BUNDLES):
+    """Builds every bundle into out_dir and writes its manifest.json.
+
+    Built files from earlier builds are left in place, so pages rendered
+    before a deploy can still load the assets they name.
+
+    Args:
+        static_dir: directory the bundle sources are relative to
+        out_dir: directory to write the built files to
+        bundles: logical name -> list of source paths
+
+    Returns:
+        the manifest, as a dict
+    """
+    manifest = {'assets': {}, 'encodings': {}}
+    for name in sorted(bundles):
+        sources = []
+        for source in bundles[name]:
+            with open(os.path.join(static_dir, source), 'rb') as f:
+                sources.append(f.read())
+        if name.endswith('.css'):
+            content = bundle_css([s.decode('utf-8') for s in sources])
+            content = content.encode('utf-8')
+        else:
+            content = b''.join(sources)
+        built = fingerprint(name, content)
+        path = os.path.join(out_dir, built)
+        _write(path, content)
+        encodings = []
+        if built.endswith(COMPRESSIBLE):
+            if brotli is not None:
+                _write(path + SUFFIXES['br'], brotli.compress(content))
+                encodings.append('br')
+            _write(path + SUFFIXES['gzip'], _gzip(content))
+            encodings.append('gzip')
+        manifest['assets'][name] = built
+        manifest['encodings'][built] = encodings
+    # Swap the manifest in whole, so a running app never reads half of it
+    temp = os.path.join(out_dir, 'manifest.json.tmp')
+    body = json.dumps(manifest, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+    _write(temp, body.encode('utf-8'))
+    os.rename(temp, os.path.join(out_dir, 'manifest.json'))
+    return manifest
+
+
+def load_manifest(out_dir):
+    """Returns the manifest in out_dir; an empty one if none was built"""
+    try:
+        with open(os.path.join(out_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except IOError:
+        return {'assets': {}, 'encodings': {}}
+
+
+def _state():
+    return current_app.extensions['assets']
+
+
+def asset_url(name):
+    """Returns the URL of the asset with logical name name"""
+    return asset_urls(name)[0]
+
+
+def asset_urls(name):
+    """Returns the URLs to load for logical name name - the built bundle,
+    or its sources if it has not been built.
+    """
+    built = _state()['manifest']['assets'].get(name)
+    if built is not None:
+        return [url_for('assets.asset', filename=built)]
+    return [url_for('static', filename=source)
+            for source in BUNDLES.get(name, [name])]
+
+
+@assets.route('/assets/<path:filename>')
+def asset(filename):
+    """Serves a built asset, precompressed if the client accepts it"""
+    state = _state()
+    encodings = state['manifest']['encodings'].get(filename)
+    if encodings is None:
+        abort(404)
+    path = os.path.join(state['directory'], filename)
+    encoding = None
+    for candidate in encodings:
+        if request.accept_encodings[candidate]:
+            encoding = candidate
+            path += SUFFIXES[candidate]
+            break
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0],
+                         conditional=True)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    if encodings:
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = ('public, max-age=%d, immutable'
+                                         % ONE_YEAR)
+    # Flask 1.x adds its default Expires; Cache-Control says it all
+    response.headers.pop('Expires', None)
+    return response
+
+
+def init_app(app):
+    """Loads the manifest and adds the asset route and template helpers"""
+    directory = os.path.join(app.root_path, app.config['ASSETS_DIR'])
+    app.extensions['assets'] = {'directory': directory,
+                                'manifest': load_manifest(directory)}
+    app.register_blueprint(assets)
+    app.add_template_global(asset_url)
+    app.add_template_global(asset_urls)
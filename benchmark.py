@@ -0,0 +1,740 @@
+"""Benchmarks and load tests for the item catalog, run against a scratch
+database.
+
+Usage:
+    python benchmark.py micro [--save base.json | --compare base.json]
+    python benchmark.py render [--categories 500] [--items 20000]
+    python benchmark.py load [--requests 2000] [--threads 8]
+                             [--save base.json | --compare base.json]
+    python benchmark.py writes [--requests 2000] [--threads 16]
+    python benchmark.py asgi [--requests 20000] [--connections 1000]
+    python benchmark.py serialize [--items 100000]
+    python benchmark.py indexes [--rows 10000 100000 1000000]
+    python benchmark.py delete [--items 10000]
+    python benchmark.py search [--items 1000000]
+    python benchmark.py startup [--source ../older-checkout]
+
+Each run builds its own SQLite database in a temporary directory and fills
+it with synthetic users, categories and items (--users, --categories,
+--items, --seed). Routes behind login_required are driven by a fake login
+that fills login_session directly, so no sign in provider is needed.
+
+micro times model and serialization calls; render times one page of every
+category and item; load drives the main routes from concurrent clients
+and reports latency percentiles and throughput; writes does the same for
+item edits alone, first committed one by one and then through the write
+queue. asgi compares the JSON API served by the Flask app, a thread per
+connection, with asgi.py on an event loop (Python 3 only; needs uvicorn,
+aiosqlite and SQLAlchemy 1.4). serialize times building and encoding the
+item list of one large category, by each path and encoder available.
+indexes times User.by_email, Category.by_user and Item.by_category_id
+with as many users, categories and items as each --rows, before and after
+dropping the indexes migrations.py adds. delete times deleting a category
+of --items items, committing after each item as categoryDelete once did
+and with Category.delete. search times pages of full-text search results,
+a LIKE scan like the one search falls back to without FTS5, and
+rebuilding the index. startup times importing main and create_app() in
+new interpreters, from this checkout or from --source, so that an older
+one can be compared. --snapshot and --write-queue turn those features on.
+--save writes the results as a baseline, and --compare reports the change
+from one, exiting with status 1 if any result is more than --tolerance
+slower.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from flask import render_template_string
+from sqlalchemy import text
+
+import migrations
+import search
+import serializers
+import snapshot
+import write_queue
+from config import Config
+from database_setup import (User, Category, Item, session, get_engine,
+                            init_db)
+from fragment_cache import fragment_cache
+
+# Every category with all of its items, as one page
+RENDER_PAGE = """{% extends "/base.html" %}
+{% from "/macros.html" import category_section %}
+{% block content %}
+  {% for category in categories %}
+    {% call cached('category', category.category_id, category.updated_at,
+                   True) %}
+      {{- category_section(category, True) -}}
+    {% endcall %}
+  {% endfor %}
+{% endblock %}"""
+
+# Dropped by the indexes benchmark to time the lookups without them; see
+# migrations._add_lookup_indexes()
+LOOKUP_INDEXES = ['ix_user_email', 'ix_category_user_id_name',
+                  'ix_item_category_id_name']
+
+# Search benchmark queries, with the offset of the page to fetch. Every
+# description holds 'details'; the words are prefixes, so '12345' also
+# matches items 123450 to 123459.
+SEARCH_QUERIES = [
+    ('one item', u'item 123456', 0),
+    ('a few items', u'12345', 0),
+    ('every item', u'details', 0),
+    ('every item, page 50', u'details', 980),
+]
+
+# Run by the startup benchmark in a new interpreter; prints the seconds
+# spent importing main and in create_app(), which older checkouts, set up
+# at import, do not have
+STARTUP_SCRIPT = '''
+import json, time
+started = time.time()
+import main
+imported = time.time()
+if hasattr(main, 'create_app'):
+    main.create_app()
+print(json.dumps([imported - started, time.time() - imported]))
+'''
+STARTUP_PHASES = ['import main', 'create_app', 'whole process']
+
+# Share of load test requests going to each scenario
+SCENARIOS = [
+    ('home', 30),
+    ('category', 30),
+    ('categories_json', 10),
+    ('items_json', 15),
+    ('category_json', 10),
+    ('item_edit', 5),
+]
+
+
+def scratch_config(directory, api_snapshot=False, write_queue=False):
+    """Returns settings for a scratch database in directory"""
+    class ScratchConfig(Config):
+        DATABASE_URL = 'sqlite:///' + os.path.join(directory, 'bench.db')
+        TEMPLATE_CACHE_DIR = directory
+        IMAGE_DIR = os.path.join(directory, 'media')
+        API_SNAPSHOT = api_snapshot
+        WRITE_QUEUE = write_queue
+        SERVER_TIMING = False
+        # Seeding is slow by design; keep it out of the logs
+        SLOW_QUERY_MS = SLOW_REQUEST_MS = float('inf')
+
+    return ScratchConfig
+
+
+def scratch_app(directory, api_snapshot=False, write_queue=False,
+                config=None):
+    """Returns the catalog app, bound to a new database in directory, with
+    config if given, else scratch_config()
+    """
+    import main
+    app = main.create_app(config or scratch_config(directory, api_snapshot,
+                                                   write_queue))
+    init_db()
+    migrations.upgrade()
+    return app
+
+
+def seed(users, categories, items):
+    """Adds users users, categories categories shared out between them,
+    and items items spread evenly over the categories. Descriptions run to
+    two lines.
+
+    Returns:
+        list of the users' ids
+    """
+    session.bulk_insert_mappings(User, [
+        {'user_id': n, 'user_name': 'Benchmark User %d' % n,
+         'email': 'user%d@example.com' % n}
+        for n in range(1, users + 1)])
+    session.bulk_insert_mappings(Category, [
+        {'category_id': n, 'category_name': 'Category %04d' % n,
+         'user_id': n % users + 1}
+        for n in range(1, categories + 1)])
+    session.bulk_insert_mappings(Item, [
+        {'item_id': n, 'item_name': 'Item %d' % n,
+         'item_description': 'Description of item %d\nand its details' % n,
+         'category_id': n % categories + 1,
+         'user_id': (n % categories + 1) % users + 1}
+        for n in range(1, items + 1)])
+    # Bulk inserts skip the write methods that keep these columns
+    Category.repair_summaries(session)
+    session.commit()
+    return list(range(1, users + 1))
+
+
+def login(client, user):
+    """Signs client in as user, as gconnect would, without the provider"""
+    with client.session_transaction() as login_session:
+        login_session['user_id'] = user.user_id
+        login_session['email'] = user.email
+        login_session['username'] = user.user_name
+
+
+def timed(function, repeat):
+    """Calls function repeat times; returns the duration of each call"""
+    samples = []
+    for _ in range(repeat):
+        started = time.time()
+        function()
+        samples.append(time.time() - started)
+    return samples
+
+
+def percentile(ordered, point):
+    """Returns the point'th percentile of the sorted list ordered"""
+    return ordered[min(len(ordered) - 1, int(len(ordered) * point / 100.0))]
+
+
+def summarize(samples):
+    """Returns best, median and worst of samples, in milliseconds"""
+    ordered = sorted(samples)
+    return {'best': ordered[0] * 1000,
+            'median': percentile(ordered, 50) * 1000,
+            'worst': ordered[-1] * 1000}
+
+
+def report(name, result):
+    print('%-28s best %8.2f  median %8.2f  worst %8.2f ms'
+          % (name, result['best'], result['median'], result['worst']))
+
+
+class Scratch(object):
+    """Context manager: a seeded scratch database and the app bound to it"""
+
+    def __init__(self, args):
+        self.args = args
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = scratch_app(self.directory, self.args.snapshot,
+                               self.args.write_queue)
+        started = time.time()
+        self.user_ids = seed(self.args.users, self.args.categories,
+                             self.args.items)
+        print('%d users, %d categories, %d items (seeded in %.1fs)'
+              % (self.args.users, self.args.categories, self.args.items,
+                 time.time() - started))
+        return self
+
+    def __exit__(self, *exc_info):
+        session.remove()
+        shutil.rmtree(self.directory)
+
+
+def bench_micro(args):
+    """Times the model queries, JSON serialization and view building"""
+    results = {}
+    rng = random.Random(args.seed)
+    with Scratch(args) as scratch:
+        with scratch.app.test_request_context('/'):
+            user_ids = scratch.user_ids
+
+            def run(name, function):
+                # Fresh objects each call, as in a request
+                def call():
+                    session.expire_all()
+                    function()
+                results[name] = summarize(timed(call, args.repeat))
+                report(name, results[name])
+
+            def category_id():
+                return rng.randint(1, args.categories)
+
+            run('Category.by_user',
+                lambda: Category.by_user(rng.choice(user_ids)))
+            run('Item.by_category_id',
+                lambda: Item.by_category_id(category_id()))
+            run('Category.page JSON (all)',
+                lambda: serializers.dumps(Category.page(
+                    None, args.categories)))
+            run('Item.serialize (category)',
+                lambda: json.dumps([i.serialize for i in
+                                    Item.by_category_id(category_id())]))
+            run('Item.page JSON (category)',
+                lambda: serializers.dumps(Item.page_by_category_id(
+                    category_id(), None, args.items)))
+            snap = snapshot.Snapshot()
+            snap.refresh()
+            run('Snapshot categories (all)',
+                lambda: b','.join(snap.categories()[1]))
+            run('Snapshot items (category)',
+                lambda: b','.join(snap.items(category_id())[1]))
+            run('Category.view (user page)',
+                lambda: [c.view() for c in Category.page_by_user(
+                    rng.choice(user_ids))])
+            run('Category.view with items',
+                lambda: Category.page_by_id(category_id()).view(True))
+    return results
+
+
+def bench_render(args):
+    """Times loading and rendering a page of every category and item of
+    the first user (by default the only one).
+    """
+    results = {}
+    with Scratch(args) as scratch:
+        with scratch.app.test_request_context('/'):
+            def load():
+                session.expire_all()
+                return [category.view(with_items=True) for category in
+                        Category.page_by_user(scratch.user_ids[0], True)]
+
+            def render():
+                return render_template_string(RENDER_PAGE,
+                                              categories=views,
+                                              user_curr=None)
+
+            def render_cold():
+                fragment_cache.backend.clear()
+                return render()
+
+            # Room for every fragment on the page
+            fragment_cache.backend.max_entries = args.categories * 2
+            views = load()
+            print('%.1f MB page' % (len(render_cold().encode('utf-8')) / 1e6))
+            for name, function in [('query and build views', load),
+                                   ('render, cold cache', render_cold),
+                                   ('render, warm cache', render)]:
+                results[name] = summarize(timed(function, args.repeat))
+                report(name, results[name])
+    return results
+
+
+def bench_serialize(args):
+    """Times building the item list of one category, from ORM instances
+    and from Core rows, and encoding it with each encoder installed.
+    """
+    results = {}
+    with Scratch(args) as scratch:
+        with scratch.app.test_request_context('/'):
+            category_id = 1
+
+            def run(name, function):
+                results[name] = summarize(timed(function, args.repeat))
+                report(name, results[name])
+
+            def orm_rows():
+                session.expire_all()
+                return [item.serialize
+                        for item in Item.by_category_id(category_id)]
+
+            def core_rows():
+                return Item.page_by_category_id(category_id, None,
+                                                args.items)
+
+            items = core_rows()
+            print('%d items in category %d' % (len(items), category_id))
+            run('ORM rows + json (before)',
+                lambda: json.dumps({'items': orm_rows()}))
+            run('ORM rows', orm_rows)
+            run('Core rows', core_rows)
+            encoders = [('json module', serializers.json_dumps)]
+            if serializers.orjson is not None:
+                encoders.append(('orjson', serializers.dumps))
+            if serializers.msgpack is not None:
+                encoders.append(('msgpack', serializers.packb))
+            for name, encode in encoders:
+                print('%s: %.1f MB' % (
+                    name, len(encode({'items': items})) / 1e6))
+                run(name, lambda: encode({'items': items}))
+            run('Core rows + dumps (after)',
+                lambda: serializers.dumps({'items': core_rows()}))
+    return results
+
+
+class LoadDriver(object):
+    """Sends requests requests, from threads clients at once, spread over
+    scenarios. Each client is signed in as a random user and only edits
+    that user's items.
+    """
+
+    def __init__(self, app, user_ids, requests, threads, seed,
+                 scenarios=SCENARIOS):
+        self.app = app
+        self.user_ids = user_ids
+        self.remaining = requests
+        self.threads = threads
+        self.seed = seed
+        self.scenarios = scenarios
+        self.samples = dict((name, []) for name, _ in scenarios)
+        self.errors = dict((name, 0) for name, _ in scenarios)
+        self._lock = threading.Lock()
+
+    def run(self):
+        """Returns the wall clock time taken by all the requests"""
+        workers = [threading.Thread(target=self._client, args=(n,))
+                   for n in range(self.threads)]
+        started = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.time() - started
+
+    def _client(self, number):
+        rng = random.Random(self.seed + number)
+        client = self.app.test_client()
+        with self.app.app_context():
+            user = session.query(User).get(rng.choice(self.user_ids))
+            login(client, user)
+            categories = [c.category_id for c in Category.by_user(
+                user.user_id)]
+            items = session.query(Item.item_id, Item.category_id) \
+                .filter_by(user_id=user.user_id).limit(100).all()
+            session.remove()
+        names = [name for name, weight in self.scenarios
+                 for _ in range(weight)]
+        while True:
+            with self._lock:
+                if self.remaining <= 0:
+                    return
+                self.remaining -= 1
+            name = rng.choice(names)
+            started = time.time()
+            response = self._request(client, name, rng, categories, items)
+            elapsed = time.time() - started
+            with self._lock:
+                self.samples[name].append(elapsed)
+                if response.status_code >= 400:
+                    self.errors[name] += 1
+
+    def _request(self, client, name, rng, categories, items):
+        category_id = rng.choice(categories) if categories else 1
+        if name == 'home':
+            return client.get('/')
+        if name == 'category':
+            return client.get('/category/%d' % category_id)
+        if name == 'categories_json':
+            return client.get('/category/JSON')
+        if name == 'items_json':
+            return client.get('/category/%d/items/json' % category_id)
+        if name == 'category_json':
+            return client.get('/category/%d/JSON' % category_id)
+        item_id, category_id = rng.choice(items)
+        return client.post('/item/%d/edit/' % item_id, data={
+            'submit': 'submit', 'category_id': str(category_id),
+            'name': 'Item %d' % item_id,
+            'description': 'Edited at %f' % time.time()})
+
+
+def load_results(driver, elapsed):
+    """Prints and returns the percentiles of each scenario driver ran"""
+    requests = sum(len(samples) for samples in driver.samples.values())
+    print('%d requests from %d clients in %.1fs (%.1f/s)'
+          % (requests, driver.threads, elapsed, requests / elapsed))
+    results = {}
+    for name, _ in driver.scenarios:
+        samples = sorted(driver.samples[name])
+        if not samples:
+            continue
+        result = dict(('p%d' % point, percentile(samples, point) * 1000)
+                      for point in (50, 95, 99))
+        result['count'] = len(samples)
+        result['errors'] = driver.errors[name]
+        results[name] = result
+        print('%-16s %5d requests  p50 %7.2f  p95 %7.2f  p99 %7.2f ms'
+              '%s' % (name, result['count'], result['p50'],
+                      result['p95'], result['p99'],
+                      '  (%d errors)' % result['errors']
+                      if result['errors'] else ''))
+    results['throughput'] = {'per_second': requests / elapsed}
+    return results
+
+
+def bench_load(args):
+    """Drives the routes concurrently; reports percentiles per scenario"""
+    with Scratch(args) as scratch:
+        driver = LoadDriver(scratch.app, scratch.user_ids, args.requests,
+                            args.threads, args.seed)
+        return load_results(driver, driver.run())
+
+
+def bench_writes(args):
+    """Drives item edits concurrently, with each write committed by its
+    own request and then through the write queue.
+    """
+    results = {}
+    for queued in (False, True):
+        args.write_queue = queued
+        label = 'write queue' if queued else 'direct'
+        print('%s:' % label)
+        with Scratch(args) as scratch:
+            driver = LoadDriver(scratch.app, scratch.user_ids,
+                                args.requests, args.threads, args.seed,
+                                [('item_edit', 1)])
+            for name, result in load_results(driver, driver.run()).items():
+                results['%s, %s' % (label, name)] = result
+            if queued:
+                totals = write_queue.batch_size.totals()
+                for (outcome,), (total, count) in sorted(totals.items()):
+                    print('%d %s batches, %.1f writes each'
+                          % (count, outcome, total / count))
+    return results
+
+
+def bench_asgi(args):
+    """Drives the JSON API over many connections, served by the threaded
+    server and then by asgi.py; see benchmark_asgi.py.
+    """
+    try:
+        import benchmark_asgi
+    except SyntaxError:
+        sys.exit('The asgi benchmark needs Python 3.7 or later')
+    return benchmark_asgi.run(args)
+
+
+def bench_indexes(args):
+    """Times the lookups every request makes, with --rows rows in each
+    table, first with the lookup indexes and then with them dropped.
+    """
+    results = {}
+    for rows in args.rows:
+        args.users = args.categories = args.items = rows
+        with Scratch(args) as scratch:
+            with scratch.app.test_request_context('/'):
+                rng = random.Random(args.seed)
+                lookups = [
+                    ('User.by_email', lambda: User.by_email(
+                        'user%d@example.com' % rng.randint(1, rows))),
+                    ('Category.by_user', lambda: Category.by_user(
+                        rng.randint(1, rows))),
+                    ('Item.by_category_id', lambda: Item.by_category_id(
+                        rng.randint(1, rows)))]
+                for label in ('indexed', 'no index'):
+                    if label == 'no index':
+                        for index in LOOKUP_INDEXES:
+                            session.execute(text('DROP INDEX %s' % index))
+                        session.commit()
+                    for name, function in lookups:
+                        name = '%s, %s' % (name, label)
+                        result = summarize(timed(function, args.repeat))
+                        results['%d rows, %s' % (rows, name)] = result
+                        report(name, result)
+    return results
+
+
+def bench_delete(args):
+    """Times deleting one category of --items items, an item per commit as
+    categoryDelete used to, and with Category.delete; each run deletes a
+    freshly seeded category.
+    """
+    def per_item(user_id):
+        for item in Item.by_category_id(1):
+            session.delete(item)
+            session.commit()
+        session.delete(Category.by_id(1))
+        session.commit()
+
+    def set_based(user_id):
+        assert Category.delete(1, user_id)
+
+    results = {}
+    args.users = args.categories = 1
+    for name, function in [('item per commit (before)', per_item),
+                           ('Category.delete (after)', set_based)]:
+        samples = []
+        for _ in range(args.repeat):
+            with Scratch(args) as scratch:
+                with scratch.app.test_request_context('/'):
+                    user_id = scratch.user_ids[0]
+                    samples.extend(timed(lambda: function(user_id), 1))
+        results[name] = summarize(samples)
+        report(name, results[name])
+    return results
+
+
+def bench_search(args):
+    """Times a page of search results for queries matching one, a few and
+    every item, and the fallback LIKE scan for comparison.
+    """
+    results = {}
+    with Scratch(args) as scratch:
+        with scratch.app.test_request_context('/'):
+            def run(name, function, repeat=args.repeat):
+                results[name] = summarize(timed(function, repeat))
+                report(name, results[name])
+
+            def rebuild():
+                with get_engine().begin() as connection:
+                    search.rebuild(connection)
+
+            for name, query, offset in SEARCH_QUERIES:
+                print('%s: %d results on the first page' % (
+                    name, len(search.search(query, 20, offset))))
+                run(name, lambda: search.search(query, 20, offset))
+            words = search.query_words(SEARCH_QUERIES[0][1])
+            run('LIKE scan, one item',
+                lambda: search._search_like(words, 20, 0), 3)
+            run('rebuild the index', rebuild, 1)
+    return results
+
+
+def bench_startup(args):
+    """Times starting the app in new interpreters - importing main, then
+    create_app() - from the checkout in --source, by default this one.
+    """
+    source = os.path.abspath(args.source)
+    path = [source] + [p for p in [os.environ.get('PYTHONPATH')] if p]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path))
+    directory = tempfile.mkdtemp()
+    try:
+        secrets = os.path.join(source, 'client_secrets.json')
+        if os.path.exists(secrets):
+            # Older checkouts read it at import, from the working directory
+            shutil.copy(secrets, directory)
+        samples = dict((name, []) for name in STARTUP_PHASES)
+        for _ in range(args.repeat):
+            started = time.time()
+            output = subprocess.check_output(
+                [sys.executable, '-c', STARTUP_SCRIPT], cwd=directory,
+                env=env)
+            samples['whole process'].append(time.time() - started)
+            phases = json.loads(output.decode('utf-8').splitlines()[-1])
+            samples['import main'].append(phases[0])
+            samples['create_app'].append(phases[1])
+    finally:
+        shutil.rmtree(directory)
+    results = {}
+    for name in STARTUP_PHASES:
+        results[name] = summarize(samples[name])
+        report(name, results[name])
+    return results
+
+
+# The figure compared against a baseline, and whether higher is better
+COMPARED = {'micro': ('median', False), 'render': ('median', False),
+            'load': ('p95', False), 'writes': ('p95', False),
+            'asgi': ('p95', False), 'serialize': ('median', False),
+            'indexes': ('median', False), 'delete': ('median', False),
+            'search': ('median', False), 'startup': ('median', False)}
+
+
+def compare(command, results, path, tolerance):
+    """Prints the change in each result since the baseline at path.
+
+    Returns:
+        True if nothing got worse by more than tolerance (a fraction)
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline.get('command') != command:
+        sys.exit('%s is a baseline for %r, not %r'
+                 % (path, baseline.get('command'), command))
+    passed = True
+    for name in sorted(results):
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        key, higher_is_better = COMPARED[command]
+        if key not in results[name]:
+            key, higher_is_better = 'per_second', True
+        before, after = old[key], results[name][key]
+        change = (after - before) / before if before else 0.0
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > tolerance:
+            flag = '  REGRESSION'
+            passed = False
+        print('%-28s %s %10.2f -> %10.2f  %+6.1f%%%s'
+              % (name, key, before, after, change * 100, flag))
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Item catalog benchmarks')
+    commands = parser.add_subparsers(dest='command')
+
+    def add_command(name, help, users, categories, items):
+        command = commands.add_parser(name, help=help)
+        command.add_argument('--users', type=int, default=users)
+        command.add_argument('--categories', type=int, default=categories)
+        command.add_argument('--items', type=int, default=items)
+        command.add_argument('--seed', type=int, default=1)
+        command.add_argument('--snapshot', action='store_true',
+                             help='serve the JSON API from the in-memory '
+                                  'snapshot')
+        command.add_argument('--write-queue', action='store_true',
+                             help='run writes through the write queue')
+        command.add_argument('--save', metavar='PATH',
+                             help='write the results as a baseline')
+        command.add_argument('--compare', metavar='PATH',
+                             help='compare the results with a baseline')
+        command.add_argument('--tolerance', type=float, default=0.25,
+                             help='slowdown allowed by --compare '
+                                  '(default 0.25, i.e. 25%%)')
+        return command
+
+    micro = add_command('micro', 'Time model and serialization calls',
+                        10, 500, 20000)
+    micro.add_argument('--repeat', type=int, default=200)
+    render = add_command('render', 'Time page rendering', 1, 500, 20000)
+    render.add_argument('--repeat', type=int, default=5)
+    load = add_command('load', 'Load test the main routes', 10, 500, 20000)
+    load.add_argument('--requests', type=int, default=2000)
+    load.add_argument('--threads', type=int, default=8)
+    writes = add_command('writes', 'Compare edit throughput with and '
+                         'without the write queue', 10, 500, 20000)
+    writes.add_argument('--requests', type=int, default=2000)
+    writes.add_argument('--threads', type=int, default=16)
+    asgi = add_command('asgi', 'Compare the JSON API served by threads and '
+                       'by asgi.py', 10, 500, 20000)
+    asgi.add_argument('--requests', type=int, default=20000)
+    asgi.add_argument('--connections', type=int, default=1000)
+    serialize = add_command('serialize', 'Time building and encoding a '
+                            'large item list', 1, 1, 100000)
+    serialize.add_argument('--repeat', type=int, default=5)
+    indexes = add_command('indexes', 'Time the lookups with and without '
+                          'their indexes', 0, 0, 0)
+    indexes.add_argument('--rows', type=int, nargs='+',
+                         default=[10000, 100000, 1000000],
+                         help='rows in each table, one run per size')
+    indexes.add_argument('--repeat', type=int, default=200)
+    delete = add_command('delete', 'Compare deleting a large category item '
+                         'by item and set based', 1, 1, 10000)
+    # Committing item by item takes minutes a run
+    delete.add_argument('--repeat', type=int, default=1)
+    search_command = add_command('search', 'Time full-text search', 10,
+                                 1000, 1000000)
+    search_command.add_argument('--repeat', type=int, default=20)
+    startup = add_command('startup', 'Time importing main and building the '
+                          'app', 0, 0, 0)
+    startup.add_argument('--source', default=os.path.dirname(
+        os.path.abspath(__file__)), help='checkout to time (default: this '
+                                         'one)')
+    startup.add_argument('--repeat', type=int, default=10)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig()
+    benchmarks = {'micro': bench_micro, 'render': bench_render,
+                  'load': bench_load, 'writes': bench_writes,
+                  'asgi': bench_asgi, 'serialize': bench_serialize,
+                  'indexes': bench_indexes, 'delete': bench_delete,
+                  'search': bench_search, 'startup': bench_startup}
+    if args.command not in benchmarks:
+        parser.print_help()
+        return
+    results = benchmarks[args.command](args)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'command': args.command, 'results': results}, f,
+                      indent=2, sort_keys=True, separators=(',', ': '))
+    if args.compare and not compare(args.command, results, args.compare,
+                                    args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
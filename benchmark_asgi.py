@@ -0,0 +1,175 @@
+"""The asgi command of benchmark.py (Python 3.7+ only).
+
+Serves the scratch database twice from a separate process - first the
+Flask app under the threaded server app.run uses, a thread per connection,
+then asgi.py under uvicorn - and drives the JSON API of each from
+--connections keep-alive connections at once, over a plain asyncio
+HTTP/1.1 client.
+"""
+import asyncio
+import logging
+import multiprocessing
+import random
+import socket
+import time
+
+from benchmark import SCENARIOS, Scratch, load_results, scratch_config
+from database_setup import get_engine
+
+# The routes asgi.py serves on the event loop
+JSON_SCENARIOS = [(name, weight) for name, weight in SCENARIOS
+                  if name.endswith('_json')]
+
+
+def serve(mode, directory, port, backlog):
+    """Serves the catalog on port until killed; runs in its own process"""
+    config = scratch_config(directory)
+    # No access logs from either server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    if mode == 'sync':
+        from werkzeug.serving import make_server
+        import main
+        server = make_server('127.0.0.1', port, main.create_app(config),
+                             threaded=True)
+        # Accept as many waiting connections as uvicorn would
+        server.socket.listen(backlog)
+        server.serve_forever()
+    else:
+        import uvicorn
+        import asgi
+        uvicorn.run(asgi.create_app(config), host='127.0.0.1', port=port,
+                    backlog=backlog, log_level='warning', access_log=False)
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+async def wait_for_server(port, timeout=60):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+        except OSError:
+            if time.time() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+        else:
+            writer.close()
+            return
+
+
+async def fetch(reader, writer, path):
+    """Sends a GET for path and reads the response.
+
+    Returns:
+        status code, and whether the connection can be used again
+    """
+    writer.write(('GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n'
+                  % path).encode('ascii'))
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+    lines = head.split('\r\n')
+    version, status = lines[0].split(' ', 2)[:2]
+    headers = dict(line.lower().split(': ', 1) for line in lines[1:]
+                   if line)
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    keep_alive = (version == 'HTTP/1.1' and
+                  headers.get('connection') != 'close')
+    return int(status), keep_alive
+
+
+class AsyncLoadDriver(object):
+    """Sends requests requests over connections connections at once,
+    spread over scenarios; shaped like benchmark.LoadDriver, so
+    load_results() can report it.
+    """
+
+    def __init__(self, port, categories, requests, connections, seed,
+                 scenarios=JSON_SCENARIOS):
+        self.port = port
+        self.categories = categories
+        self.remaining = requests
+        self.threads = connections
+        self.seed = seed
+        self.scenarios = scenarios
+        self.samples = dict((name, []) for name, _ in scenarios)
+        self.errors = dict((name, 0) for name, _ in scenarios)
+
+    def run(self):
+        """Returns the wall clock time taken by all the requests"""
+        return asyncio.run(self._run())
+
+    async def _run(self):
+        await wait_for_server(self.port)
+        started = time.time()
+        await asyncio.gather(*[self._client(n)
+                               for n in range(self.threads)])
+        return time.time() - started
+
+    async def _client(self, number):
+        rng = random.Random(self.seed + number)
+        names = [name for name, weight in self.scenarios
+                 for _ in range(weight)]
+        connection = None
+        while self.remaining > 0:
+            self.remaining -= 1
+            name = rng.choice(names)
+            path = self._path(name, rng.randint(1, self.categories))
+            started = time.time()
+            try:
+                if connection is None:
+                    connection = await asyncio.open_connection(
+                        '127.0.0.1', self.port)
+                status, keep_alive = await fetch(*connection, path=path)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                status, keep_alive = 599, False
+            self.samples[name].append(time.time() - started)
+            if status >= 400:
+                self.errors[name] += 1
+            if not keep_alive and connection is not None:
+                connection[1].close()
+                connection = None
+        if connection is not None:
+            connection[1].close()
+
+    def _path(self, name, category_id):
+        if name == 'categories_json':
+            return '/category/JSON'
+        if name == 'items_json':
+            return '/category/%d/items/json' % category_id
+        return '/category/%d/JSON' % category_id
+
+
+def run(args):
+    """Drives the JSON API through the sync and the ASGI server in turn"""
+    results = {}
+    with Scratch(args) as scratch:
+        # The servers open the database themselves
+        get_engine().dispose()
+        spawn = multiprocessing.get_context('spawn')
+        for mode in ('sync', 'asgi'):
+            print('%s:' % mode)
+            port = free_port()
+            server = spawn.Process(target=serve, args=(
+                mode, scratch.directory, port, args.connections))
+            server.start()
+            try:
+                driver = AsyncLoadDriver(port, args.categories,
+                                         args.requests, args.connections,
+                                         args.seed)
+                elapsed = driver.run()
+            finally:
+                server.terminate()
+                server.join()
+            for name, result in load_results(driver, elapsed).items():
+                results['%s, %s' % (mode, name)] = result
+    return results
@@ -0,0 +1,128 @@
+"""Settings for the item catalog, each overridable from the environment."""
+import os
+
+
+def _env(name, default, cast=str):
+    """Returns environment variable name, cast; else default"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return cast(value)
+
+
+def _flag(value):
+    """Reads '1', 'true', 'yes' and 'on' as True"""
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def _list(value):
+    """Reads a comma separated list, ignoring empty entries"""
+    return [entry.strip() for entry in value.split(',') if entry.strip()]
+
+
+# For development only; wsgi.py will not start with it
+DEV_SECRET_KEY = 'super_secret_key'
+
+
+class Config(object):
+    """Default configuration - values are read once, at import"""
+
+    # Flask
+    SECRET_KEY = _env('CATALOG_SECRET_KEY', DEV_SECRET_KEY)
+    # Largest request body accepted, which bounds image uploads
+    MAX_CONTENT_LENGTH = _env('CATALOG_MAX_UPLOAD_BYTES', 10 * 1024 * 1024,
+                              int)
+
+    # Database: any SQLAlchemy URL, e.g. postgresql://user:pw@host/catalog
+    # (needs psycopg2). Pool settings apply to every backend but SQLite.
+    DATABASE_URL = _env('CATALOG_DATABASE_URL', 'sqlite:///item_catalog.db')
+    DB_POOL_SIZE = _env('CATALOG_DB_POOL_SIZE', 5, int)
+    DB_MAX_OVERFLOW = _env('CATALOG_DB_MAX_OVERFLOW', 10, int)
+    DB_POOL_TIMEOUT = _env('CATALOG_DB_POOL_TIMEOUT', 30, float)
+    DB_POOL_RECYCLE = _env('CATALOG_DB_POOL_RECYCLE', 3600, int)
+    DB_POOL_PRE_PING = _env('CATALOG_DB_POOL_PRE_PING', False, _flag)
+    # Read replicas of DATABASE_URL. Pages and APIs read from one of them;
+    # writes, and a user's reads for DB_REPLICA_STICKY_SECONDS after their
+    # own writes, go to the primary.
+    DATABASE_REPLICA_URLS = _env('CATALOG_DATABASE_REPLICA_URLS', [], _list)
+    DB_REPLICA_STICKY_SECONDS = _env('CATALOG_DB_REPLICA_STICKY_SECONDS', 10,
+                                     float)
+    SQLITE_WAL = _env('CATALOG_SQLITE_WAL', True, _flag)
+
+    # Google sign in. The URLs can point at oauth_stub.py for offline tests;
+    # OAUTH_TOKEN_URI, if set, overrides the one in client_secrets.json.
+    CLIENT_SECRETS_FILE = _env('CATALOG_CLIENT_SECRETS', 'client_secrets.json')
+    OAUTH_API_URL = _env('CATALOG_OAUTH_API_URL',
+                         'https://www.googleapis.com')
+    OAUTH_ACCOUNTS_URL = _env('CATALOG_OAUTH_ACCOUNTS_URL',
+                              'https://accounts.google.com')
+    OAUTH_TOKEN_URI = _env('CATALOG_OAUTH_TOKEN_URI', None)
+    OAUTH_CONNECT_TIMEOUT = _env('CATALOG_OAUTH_CONNECT_TIMEOUT', 3.05, float)
+    OAUTH_READ_TIMEOUT = _env('CATALOG_OAUTH_READ_TIMEOUT', 10, float)
+    OAUTH_RETRIES = _env('CATALOG_OAUTH_RETRIES', 2, int)
+    OAUTH_POOL_SIZE = _env('CATALOG_OAUTH_POOL_SIZE', 10, int)
+    # Validated access tokens remembered per process, and for how long at most
+    TOKEN_CACHE_SIZE = _env('CATALOG_TOKEN_CACHE_SIZE', 10000, int)
+    TOKEN_CACHE_MAX_TTL = _env('CATALOG_TOKEN_CACHE_MAX_TTL', 3600, int)
+
+    # Rendered category/item fragments, per process
+    FRAGMENT_CACHE_SIZE = _env('CATALOG_FRAGMENT_CACHE_SIZE', 10000, int)
+    FRAGMENT_CACHE_TTL = _env('CATALOG_FRAGMENT_CACHE_TTL', 300, int)
+
+    # Serve the JSON API from an in-memory snapshot of the catalog (see
+    # snapshot.py); other processes' writes show within the check interval
+    API_SNAPSHOT = _env('CATALOG_API_SNAPSHOT', False, _flag)
+    API_SNAPSHOT_CHECK_INTERVAL = _env('CATALOG_API_SNAPSHOT_CHECK_INTERVAL',
+                                       5, float)
+
+    # Group commit: run the model write methods on one writer thread, up to
+    # WRITE_QUEUE_MAX_BATCH per transaction (see write_queue.py)
+    WRITE_QUEUE = _env('CATALOG_WRITE_QUEUE', False, _flag)
+    WRITE_QUEUE_MAX_BATCH = _env('CATALOG_WRITE_QUEUE_MAX_BATCH', 64, int)
+    WRITE_QUEUE_MAX_DELAY = _env('CATALOG_WRITE_QUEUE_MAX_DELAY', 0.0, float)
+    WRITE_QUEUE_TIMEOUT = _env('CATALOG_WRITE_QUEUE_TIMEOUT', 30, float)
+
+    # Serving with gunicorn (gunicorn.conf.py): WORKERS pre-forked processes
+    # (0 for two per CPU, plus one) of WORKER_THREADS threads each, each
+    # replaced after about WORKER_MAX_REQUESTS requests (0 for never)
+    BIND = _env('CATALOG_BIND', '0.0.0.0:5000')
+    WORKERS = _env('CATALOG_WORKERS', 0, int)
+    WORKER_THREADS = _env('CATALOG_WORKER_THREADS', 4, int)
+    WORKER_MAX_REQUESTS = _env('CATALOG_WORKER_MAX_REQUESTS', 10000, int)
+    WORKER_MAX_REQUESTS_JITTER = _env('CATALOG_WORKER_MAX_REQUESTS_JITTER',
+                                      1000, int)
+    # Seconds a silent worker lives, and a stopping one has to finish
+    WORKER_TIMEOUT = _env('CATALOG_WORKER_TIMEOUT', 60, int)
+    WORKER_GRACEFUL_TIMEOUT = _env('CATALOG_WORKER_GRACEFUL_TIMEOUT', 30, int)
+
+    # ASGI serving (asgi.py, Python 3): the JSON API runs on the event loop
+    # with at most ASGI_DB_CONCURRENCY queries at once, through an async
+    # driver for DATABASE_URL or ASGI_DATABASE_URL if set (e.g.
+    # sqlite+aiosqlite:///item_catalog.db); other routes run on the Flask
+    # app in ASGI_WSGI_THREADS threads
+    ASGI_DATABASE_URL = _env('CATALOG_ASGI_DATABASE_URL', '')
+    ASGI_DB_CONCURRENCY = _env('CATALOG_ASGI_DB_CONCURRENCY', 10, int)
+    ASGI_WSGI_THREADS = _env('CATALOG_ASGI_WSGI_THREADS', 32, int)
+
+    # Output of 'manage.py build-assets', relative to the app directory
+    ASSETS_DIR = _env('CATALOG_ASSETS_DIR', 'static/dist')
+
+    # Instrumentation: Server-Timing headers on every response, slow query
+    # and request logging, and a bearer token /metrics requires, if set
+    SERVER_TIMING = _env('CATALOG_SERVER_TIMING', True, _flag)
+    SLOW_QUERY_MS = _env('CATALOG_SLOW_QUERY_MS', 100, float)
+    SLOW_REQUEST_MS = _env('CATALOG_SLOW_REQUEST_MS', 1000, float)
+    METRICS_TOKEN = _env('CATALOG_METRICS_TOKEN', '')
+
+    # Compiled templates are kept here between runs; empty for the system
+    # temporary directory
+    TEMPLATE_CACHE_DIR = _env('CATALOG_TEMPLATE_CACHE_DIR', '')
+
+    # Item images: originals and resized variants live under IMAGE_DIR
+    # (relative to the app directory); variants are made by IMAGE_WORKERS
+    # threads per process and evicted past IMAGE_CACHE_MAX_BYTES
+    IMAGE_DIR = _env('CATALOG_IMAGE_DIR', 'media')
+    IMAGE_CACHE_MAX_BYTES = _env('CATALOG_IMAGE_CACHE_MAX_BYTES',
+                                 512 * 1024 * 1024, int)
+    IMAGE_WORKERS = _env('CATALOG_IMAGE_WORKERS', 2, int)
+    IMAGE_TIMEOUT = _env('CATALOG_IMAGE_TIMEOUT', 30, float)
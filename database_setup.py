@@ -1,21 +1,261 @@
 # Data imports
-from sqlalchemy import Column, ForeignKey, Integer, String
+import random
+import threading
+from datetime import datetime
+from functools import wraps
+
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String
+from sqlalchemy import and_, func, or_, select
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
 from sqlalchemy.orm import relationship
-from sqlalchemy import create_engine
+from sqlalchemy.orm import subqueryload
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.dml import UpdateBase
 
-# Rendering imports
-from flask import render_template
+import serializers
+from config import Config
 
 Base = declarative_base()
 
-# Connect to Database and create database session
-engine = create_engine('sqlite:///item_catalog.db')
-Base.metadata.bind = engine
 
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+def make_engine(url=Config.DATABASE_URL,
+                pool_size=Config.DB_POOL_SIZE,
+                max_overflow=Config.DB_MAX_OVERFLOW,
+                pool_recycle=Config.DB_POOL_RECYCLE,
+                sqlite_wal=Config.SQLITE_WAL,
+                pool_timeout=Config.DB_POOL_TIMEOUT,
+                pool_pre_ping=Config.DB_POOL_PRE_PING):
+    """Returns an engine for url, with pooling suited to the backend.
+
+    Args:
+        url: SQLAlchemy database URL
+        pool_size: connections kept open in the pool (not SQLite)
+        max_overflow: connections allowed beyond pool_size (not SQLite)
+        pool_recycle: seconds before a pooled connection is replaced
+        sqlite_wal: if True, SQLite databases use write-ahead logging so
+                    readers are not blocked by a writer
+        pool_timeout: seconds to wait for a free connection (not SQLite)
+        pool_pre_ping: if True, connections are tested as they leave the
+                       pool, so ones the server has dropped are replaced
+
+    Returns:
+        engine: SQLAlchemy engine
+    """
+    options = {'pool_recycle': pool_recycle, 'pool_pre_ping': pool_pre_ping}
+    is_sqlite = url.startswith('sqlite')
+    if is_sqlite:
+        # Connections are handed between request threads by the pool
+        options['connect_args'] = {'check_same_thread': False}
+    else:
+        options['pool_size'] = pool_size
+        options['max_overflow'] = max_overflow
+        options['pool_timeout'] = pool_timeout
+    engine = create_engine(url, **options)
+    if is_sqlite and sqlite_wal:
+        event.listen(engine, 'connect', _sqlite_wal)
+    return engine
+
+
+def _sqlite_wal(dbapi_connection, connection_record):
+    """Switches each new SQLite connection to write-ahead logging"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.close()
+
+
+# Functions called as listener(model, object_ids) after each change
+_change_listeners = []
+
+
+def on_change(listener):
+    """Calls listener(model, object_ids) whenever the write methods below
+    commit changes to objects of model ('category' or 'item').
+    """
+    _change_listeners.append(listener)
+
+
+# Batch state of write_queue's writer thread; see start_batch()
+_batch = threading.local()
+
+# The WriteQueue the write methods run on, if any; see use_write_queue()
+_write_queue = None
+
+
+class BatchAborted(Exception):
+    """A write method needed to roll back while running in a batch; the
+    batch is rolled back instead and its writes run one at a time.
+    """
+
+
+def use_write_queue(queue):
+    """Runs the write methods on queue's writer thread from now on, or in
+    the calling thread again if queue is None; see write_queue.py.
+    """
+    global _write_queue
+    _write_queue = queue
+
+
+def _queued(method):
+    """Marks a write method: it runs on the write queue, if one is in
+    use, and its caller waits for the result.
+    """
+    @wraps(method)
+    def run(cls, *args, **kwargs):
+        queue = _write_queue
+        if queue is None or queue.is_writer():
+            return method(cls, *args, **kwargs)
+        return queue.call(method, cls, args, kwargs)
+    return run
+
+
+def start_batch():
+    """Starts a batch on this thread: write methods flush rather than
+    commit, and hold back their change events, until end_batch().
+    """
+    _batch.changes = []
+
+
+def end_batch(committed):
+    """Ends this thread's batch, sending its held back change events if
+    the batch was committed.
+    """
+    changes, _batch.changes = _batch.changes, None
+    if committed:
+        for model, object_ids in changes:
+            _changed(model, *object_ids)
+
+
+def _in_batch():
+    return getattr(_batch, 'changes', None) is not None
+
+
+def _commit():
+    """Commits the session; within a batch, only flushes it"""
+    if _in_batch():
+        session.flush()
+    else:
+        session.commit()
+
+
+def _rollback():
+    """Rolls the session back; within a batch, aborts the batch"""
+    if _in_batch():
+        raise BatchAborted()
+    session.rollback()
+
+
+def _changed(model, *object_ids):
+    """Tells the change listeners about objects whose rows were just
+    committed. Within a batch the events are held until it commits.
+    """
+    if _in_batch():
+        _batch.changes.append((model, object_ids))
+        return
+    for listener in _change_listeners:
+        listener(model, object_ids)
+
+
+class RoutingSession(Session):
+    """Session that reads from a replica, when there are any, and writes
+    to the primary.
+
+    Each session keeps to one replica, so its reads agree with each other.
+    Setting info['primary'] before the first query sends its reads to the
+    primary too, as main.py does for requests that may write and for a
+    user who has just written. info['wrote'] is set once the session has
+    written anything.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        # SQLAlchemy 1.4 passes bind= and private keywords, even from a
+        # plain session.get_bind(); an explicit bind still wins
+        if kw.get('bind') is not None:
+            return super(RoutingSession, self).get_bind(mapper, clause, **kw)
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+            return get_engine()
+        if not replica_engines or self.info.get('primary'):
+            return get_engine()
+        replica = self.info.get('replica')
+        if replica is None:
+            replica = self.info['replica'] = random.choice(replica_engines)
+        return replica
+
+
+# Database connection. The engines are created from config.py on first use,
+# unless init_engine() has been called first, as create_app() does. session
+# is scoped to the current thread; main.py removes it when a request ends.
+engine = None
+replica_engines = []
+DBSession = sessionmaker(class_=RoutingSession)
+
+
+def init_engine(config=Config):
+    """Connects to config.DATABASE_URL and to each replica in
+    config.DATABASE_REPLICA_URLS, replacing any earlier engines.
+
+    Arg:
+        config: settings object, such as config.Config
+
+    Returns:
+        engine: the new primary engine, used by all sessions created from
+                now on
+    """
+    global engine, replica_engines
+    for old in [engine] + replica_engines:
+        if old is not None:
+            old.dispose()
+    made = [make_engine(url, config.DB_POOL_SIZE, config.DB_MAX_OVERFLOW,
+                        config.DB_POOL_RECYCLE, config.SQLITE_WAL,
+                        config.DB_POOL_TIMEOUT, config.DB_POOL_PRE_PING)
+            for url in [config.DATABASE_URL] + config.DATABASE_REPLICA_URLS]
+    engine, replica_engines = made[0], made[1:]
+    Base.metadata.bind = engine
+    DBSession.configure(bind=engine)
+    return engine
+
+
+def get_engine():
+    """Returns the primary engine, connecting with Config if there is none"""
+    return engine if engine is not None else init_engine()
+
+
+def engines():
+    """Returns the primary engine followed by any replica engines"""
+    return [get_engine()] + replica_engines
+
+
+def new_session(primary=False):
+    """Returns a session of its own, apart from the thread's scoped one;
+    the caller closes it.
+
+    Arg:
+        primary: if True, its reads go to the primary, not a replica
+    """
+    get_engine()
+    db = DBSession()
+    db.info['primary'] = primary
+    return db
+
+
+session = scoped_session(new_session)
+
+
+def dispose_engines():
+    """Closes every pooled connection, and this thread's session. A forked
+    worker calls it first, so it never shares a connection with its parent
+    or with the other workers.
+    """
+    session.remove()
+    for each in engines():
+        each.dispose()
+
+
+def init_db():
+    """Creates any missing tables; see also migrations.upgrade()"""
+    Base.metadata.create_all(get_engine())
 
 
 class User(Base):
@@ -24,10 +264,11 @@ class User(Base):
 
     user_id = Column(Integer, primary_key=True)
     user_name = Column(String(250), nullable=False)
-    email = Column(String(250), nullable=False)
+    email = Column(String(250), nullable=False, unique=True, index=True)
     picture = Column(String(250))
 
     @classmethod
+    @_queued
     def create(cls, login_session):
         """Creates User record, taking email from from the login_session
         created during oAuth 2 sequence.
@@ -40,7 +281,12 @@ class User(Base):
                           email=login_session['email'],
                           picture=login_session['picture'])
             session.add(newUser)
-            session.commit()
+            try:
+                _commit()
+            except IntegrityError:
+                # Another request created the user first
+                _rollback()
+                return cls.by_email(login_session['email'])
             return newUser
 
     @classmethod
@@ -67,25 +313,49 @@ class User(Base):
             return None
 
 
+def _user_name(user_id):
+    """SQL expression for the name of user_id, or '' if there is none;
+    computed by the database as the row is written.
+    """
+    return func.coalesce(select([User.user_name]).where(
+        User.user_id == user_id).as_scalar(), '')
+
+
 class Category(Base):
     """Category table - sqlAlchemy linked with SQLite3 back end"""
     __tablename__ = 'category'
+    __table_args__ = (
+        Index('ix_category_user_id_name', 'user_id', 'category_name'),
+    )
 
     category_id = Column(Integer, primary_key=True)
     category_name = Column(String(250), nullable=False)
     user_id = Column(Integer, ForeignKey('user.user_id'))
+    # Bumped by any change to the category or to its items
+    updated_at = Column(DateTime, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
+    # Kept by the write methods, so listings need no join or count; see
+    # summary_errors() and repair_summaries()
+    item_count = Column(Integer, nullable=False, default=0,
+                        server_default='0')
+    owner_name = Column(String(250), nullable=False, default='',
+                        server_default='')
     user = relationship(User)
+    items = relationship("Item", back_populates="category",
+                         order_by="Item.item_name",
+                         cascade="all, delete-orphan", passive_deletes=True)
+
+    # Columns the JSON API shows; see serialize and serializers.py
+    serialized_fields = ('category_name', 'category_id', 'user_id')
 
     @property
     def serialize(self):
         """Return object data in easily serializeable format"""
-        return {
-            'category_name': self.category_name,
-            'category_id': self.category_id,
-            'user_id': self.category_id
-        }
+        return dict((name, getattr(self, name))
+                    for name in self.serialized_fields)
 
     @classmethod
+    @_queued
     def add_or_update(cls, name, user_id, category_id=None):
         """Add or update the caegory record
 
@@ -102,14 +372,17 @@ class Category(Base):
             return cls.update(name, user_id, category)
         else:
             newCategory = cls(category_name=name,
-                              user_id=user_id)
+                              user_id=user_id,
+                              owner_name=_user_name(user_id))
             session.add(newCategory)
-            session.commit()
+            _commit()
+            _changed('category', newCategory.category_id)
             msg = ('New Category %s Successfully Created'
                    % Category.category_name)
             return newCategory, msg
 
     @classmethod
+    @_queued
     def update(cls, category_name, user_id, category):
         """Returns and updates pdates the category_name, if user owns it.
 
@@ -124,12 +397,14 @@ class Category(Base):
         if category.user_id == user_id:
             category.category_name = category_name
             session.add(category)
-            session.commit()
+            _commit()
+            _changed('category', category.category_id)
             return category
         else:
             return False
 
     @classmethod
+    @_queued
     def write(cls, category_name, user_id):
         """Adds a new record to the Category table; returns it as
         category instance.
@@ -142,11 +417,123 @@ class Category(Base):
             Adds record to Category table and returns same instance
         """
         newCategory = cls(category_name=category_name,
-                          user_id=user_id)
+                          user_id=user_id,
+                          owner_name=_user_name(user_id))
         session.add(newCategory)
-        session.commit()
+        _commit()
+        _changed('category', newCategory.category_id)
         return newCategory
 
+    @classmethod
+    @_queued
+    def delete(cls, category_id, user_id):
+        """Deletes the category and all of its items, if user owns it.
+
+        Items are removed with one set-based DELETE, in the same transaction
+        as the category, rather than loaded and deleted one by one.
+
+        Args:
+            category_id: category to be deleted
+            user_id: Current user, possibly owner of category
+
+        Returns:
+            True if the category was deleted; else False
+        """
+        category = cls.by_id(category_id)
+        if not category or category.user_id != user_id:
+            return False
+        session.query(Item).filter_by(category_id=category_id).delete(
+            synchronize_session=False)
+        session.query(cls).filter_by(category_id=category_id).delete(
+            synchronize_session=False)
+        _commit()
+        _changed('category', category_id)
+        return True
+
+    @classmethod
+    def touch(cls, *category_ids):
+        """Marks categories as modified, within the current transaction;
+        used when items are added, changed or removed.
+        """
+        session.query(cls).filter(cls.category_id.in_(category_ids)).update(
+            {cls.updated_at: datetime.utcnow()}, synchronize_session=False)
+
+    @classmethod
+    def add_items(cls, category_id, count):
+        """Adds count (negative to remove) to the category's item_count and
+        marks it modified, within the current transaction.
+        """
+        session.query(cls).filter_by(category_id=category_id).update(
+            {cls.item_count: cls.item_count + count,
+             cls.updated_at: datetime.utcnow()}, synchronize_session=False)
+
+    @classmethod
+    def _summaries(cls):
+        """Returns the category table and expressions for what item_count
+        and owner_name of each row should be.
+        """
+        category = cls.__table__
+        item = Item.__table__
+        user = User.__table__
+        item_count = select([func.count(item.c.item_id)]).where(
+            item.c.category_id == category.c.category_id).as_scalar()
+        owner_name = func.coalesce(select([user.c.user_name]).where(
+            user.c.user_id == category.c.user_id).as_scalar(), '')
+        return category, item_count, owner_name
+
+    @classmethod
+    def summary_errors(cls, bind):
+        """Returns rows of category_id, item_count, actual_count,
+        owner_name and actual_owner for every category whose maintained
+        columns are wrong.
+
+        Arg:
+            bind: connection or session to query with
+        """
+        category, item_count, owner_name = cls._summaries()
+        query = select([category.c.category_id, category.c.item_count,
+                        item_count.label('actual_count'),
+                        category.c.owner_name,
+                        owner_name.label('actual_owner')])
+        query = query.where(or_(category.c.item_count != item_count,
+                                category.c.owner_name != owner_name))
+        query = query.order_by(category.c.category_id)
+        return bind.execute(query).fetchall()
+
+    @classmethod
+    def repair_summaries(cls, bind, category_ids=None):
+        """Recomputes item_count and owner_name where they are wrong, with
+        one UPDATE; repaired categories are marked modified.
+
+        Args:
+            bind: connection or session to update with
+            category_ids: only check these categories; None for all
+
+        Returns:
+            number of categories repaired
+        """
+        category, item_count, owner_name = cls._summaries()
+        wrong = or_(category.c.item_count != item_count,
+                    category.c.owner_name != owner_name)
+        if category_ids is not None:
+            wrong = and_(category.c.category_id.in_(category_ids), wrong)
+        result = bind.execute(category.update().where(wrong).values(
+            item_count=item_count, owner_name=owner_name,
+            updated_at=datetime.utcnow()))
+        return result.rowcount
+
+    @classmethod
+    def freshness(cls, user_id=None):
+        """Returns count and newest updated_at of all categories, or only
+        those owned by user_id; together they change whenever a listing of
+        those categories would.
+        """
+        query = session.query(func.count(cls.category_id),
+                              func.max(cls.updated_at))
+        if user_id is not None:
+            query = query.filter_by(user_id=user_id)
+        return query.one()
+
     @classmethod
     def by_user(cls, user_id):
         """Filter to return all categories owned by user_id, as instance.
@@ -179,61 +566,131 @@ class Category(Base):
         else:
             False
 
-    def render(self, display_items=False):
-        """ Allows values to be passed into category_loop.html
-            file at runtime.
+    @classmethod
+    def page(cls, after_id=None, limit=100):
+        """Returns the next page of all categories, in category_id order,
+        serialized straight from the table rows.
+
+        Args:
+            after_id: last category_id already seen; None for the first page
+            limit: most categories to return
+
+        Returns:
+            categories: up to limit dicts, as serialize gives
+        """
+        query = serializers.select_fields(cls)
+        if after_id is not None:
+            query = query.where(cls.category_id > after_id)
+        query = query.order_by(cls.category_id).limit(limit)
+        return serializers.rows(cls, session.execute(query))
+
+    @classmethod
+    def stream(cls, batch_size=1000):
+        """Returns all categories, serialized, as an iterator, fetched
+        batch_size rows at a time so memory stays flat however many there
+        are.
+        """
+        query = serializers.select_fields(cls).order_by(cls.category_id)
+        result = session.execute(query.execution_options(
+            stream_results=True))
+        return serializers.stream_rows(cls, result, batch_size)
+
+    @classmethod
+    def page_by_user(cls, user_id, with_items=False):
+        """Returns all categories owned by user_id, ready for rendering.
+
+        Owner names and item counts are kept on the category row, so
+        without items this is one scan of ix_category_user_id_name. Items,
+        if requested, are loaded up front, so the page costs a constant
+        number of queries rather than one per category.
+
+        Args:
+            user_id: used to filter the Category table for owner
+            with_items: if True, items and their owners are also loaded
+
+        Returns:
+            categories: all categories owned by user_id, as instance.
+        """
+        categories = cls._page_query(with_items).filter_by(user_id=user_id)
+        categories = categories.order_by(cls.category_name).all()
+        return categories
+
+    @classmethod
+    def page_by_id(cls, category_id):
+        """Returns single category with owner, items and item owners loaded
 
         Arg:
-            display_items: If present, all items within the category are
-                           displayed to the user.
+            category_id: category to be displayed
 
         Returns:
-            Feeds Category HTML into calling function in flask/jinja template.
+            category: Category instance, if category_id exists; else None
+        """
+        category = cls._page_query(True).filter_by(category_id=category_id)
+        return category.first()
+
+    @classmethod
+    def _page_query(cls, with_items):
+        """Category query with the relationships used by view() loaded.
+        Without items it reads the category table alone.
+        """
+        query = session.query(cls)
+        if with_items:
+            query = query.options(
+                subqueryload(cls.items).joinedload(Item.user))
+        return query
+
+    def view(self, with_items=False):
+        """Returns the category as a plain dict for the page templates.
+
+        Arg:
+            with_items: if True, includes views of the category's items
 
+        Returns:
+            dict with category_id, category_name, owner_name, item_count,
+            updated_at and items
         """
-        if self:
-            self._category_name = self.category_name
-            self._category_id = self.category_id
-            self._user_id = self.user_id
-            self._owner_name = session.query(User).filter_by(
-                user_id=self.user_id).one().user_name
-            self._items = Item.by_category_id(self.category_id)
-            self._show_description = display_items
-        return render_template("/category.html", category=self)
-
-    def render_dropdown(self, default_id):
-        """ Allows category values to be passed into category_admin.html
-            file at runtime"""
-        if self:
-            self._category_name = self.category_name
-            self._category_id = self.category_id
-        return render_template("/category_dropdown_part.html",
-                               category=self,
-                               default_id=default_id)
+        return {
+            'category_id': self.category_id,
+            'category_name': self.category_name,
+            'updated_at': self.updated_at,
+            'owner_name': self.owner_name,
+            'item_count': self.item_count,
+            'items': [item.view() for item in self.items] if with_items
+            else []
+        }
 
 
 class Item(Base):
     """Item table - sqlAlchemy linked with SQLite3 back end"""
     __tablename__ = 'item'
+    __table_args__ = (
+        Index('ix_item_category_id_name', 'category_id', 'item_name'),
+    )
 
     item_id = Column(Integer, primary_key=True)
     item_name = Column(String(250), nullable=False)
     item_description = Column(String(1000), nullable=False)
-    category_id = Column(Integer, ForeignKey('category.category_id'))
+    category_id = Column(Integer, ForeignKey('category.category_id',
+                                             ondelete='CASCADE'))
     user_id = Column(Integer, ForeignKey('user.user_id'))
-    category = relationship("Category")
+    updated_at = Column(DateTime, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
+    # Name of the uploaded original, if any; see images.py
+    image = Column(String(64))
+    category = relationship("Category", back_populates="items")
     user = relationship(User)
 
+    # Columns the JSON API shows; see serialize and serializers.py
+    serialized_fields = ('item_name', 'item_description', 'item_id')
+
     @property
     def serialize(self):
         """Return object data in easily serializeable format"""
-        return {
-            'item_name': self.item_name,
-            'item_description': self.item_description,
-            'item_id': self.item_id
-        }
+        return dict((name, getattr(self, name))
+                    for name in self.serialized_fields)
 
     @classmethod
+    @_queued
     def add_or_update(cls, item_name, item_description, category_id,
                       user_id, item_id=None):
         """Add or update the item record
@@ -272,6 +729,7 @@ class Item(Base):
             False
 
     @classmethod
+    @_queued
     def update(cls, item_name, item_description, category_id, user_id, item):
         """Updates item record with values from arguments
 
@@ -286,16 +744,26 @@ class Item(Base):
             item if user is authorized; else False
         """
         if item.user_id == user_id:
-            # Item is owned by current user
+            # Item is owned by current user; forms post the id as a string
+            category_id = int(category_id)
+            old_category_id = item.category_id
             item.item_name = item_name
             item.item_description = item_description
             item.category_id = category_id
-            session.commit()
+            if old_category_id == category_id:
+                Category.touch(category_id)
+            else:
+                Category.add_items(old_category_id, -1)
+                Category.add_items(category_id, 1)
+            _commit()
+            _changed('item', item.item_id)
+            _changed('category', old_category_id, category_id)
             return item
         else:
             False
 
     @classmethod
+    @_queued
     def write(cls, item_name, item_description, category_id, user_id):
         """Adds a new record to the Item table; returns it as
         item instance.
@@ -315,9 +783,54 @@ class Item(Base):
                       category_id=category_id,
                       user_id=user_id)
         session.add(newItem)
-        session.commit()
+        Category.add_items(category_id, 1)
+        _commit()
+        _changed('category', category_id)
         return newItem
 
+    @classmethod
+    @_queued
+    def delete(cls, item_id, user_id):
+        """Deletes the item, if user owns it.
+
+        Args:
+            item_id: item to be deleted
+            user_id: User currently logged in
+
+        Returns:
+            True if the item was deleted; else False
+        """
+        item = cls.by_id(item_id)
+        if not item or item.user_id != user_id:
+            return False
+        category_id = item.category_id
+        session.delete(item)
+        Category.add_items(category_id, -1)
+        _commit()
+        _changed('item', item_id)
+        _changed('category', category_id)
+        return True
+
+    @classmethod
+    @_queued
+    def set_image(cls, item, image):
+        """Points item at a newly stored image original.
+
+        Args:
+            item: item the image belongs to
+            image: name of the original, from images.ImageStore
+
+        Returns:
+            name of the item's previous original, if any, for clean up
+        """
+        previous = item.image
+        item.image = image
+        Category.touch(item.category_id)
+        _commit()
+        _changed('item', item.item_id)
+        _changed('category', item.category_id)
+        return previous
+
     @classmethod
     def by_category_id(cls, category_id):
         """Returns all items within a category, as instance, if present
@@ -336,33 +849,53 @@ class Item(Base):
         else:
             False
 
-    def render(self, item_display):
-        """ Allows values to be passed into category_loop.html
-            file at runtime.
-
-        Arg:
-            item_display: controls if item information fed into render
-
-        Return:
-            rendered HTML - if item_display is True, full item information;
-                            else, only the item name
+    @classmethod
+    def images_by_category_id(cls, category_id):
+        """Returns the names of the image originals of a category's items,
+        so they can be removed once the category is deleted.
         """
-        if self:
-            self._item_id = self.item_id
-            self._item_name = self.item_name
-            self._item_description = self.item_description.replace("\n",
-                                                                   "<br>")
-            self._category_id = self.category_id
-            self._user_id = self.user_id
-            self._owner_name = session.query(User).filter_by(
-                user_id=self.user_id).one().user_name
-        if item_display:
-            return render_template("/item_full.html", item=self)
-        else:
-            return render_template("/item.html", item=self)
+        rows = session.query(cls.image).filter(
+            cls.category_id == category_id, cls.image.isnot(None))
+        return [image for image, in rows]
 
+    @classmethod
+    def page_by_category_id(cls, category_id, after_id=None, limit=100):
+        """Returns the next page of items in a category, in item_id order,
+        serialized straight from the table rows.
 
-engine = create_engine('sqlite:///item_catalog.db')
+        Args:
+            category_id: category the items belong to
+            after_id: last item_id already seen; None for the first page
+            limit: most items to return
 
+        Returns:
+            items: up to limit dicts, as serialize gives
+        """
+        query = serializers.select_fields(cls).where(
+            cls.category_id == category_id)
+        if after_id is not None:
+            query = query.where(cls.item_id > after_id)
+        query = query.order_by(cls.item_id).limit(limit)
+        return serializers.rows(cls, session.execute(query))
 
-Base.metadata.create_all(engine)
+    @classmethod
+    def stream_by_category_id(cls, category_id, batch_size=1000):
+        """Returns all items in a category, serialized, as an iterator,
+        fetched batch_size rows at a time so memory stays flat.
+        """
+        query = serializers.select_fields(cls).where(
+            cls.category_id == category_id).order_by(cls.item_id)
+        result = session.execute(query.execution_options(
+            stream_results=True))
+        return serializers.stream_rows(cls, result, batch_size)
+
+    def view(self):
+        """Returns the item as a plain dict for the page templates"""
+        return {
+            'item_id': self.item_id,
+            'item_name': self.item_name,
+            'item_description': self.item_description,
+            'category_id': self.category_id,
+            'owner_name': self.user.user_name if self.user else '',
+            'image': self.image
+        }
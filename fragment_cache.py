@@ -0,0 +1,131 @@
+"""Cache of rendered HTML fragments of the category and item templates.
+
+Fragments are keyed by (model, id, version, display flag), where the
+version is read from the object's own row - a category's updated_at, which
+any change to it or its items bumps. Every process sees the same version,
+so a write from another worker or from manage.py makes the old fragments
+unreachable everywhere at once, with nothing to invalidate; they simply age
+out.
+
+Templates cache a fragment by wrapping it in a call block:
+    {% call cached('category', category.category_id, category.updated_at,
+                   False) %}...{% endcall %}
+
+Backends only need get/set/delete/clear on string keys (see FragmentCache),
+which maps directly onto memcached or Redis clients, should processes need
+to share fragments.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+from config import Config
+
+
+class LRUCache(object):
+    """In-process backend holding at most max_entries values, each for at
+    most ttl seconds. Least recently used values are evicted first.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                return None
+            # Re-insert to mark as most recently used
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FragmentCache(object):
+    """Versioned fragment cache in front of backend, any object with these
+    methods, keys and values being strings (as LRUCache below, or a
+    memcached or Redis client):
+
+        get(key): the value stored for key; None if absent or expired
+        set(key, value): stores value for key
+        delete(key): removes key, if present
+        clear(): removes every key
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, model, object_id, version, flag):
+        """Returns the cached fragment; None on a miss. Arguments are
+        those of get_or_render.
+        """
+        return self.backend.get(_key(model, object_id, version, flag))
+
+    def get_or_render(self, model, object_id, version, flag, render):
+        """Returns the cached fragment, calling render() only on a miss.
+
+        Args:
+            model: name of the model, e.g. 'category'
+            object_id: primary key of the object rendered
+            version: value from the object's row that changes whenever the
+                     fragment would, such as its updated_at
+            flag: display option passed to the render method
+            render: function returning the fragment HTML
+        """
+        key = _key(model, object_id, version, flag)
+        html = self.backend.get(key)
+        if html is None:
+            html = render()
+            self.backend.set(key, html)
+        return html
+
+
+def _key(model, object_id, version, flag):
+    if hasattr(version, 'isoformat'):
+        version = version.isoformat()
+    return 'fragment:%s:%s:%s:%d' % (model, object_id, version, bool(flag))
+
+
+fragment_cache = FragmentCache(LRUCache(Config.FRAGMENT_CACHE_SIZE,
+                                        Config.FRAGMENT_CACHE_TTL))
+
+
+def cached(model, object_id, version, flag, caller):
+    """Template global: returns the body of a {% call %} block from
+    fragment_cache, rendering it only on a miss. Arguments are those of
+    FragmentCache.get_or_render.
+    """
+    return Markup(fragment_cache.get_or_render(
+        model, object_id, version, flag, lambda: type(u'')(caller())))
+
+
+def cached_fragment(model, object_id, version, flag):
+    """Returns the fragment cached() would, as Markup, without rendering;
+    None on a miss. Lets a view skip loading what only the fragment shows.
+    """
+    html = fragment_cache.get(model, object_id, version, flag)
+    return Markup(html) if html is not None else None
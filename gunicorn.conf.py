@@ -0,0 +1,47 @@
+"""gunicorn settings for the catalog, read from config.py:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+CATALOG_WORKERS pre-forked processes serve CATALOG_WORKER_THREADS requests
+at a time each. The app is loaded once, by the master, before the workers
+are forked (see wsgi.py); each worker then opens database connections of
+its own, and is replaced after about CATALOG_WORKER_MAX_REQUESTS requests
+to bound memory growth. The jitter keeps workers from all restarting at
+once.
+
+Each worker keeps its own caches, and none of them can serve a stale page
+against a fresh validator from conditional(). Rendered fragments are keyed
+on the category's updated_at, read from the database, so a write from any
+worker or from manage.py reaches them all at once (see fragment_cache.py).
+The JSON API snapshot checks the database for other processes' writes every
+CATALOG_API_SNAPSHOT_CHECK_INTERVAL seconds, and its validators come from
+the snapshot itself.
+
+Restarts drop no requests, as the listening socket stays open throughout:
+
+* kill -HUP <master> starts new workers, with these settings read again,
+  and then stops the old ones, each after its current requests. The code
+  is not reloaded, as the master preloaded it.
+* To deploy new code, kill -USR2 <master> starts a new master, with the new
+  code, next to the old one. Once it is serving, kill -WINCH <old master>
+  stops the old workers gracefully and kill -QUIT <old master> ends it.
+"""
+import multiprocessing
+
+from config import Config
+from database_setup import dispose_engines
+
+bind = Config.BIND
+workers = Config.WORKERS or multiprocessing.cpu_count() * 2 + 1
+worker_class = 'gthread'
+threads = Config.WORKER_THREADS
+preload_app = True
+max_requests = Config.WORKER_MAX_REQUESTS
+max_requests_jitter = Config.WORKER_MAX_REQUESTS_JITTER
+timeout = Config.WORKER_TIMEOUT
+graceful_timeout = Config.WORKER_GRACEFUL_TIMEOUT
+
+
+def post_fork(server, worker):
+    """Drops any connection the worker inherited; it connects afresh"""
+    dispose_engines()
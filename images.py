@@ -0,0 +1,351 @@
+"""Item images: one uploaded original per item, resized on demand.
+
+Originals are kept under IMAGE_DIR/originals, named for their item and a
+hash of their content. Pages ask for them at a handful of widths, as WebP
+or JPEG, through /media/<original>/<width>.<format>; each variant is made
+on first request by a small, bounded pool of worker threads and kept in an
+on-disk cache (IMAGE_DIR/cache) that evicts the least recently used files
+once it grows past IMAGE_CACHE_MAX_BYTES. Requests for a variant that is
+already being made wait for that work rather than repeating it.
+
+Resizing needs Pillow. Without it uploads are refused and any existing
+originals are served as they are.
+"""
+import hashlib
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+from flask import Blueprint, abort, current_app, request, send_file
+from flask import url_for
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+# Widths offered in srcset; requests for any other width are refused
+WIDTHS = (200, 500, 1000)
+
+# Uploaded formats accepted, with the extension their originals get
+UPLOAD_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+MIMETYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+ORIGINAL_NAME = re.compile(r'^\d+-[0-9a-f]{12}\.(jpg|png|gif|webp)$')
+
+# EXIF orientation tag; values 5-8 mean the image is stored on its side
+ORIENTATION = 0x0112
+
+ONE_YEAR = 365 * 24 * 3600
+
+images = Blueprint('images', __name__)
+
+
+def variant_formats():
+    """Returns the formats variants can be made in, best first"""
+    if Image is None:
+        return ()
+    if features.check('webp'):
+        return ('webp', 'jpeg')
+    return ('jpeg',)
+
+
+def resize(path, width, format):
+    """Returns the image at path scaled down to width (never up), encoded
+    as format ('webp' or 'jpeg').
+    """
+    image = Image.open(path)
+    sideways = image.getexif().get(ORIENTATION, 1) in (5, 6, 7, 8)
+    # thumbnail() lets the JPEG decoder skip detail it would discard
+    image.thumbnail((10 * width, width) if sideways else (width, 10 * width),
+                    Image.LANCZOS)
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+    out = io.BytesIO()
+    if format == 'jpeg':
+        if has_alpha:
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[3])
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(out, 'JPEG', quality=82, optimize=True, progressive=True)
+    else:
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        image.save(out, 'WEBP', quality=80, method=4)
+    return out.getvalue()
+
+
+class DiskCache(object):
+    """Files under directory, evicted least recently used first once they
+    total more than max_bytes.
+
+    Recency is tracked in memory and seeded from file modification times,
+    which get() refreshes, so the order survives restarts. Processes
+    sharing the directory each track it separately; a file removed by
+    another process just counts as a miss.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._files = OrderedDict()  # key: size, least recent first
+        self._bytes = 0
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                key = os.path.relpath(path, self.directory)
+                found.append((stat.st_mtime, key, stat.st_size))
+        with self._lock:
+            for _, key, size in sorted(found):
+                self._files[key] = size
+                self._bytes += size
+            self._evict()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Returns the path of key's file, marking it recently used; None
+        if it is not cached.
+        """
+        path = self.path(key)
+        with self._lock:
+            size = self._files.pop(key, None)
+            if size is None:
+                return None
+            if not os.path.isfile(path):
+                self._bytes -= size
+                return None
+            self._files[key] = size
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return path
+
+    def put(self, key, content):
+        """Stores content as key's file; returns its path"""
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        # Write aside and rename, so readers never see a partial file
+        temp = '%s.%d.%d.tmp' % (path, os.getpid(),
+                                 threading.current_thread().ident)
+        with open(temp, 'wb') as f:
+            f.write(content)
+        os.rename(temp, path)
+        with self._lock:
+            self._bytes += len(content) - self._files.pop(key, 0)
+            self._files[key] = len(content)
+            self._evict()
+        return path
+
+    def discard(self, prefix):
+        """Removes every file whose key starts with prefix"""
+        with self._lock:
+            for key in [k for k in self._files if k.startswith(prefix)]:
+                self._bytes -= self._files.pop(key)
+                self._remove(key)
+
+    def _evict(self):
+        # Always keep the newest file, even if it alone is over the limit
+        while self._bytes > self.max_bytes and len(self._files) > 1:
+            key, size = self._files.popitem(last=False)
+            self._bytes -= size
+            self._remove(key)
+
+    def _remove(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+
+class ImageStore(object):
+    """Originals and their cached variants, under directory"""
+
+    def __init__(self, directory, cache_max_bytes, workers=2, timeout=30):
+        self.originals = os.path.join(directory, 'originals')
+        self.cache = DiskCache(os.path.join(directory, 'cache'),
+                               cache_max_bytes)
+        self.workers = workers
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pending = {}  # variant key: AsyncResult of its resize
+        self._pid = None
+        self._pool = None
+
+    def _workers(self):
+        """Returns this process's resize pool; made again after a fork"""
+        if self._pid != os.getpid():
+            self._pool = ThreadPool(self.workers)
+            self._pending = {}
+            self._pid = os.getpid()
+        return self._pool
+
+    def save_original(self, item_id, stream, max_bytes):
+        """Checks and stores an uploaded image as item_id's original.
+
+        Args:
+            item_id: item the image belongs to
+            stream: file object holding the upload
+            max_bytes: largest upload accepted
+
+        Returns:
+            name of the stored original
+
+        Raises:
+            ValueError: with a message for the user, if the upload is too
+                        large, not an image, or Pillow is missing
+        """
+        if Image is None:
+            raise ValueError('Image uploads are not available')
+        content = stream.read(max_bytes + 1)
+        if len(content) > max_bytes:
+            raise ValueError('Images must be smaller than %d MB'
+                             % (max_bytes // (1024 * 1024)))
+        try:
+            image = Image.open(io.BytesIO(content))
+            image.verify()
+        except Exception:
+            raise ValueError('That file is not an image')
+        if image.format not in UPLOAD_FORMATS:
+            raise ValueError('Images must be JPEG, PNG, GIF or WebP')
+        name = '%d-%s.%s' % (item_id, hashlib.sha1(content).hexdigest()[:12],
+                             UPLOAD_FORMATS[image.format])
+        if not os.path.isdir(self.originals):
+            os.makedirs(self.originals)
+        with open(os.path.join(self.originals, name), 'wb') as f:
+            f.write(content)
+        return name
+
+    def remove(self, name):
+        """Deletes original name and its cached variants"""
+        self.cache.discard(name + os.sep)
+        try:
+            os.remove(os.path.join(self.originals, name))
+        except OSError:
+            pass
+
+    def variant(self, name, width, format):
+        """Returns the path of original name at width in format, making it
+        first if it is not cached. Concurrent calls for the same variant
+        share one resize.
+
+        Raises:
+            IOError: if there is no such original
+            multiprocessing.TimeoutError: if the resize takes too long
+        """
+        key = os.path.join(name, '%d.%s' % (width, format))
+        path = self.cache.get(key)
+        if path is not None:
+            return path
+        with self._lock:
+            # Check again: a resize may have finished since
+            path = self.cache.get(key)
+            if path is not None:
+                return path
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._workers().apply_async(
+                    self._make, (key, name, width, format))
+                self._pending[key] = pending
+        return pending.get(self.timeout)
+
+    def _make(self, key, name, width, format):
+        try:
+            original = os.path.join(self.originals, name)
+            return self.cache.put(key, resize(original, width, format))
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+
+def store():
+    """Returns the current app's ImageStore"""
+    return current_app.extensions['images']
+
+
+def image_url(name, width, format='jpeg'):
+    """Returns the URL of original name's variant at width"""
+    return url_for('images.variant', name=name, width=width, format=format)
+
+
+def image_srcset(name, format='jpeg'):
+    """Returns a srcset listing original name at every width in WIDTHS"""
+    return ', '.join('%s %dw' % (image_url(name, width, format), width)
+                     for width in WIDTHS)
+
+
+@images.route('/media/<name>/<int:width>.<any(webp, jpeg):format>')
+def variant(name, width, format):
+    """Serves a variant of an item image. URLs name the original's content
+    hash, so responses can be cached indefinitely.
+    """
+    if not ORIGINAL_NAME.match(name) or width not in WIDTHS:
+        abort(404)
+    originals = store()
+    if Image is None:
+        path = os.path.join(originals.originals, name)
+        if not os.path.isfile(path):
+            abort(404)
+        return send_file(path, conditional=True)
+    if format not in variant_formats():
+        abort(404)
+    try:
+        path = originals.variant(name, width, format)
+    except IOError:
+        abort(404)
+    except TimeoutError:
+        abort(503)
+    # Cache hits refresh the variant's mtime, which send_file would build
+    # its validators from; the URL names the original's content, so the
+    # original's mtime and the URL itself serve instead
+    response = send_file(
+        path, mimetype=MIMETYPES[format], conditional=False,
+        last_modified=os.path.getmtime(os.path.join(originals.originals,
+                                                    name)))
+    response.set_etag('%s-%d.%s' % (name, width, format))
+    response.make_conditional(request, accept_ranges=True,
+                              complete_length=os.path.getsize(path))
+    response.headers['Cache-Control'] = ('public, max-age=%d, immutable'
+                                         % ONE_YEAR)
+    # Flask 1.x adds its default Expires; Cache-Control says it all
+    response.headers.pop('Expires', None)
+    return response
+
+
+def init_app(app):
+    """Sets up the image store and adds the media route and template
+    helpers.
+    """
+    config = app.config
+    app.extensions['images'] = ImageStore(
+        os.path.join(app.root_path, config['IMAGE_DIR']),
+        config['IMAGE_CACHE_MAX_BYTES'], config['IMAGE_WORKERS'],
+        config['IMAGE_TIMEOUT'])
+    app.register_blueprint(images)
+    app.add_template_global(image_url)
+    app.add_template_global(image_srcset)
+    app.add_template_global(variant_formats)
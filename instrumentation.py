@@ -0,0 +1,255 @@
+"""Per-request timings: query count, SQL time, template time and latency.
+
+init_app() hooks SQLAlchemy cursor events and Flask's request hooks, and
+times template rendering. Each response then carries a Server-Timing header,
+which browser developer tools show next to the request. Every request is
+also recorded in histograms by route, and /metrics serves them in the
+Prometheus text format. Queries and requests slower than their thresholds
+are logged, with the route that ran them.
+
+Metrics are kept per process; a Prometheus server scraping several
+workers sums them itself.
+"""
+import logging
+import threading
+import time
+
+from flask import Blueprint, Response, abort, current_app, request
+from jinja2 import Template
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds and in queries
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+_local = threading.local()
+
+# Statements taking at least this long are logged; see instrument_engine()
+_slow_query_seconds = None
+
+instrumentation = Blueprint('instrumentation', __name__)
+
+
+class RequestStats(object):
+    """What one request has spent so far"""
+
+    __slots__ = ('started', 'queries', 'sql', 'render', '_render_started')
+
+    def __init__(self):
+        self.started = time.time()
+        self.queries = 0
+        self.sql = 0.0
+        self.render = 0.0
+        self._render_started = None
+
+
+def current():
+    """Returns the RequestStats of this thread's request; None outside
+    of one.
+    """
+    return getattr(_local, 'stats', None)
+
+
+class Histogram(object):
+    """Prometheus-style histogram with one series per label set"""
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values: [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [
+                    [0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def totals(self):
+        """Returns the sum and count of each series, by label values"""
+        with self._lock:
+            return dict((k, (v[1], v[2])) for k, v in self._series.items())
+
+    def expose(self):
+        """Returns the histogram in the Prometheus text format"""
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s histogram' % self.name]
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1], v[2]))
+                            for k, v in self._series.items())
+        for label_values, (counts, total, count) in series:
+            labels = ','.join('%s="%s"' % (name, _escape(value))
+                              for name, value in zip(self.labels,
+                                                     label_values))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append('%s_bucket{%s,le="%s"} %d'
+                             % (self.name, labels, _number(bound),
+                                cumulative))
+            lines.append('%s_bucket{%s,le="+Inf"} %d'
+                         % (self.name, labels, count))
+            lines.append('%s_sum{%s} %s'
+                         % (self.name, labels, _number(total)))
+            lines.append('%s_count{%s} %d' % (self.name, labels, count))
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _number(value):
+    return repr(float(value))
+
+
+LABELS = ('route', 'method', 'status')
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+request_seconds = Histogram(
+    'catalog_request_duration_seconds', 'Time to build a response.',
+    LABELS, SECONDS_BUCKETS)
+sql_seconds = Histogram(
+    'catalog_request_sql_seconds', 'Time spent in SQL per request.',
+    LABELS, SECONDS_BUCKETS)
+render_seconds = Histogram(
+    'catalog_request_render_seconds', 'Time spent rendering templates '
+    'per request.', LABELS, SECONDS_BUCKETS)
+request_queries = Histogram(
+    'catalog_request_queries', 'SQL statements run per request.',
+    LABELS, QUERY_BUCKETS)
+
+HISTOGRAMS = [request_seconds, sql_seconds, render_seconds, request_queries]
+
+
+def register(*histograms):
+    """Adds histograms kept by other modules to those /metrics serves"""
+    for histogram in histograms:
+        if histogram not in HISTOGRAMS:
+            HISTOGRAMS.append(histogram)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_started', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.time() - conn.info['query_started'].pop()
+    stats = current()
+    if stats is not None:
+        stats.queries += 1
+        stats.sql += elapsed
+    if _slow_query_seconds is not None and elapsed >= _slow_query_seconds:
+        log.warning('Slow query (%.1f ms, %s): %s', elapsed * 1000,
+                    _route() if stats is not None else 'no request',
+                    ' '.join(statement.split()))
+
+
+def instrument_engine(engine, slow_query_ms):
+    """Counts and times every statement run on engine, logging any that
+    take slow_query_ms or longer.
+    """
+    global _slow_query_seconds
+    _slow_query_seconds = slow_query_ms / 1000.0
+    if event.contains(engine, 'before_cursor_execute',
+                      _before_cursor_execute):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def _start_request():
+    _local.stats = RequestStats()
+
+
+class TimedTemplate(Template):
+    """Template that adds the time it takes to render to the request's
+    stats. Flask's template signals would need blinker, which Flask 1.x
+    and 2.x leave optional, so the app's templates are made from this
+    class instead; see init_app().
+    """
+
+    def render(self, *args, **kwargs):
+        stats = current()
+        # A template rendered from within another is already counted
+        if stats is None or stats._render_started is not None:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        stats._render_started = time.time()
+        try:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        finally:
+            stats.render += time.time() - stats._render_started
+            stats._render_started = None
+
+
+def _finish_request(response):
+    stats = current()
+    if stats is None:
+        return response
+    total = time.time() - stats.started
+    labels = (_route(), request.method, str(response.status_code))
+    request_seconds.observe(total, *labels)
+    sql_seconds.observe(stats.sql, *labels)
+    render_seconds.observe(stats.render, *labels)
+    request_queries.observe(stats.queries, *labels)
+    config = current_app.config
+    if config['SERVER_TIMING']:
+        response.headers.add('Server-Timing', ', '.join([
+            'db;dur=%.1f;desc="%d queries"' % (stats.sql * 1000,
+                                               stats.queries),
+            'render;dur=%.1f' % (stats.render * 1000),
+            'total;dur=%.1f' % (total * 1000)]))
+    if total * 1000 >= config['SLOW_REQUEST_MS']:
+        log.warning('Slow request (%.1f ms): %s %s - %d queries, '
+                    '%.1f ms SQL, %.1f ms templates', total * 1000,
+                    request.method, request.path, stats.queries,
+                    stats.sql * 1000, stats.render * 1000)
+    return response
+
+
+def _end_request(exc):
+    _local.stats = None
+
+
+@instrumentation.route('/metrics')
+def metrics():
+    """Request histograms in the Prometheus text format. If METRICS_TOKEN
+    is set, scrapers must send it as a bearer token.
+    """
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != 'Bearer ' + token:
+        abort(403)
+    body = '\n'.join(histogram.expose() for histogram in HISTOGRAMS)
+    return Response(body + '\n', content_type=METRICS_CONTENT_TYPE)
+
+
+def init_app(app, *engines):
+    """Instruments app and the database engines it uses"""
+    for engine in engines:
+        instrument_engine(engine, app.config['SLOW_QUERY_MS'])
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
+    app.jinja_env.template_class = TimedTemplate
+    app.register_blueprint(instrumentation)
@@ -1,80 +1,164 @@
-from flask import Flask, render_template, request, redirect
-from flask import jsonify, flash, make_response
-from database_setup import User, Category, Item, session
+from flask import Blueprint, Flask, render_template, request, redirect
+from flask import jsonify, flash, make_response, g, abort
+from flask import Response, current_app, stream_with_context, url_for
+from database_setup import User, Category, Item, session, init_engine
+from database_setup import engines
+import assets
+import images
+import instrumentation
+import search
+import serializers
+import snapshot
+import write_queue
 from flask import session as login_session
 from functools import wraps
+import logging
 
+import hashlib
 import random
 import string
-import httplib2
+import time
 import json
 import requests
+from multiprocessing import TimeoutError
 
-from oauth2client.client import flow_from_clientsecrets
 from oauth2client.client import FlowExchangeError
+from jinja2 import FileSystemBytecodeCache
 
+import oauth_client
+from config import Config
+from fragment_cache import cached, cached_fragment
 
-app = Flask(__name__)
 
-CLIENT_ID = json.loads(
-    open('client_secrets.json', 'r').read())['web']['client_id']
+# Routes are registered on the app by create_app()
+catalog = Blueprint('catalog', __name__)
+log = logging.getLogger(__name__)
+
 APPLICATION_NAME = "Item Catalog"
 
+# JSON API paging
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+API_STREAM_BATCH = 1000
+SEARCH_PAGE_SIZE = 20
+
+
+def shutdown_session(exception=None):
+    """Releases the request's database session back to the pool"""
+    session.remove()
+
+
+def routeReads():
+    """Keeps the request's reads on the primary database if it may write,
+    or if this user wrote too recently for the replicas to have caught up;
+    other requests read from a replica.
+    """
+    session.info['primary'] = (
+        request.method not in ('GET', 'HEAD', 'OPTIONS') or
+        login_session.get('primary_until', 0) > time.time())
+
+
+def stickToPrimary(response):
+    """After a request that wrote, sends this user's reads to the primary
+    for DB_REPLICA_STICKY_SECONDS, so they see their own changes.
+    """
+    if session.info.get('wrote'):
+        login_session['primary_until'] = (
+            time.time() + current_app.config['DB_REPLICA_STICKY_SECONDS'])
+    return response
+
 
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'email' in login_session:
+        if getUser():
             return f(*args, **kwargs)
         else:
             flash("You are not allowed to access there")
             return redirect('/login')
     return decorated_function
 
-# Connect to Database and create database session
-# sss
+
+def getUser():
+    """Returns the signed in User, loaded at most once per request.
+
+    Sessions hold the user_id stored by gconnect; older sessions that only
+    hold an email are looked up by email once and then upgraded.
+    """
+    if '_user_curr' not in g:
+        user = None
+        if 'user_id' in login_session:
+            user = User.by_id(login_session['user_id'])
+        elif 'email' in login_session:
+            user = User.by_email(login_session['email'])
+            if user:
+                login_session['user_id'] = user.user_id
+        g._user_curr = user
+    return g._user_curr
 
 
 # Create anti-forgery state token
-@app.route('/login')
+@catalog.route('/login')
 def showLogin():
     state = ''.join(random.choice(string.ascii_uppercase + string.digits)
-                    for x in xrange(32))
+                    for x in range(32))
     login_session['state'] = state
     # return "The current session state is %s" % login_session['state']
     return render_template('login.html', STATE=state)
 
 
-@app.route('/gconnect', methods=['POST'])
+@catalog.route('/gconnect', methods=['POST'])
 def gconnect():
+    """Signs the user in with a Google authorization code; the time
+    taken is recorded in oauth_client.login_latency.
+    """
+    with oauth_client.login_latency.time():
+        try:
+            return gconnectUser()
+        except requests.RequestException:
+            response = make_response(
+                json.dumps('Failed to reach the sign in provider.'), 502)
+            response.headers['Content-Type'] = 'application/json'
+            return response
+
+
+def gconnectUser():
     # Validate state token
-    print request.args.get('state')
     # if request.args.get('state') != login_session['state']:
     if request.args.get('state') != request.args.get('state'):
-        print request.args.get('state')
+        log.info('Rejected sign in with state %s', request.args.get('state'))
         response = make_response(json.dumps('Invalid state parameter.'), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
+
+    # A client that is still connected with a known-good token (page
+    # refreshes, several tabs) needs no code exchange or network calls.
+    if alreadyConnected():
+        return connectedResponse()
+
     # Obtain authorization code
     code = request.data
 
     try:
         # Upgrade the authorization code into a credentials object
-        oauth_flow = flow_from_clientsecrets('client_secrets.json', scope='')
-        oauth_flow.redirect_uri = 'postmessage'
-        credentials = oauth_flow.step2_exchange(code)
+        credentials = oauth_client.exchange_code(code)
     except FlowExchangeError:
         response = make_response(
             json.dumps('Failed to upgrade the authorization code.'), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
 
-    # Check that the access token is valid.
+    # Check that the access token is valid, fetching the user's profile
+    # at the same time.
     access_token = credentials.access_token
-    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s'
-           % access_token)
-    h = httplib2.Http()
-    result = json.loads(h.request(url, 'GET')[1])
+    try:
+        result, data = oauth_client.token_and_user_info(
+            access_token, credentials.id_token_jwt, credentials.token_expiry)
+    except TimeoutError:
+        response = make_response(
+            json.dumps('Timed out fetching the user profile.'), 401)
+        response.headers['Content-Type'] = 'application/json'
+        return response
     # If there was an error in the access token info, abort.
     if result.get('error') is not None:
         response = make_response(json.dumps(result.get('error')), 500)
@@ -90,40 +174,31 @@ def gconnect():
         return response
 
     # Verify that the access token is valid for this app.
-    if result['issued_to'] != CLIENT_ID:
+    if result['issued_to'] != oauth_client.client_id():
         response = make_response(
             json.dumps("Token's client ID does not match app's."), 401)
-        print "Token's client ID does not match app's."
+        log.warning("Token's client ID does not match app's.")
         response.headers['Content-Type'] = 'application/json'
         return response
 
     stored_credentials = login_session.get('credentials')
     stored_gplus_id = login_session.get('gplus_id')
     if stored_credentials is not None and gplus_id == stored_gplus_id:
-        # Creates user if not already created - this happened in debug
-        user = User.create(login_session)
-        response = make_response(json.dumps('Current user is already '
-                                            'connected.'), 200)
-        response.headers['Content-Type'] = 'application/json'
-        return response
+        return connectedResponse()
 
     # Store the access token in the session for later use.
     login_session['access_token'] = credentials.access_token
     login_session['gplus_id'] = gplus_id
 
-    # Get user info
-    userinfo_url = "https://www.googleapis.com/oauth2/v1/userinfo"
-    params = {'access_token': credentials.access_token, 'alt': 'json'}
-    answer = requests.get(userinfo_url, params=params)
-
-    data = answer.json()
-
+    # Save user info
     login_session['username'] = data['name']
     login_session['picture'] = data['picture']
     login_session['email'] = data['email']
 
-    user = User.create(login_session)
-    print user
+    # A plain copy, as the write may run on the write queue's thread
+    user = User.create(dict(login_session))
+    login_session['user_id'] = user.user_id
+    log.info('Signed in user %d', user.user_id)
 
     output = ''
     output += '<h1>Welcome, '
@@ -134,14 +209,36 @@ def gconnect():
     output += ' " style = "width: 300px; height: 300px;border-radius: 150px'
     output += ';-webkit-border-radius: 150px;-moz-border-radius: 150px;">'
     flash("you are now logged in as %s" % login_session['username'])
-    print "done!"
     return output
 
 
+def alreadyConnected():
+    """True if login_session holds an access token that token_cache
+    still vouches for, issued to the same Google account.
+    """
+    access_token = login_session.get('access_token')
+    if access_token is None:
+        return False
+    cached = oauth_client.token_cache.get(access_token)
+    return (cached is not None and
+            cached['user_id'] == login_session.get('gplus_id'))
+
+
+def connectedResponse():
+    """Response for a gconnect from a user who is already connected"""
+    # Creates user if not already created - this happened in debug
+    user = User.create(dict(login_session))
+    login_session['user_id'] = user.user_id
+    response = make_response(json.dumps('Current user is already '
+                                        'connected.'), 200)
+    response.headers['Content-Type'] = 'application/json'
+    return response
+
+
 # DISCONNECT - Revoke a current user's token and reset their login_session
 
 
-@app.route('/gdisconnect')
+@catalog.route('/gdisconnect')
 def gdisconnect():
         # Only disconnect a connected user.
     access_token = login_session.get('access_token')
@@ -150,16 +247,14 @@ def gdisconnect():
             json.dumps('Current user not connected.'), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
-    url = 'https://accounts.google.com/o/oauth2/revoke?token=%s' % access_token
-    h = httplib2.Http()
-    result = h.request(url, 'GET')[0]
-    if result['status'] == '200':
+    if oauth_client.revoke(access_token):
         # Reset the user's sesson.
         del login_session['access_token']
         del login_session['gplus_id']
         del login_session['username']
         del login_session['email']
         del login_session['picture']
+        login_session.pop('user_id', None)
 
         response = make_response(json.dumps('Successfully disconnected.'), 200)
         response.headers['Content-Type'] = 'application/json'
@@ -172,47 +267,296 @@ def gdisconnect():
         return response
 
 
+def conditional(validators, last_modified, build):
+    """Answers 304 Not Modified when the client's copy is still current,
+    without building the response; otherwise returns build()'s response.
+
+    Args:
+        validators: values that change whenever the response would change
+        last_modified: datetime of the newest row shown, or None
+        build: function returning the full response
+
+    Returns:
+        response carrying ETag and, if known, Last-Modified; neither, and
+        never 304, while flashed messages wait to be shown
+    """
+    if '_flashes' in login_session:
+        # The page shows them once, so it must not be cached or revalidated
+        response = make_response(build())
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    validators = (request.full_path,) + tuple(validators)
+    etag = hashlib.sha1(repr(validators).encode('utf-8')).hexdigest()
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        fresh = (last_modified is not None and since is not None and
+                 since.replace(tzinfo=None) >=
+                 last_modified.replace(microsecond=0))
+    if fresh:
+        response = Response(status=304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Clients may keep a copy, but must check back before reusing it
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 # JSON APIs to view Category/Item Information
-@app.route('/category/<int:category_id>/items/json')
+def pageArgs():
+    """Returns after_id and limit from the query string; limit is kept
+    between 1 and API_MAX_PAGE_SIZE.
+    """
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', API_PAGE_SIZE, type=int)
+    return after_id, max(1, min(limit, API_MAX_PAGE_SIZE))
+
+
+def apiConditional(mimetype, validators, last_modified, build):
+    """conditional() for the JSON API, whose responses also depend on the
+    type negotiated from the Accept header.
+    """
+    if mimetype != serializers.JSON:
+        validators = (mimetype,) + tuple(validators)
+    response = conditional(validators, last_modified, build)
+    response.vary.add('Accept')
+    return response
+
+
+def jsonPage(key, rows, last_id, limit, mimetype, endpoint, **values):
+    """Returns one page of rows, with a link to the next page.
+
+    Args:
+        key: name of the list in the response
+        rows: serialized rows on this page
+        last_id: id of the last row; the next page starts after it
+        limit: page size requested
+        mimetype: serializers.JSON or serializers.MSGPACK
+        endpoint, values: used to build the next page URL
+
+    Returns:
+        response; 'next' is null on the last page
+    """
+    next_url = None
+    if len(rows) == limit:
+        next_url = url_for(endpoint, after_id=last_id, limit=limit,
+                           **values)
+    return serializers.response({key: rows, 'next': next_url}, mimetype)
+
+
+def jsonStream(key, rows):
+    """Streams rows as they are fetched, so memory stays flat for any
+    catalog size.
+
+    ?stream=ndjson sends one JSON object per line; any other value sends a
+    single document shaped like the paged response, without 'next'.
+
+    Args:
+        key: name of the list in the JSON document
+        rows: iterator of serialized rows, e.g. from Item.stream()
+    """
+    ndjson = request.args.get('stream') == 'ndjson'
+    dumps = serializers.dumps
+
+    def generate():
+        chunk = []
+        if not ndjson:
+            yield ('{"%s":[' % key).encode('ascii')
+        for i, row in enumerate(rows):
+            if ndjson:
+                chunk.append(dumps(row) + b'\n')
+            else:
+                chunk.append((b',' if i else b'') + dumps(row))
+            if len(chunk) == API_STREAM_BATCH:
+                yield b''.join(chunk)
+                chunk = []
+        yield b''.join(chunk)
+        if not ndjson:
+            yield b']}'
+
+    mimetype = serializers.NDJSON if ndjson else serializers.JSON
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def snapshotList(key, ids, encoded, endpoint, **values):
+    """Returns objects from the API snapshot as jsonPage() or, with
+    ?stream=, jsonStream() would, joining their stored encodings.
+
+    Args:
+        key: name of the list in the response
+        ids: sorted object ids
+        encoded: encoded objects, in the same order as ids
+        endpoint, values: used to build the next page URL
+    """
+    if request.args.get('stream') == 'ndjson':
+        return Response(b''.join(row + b'\n' for row in encoded),
+                        mimetype=serializers.NDJSON)
+    head = ('{"%s":[' % key).encode('ascii')
+    if 'stream' in request.args:
+        return Response(head + b','.join(encoded) + b']}',
+                        mimetype=serializers.JSON)
+    after_id, limit = pageArgs()
+    rows, last_id = snapshot.page(ids, encoded, after_id, limit)
+    next_url = None
+    if len(rows) == limit:
+        next_url = url_for(endpoint, after_id=last_id, limit=limit,
+                           **values)
+    return Response(head + b','.join(rows) + b'],"next":' +
+                    serializers.dumps(next_url) + b'}\n',
+                    mimetype=serializers.JSON)
+
+
+@catalog.route('/category/<int:category_id>/items/json')
 def itemJSON(category_id):
     """ Creates JSON information; part of API
+
+    Paged with ?after_id=&limit=, or streamed whole with ?stream=. Pages
+    are MessagePack if the client asks for it.
     """
-    items = session.query(Item).filter_by(
-        category_id=category_id).all()
-    return jsonify(items=[i.serialize for i in items])
+    mimetype = serializers.mimetype()
+    snap = snapshot.current() if mimetype == serializers.JSON else None
+    if snap is not None:
+        category = snap.category(category_id)
+        updated_at = category[0] if category else None
+        ids, encoded = snap.items(category_id)
+        return apiConditional(mimetype, (updated_at,), updated_at,
+                              lambda: snapshotList('items', ids, encoded,
+                                                   '.itemJSON',
+                                                   category_id=category_id))
+
+    def build():
+        if 'stream' in request.args:
+            return jsonStream('items', Item.stream_by_category_id(
+                category_id, API_STREAM_BATCH))
+        after_id, limit = pageArgs()
+        items = Item.page_by_category_id(category_id, after_id, limit)
+        last_id = items[-1]['item_id'] if items else None
+        return jsonPage('items', items, last_id, limit, mimetype,
+                        '.itemJSON', category_id=category_id)
+
+    # Item changes touch their category, so its stamp covers the items
+    category = Category.by_id(category_id)
+    updated_at = category.updated_at if category else None
+    return apiConditional(mimetype, (updated_at,), updated_at, build)
 
 
-@app.route('/category/<int:category_id>/JSON')
+@catalog.route('/category/<int:category_id>/JSON')
 def categoryJSON(category_id):
     """ Creates JSON information; part of API
+
+    MessagePack if the client asks for it.
     """
+    mimetype = serializers.mimetype()
+    snap = snapshot.current() if mimetype == serializers.JSON else None
+    if snap is not None:
+        category = snap.category(category_id)
+        if category is None:
+            abort(404)
+        updated_at, encoded = category
+        return apiConditional(mimetype, (updated_at,), updated_at,
+                              lambda: Response(b'{"category":' + encoded +
+                                               b'}\n',
+                                               mimetype=serializers.JSON))
     category = Category.by_id(category_id)
-    return jsonify(category=category.serialize)
+    if category is None:
+        abort(404)
+    return apiConditional(mimetype, (category.updated_at,),
+                          category.updated_at,
+                          lambda: serializers.response(
+                              {'category': category.serialize}, mimetype))
 
 
-@app.route('/category/JSON')
+@catalog.route('/category/JSON')
 def categoryAllJSON():
     """ Creates JSON information; part of API
+
+    Paged with ?after_id=&limit=, or streamed whole with ?stream=. Pages
+    are MessagePack if the client asks for it.
     """
-    categories = session.query(Category).all()
-    return jsonify(categories=[r.serialize for r in categories])
+    mimetype = serializers.mimetype()
+    snap = snapshot.current() if mimetype == serializers.JSON else None
+    if snap is not None:
+        count, updated_at = snap.stamp()
+        ids, encoded = snap.categories()
+        return apiConditional(mimetype, (count, updated_at), updated_at,
+                              lambda: snapshotList('categories', ids,
+                                                   encoded,
+                                                   '.categoryAllJSON'))
+
+    def build():
+        if 'stream' in request.args:
+            return jsonStream('categories', Category.stream(API_STREAM_BATCH))
+        after_id, limit = pageArgs()
+        categories = Category.page(after_id, limit)
+        last_id = categories[-1]['category_id'] if categories else None
+        return jsonPage('categories', categories, last_id, limit, mimetype,
+                        '.categoryAllJSON')
+
+    count, updated_at = Category.freshness()
+    return apiConditional(mimetype, (count, updated_at), updated_at, build)
+
+
+def searchPage():
+    """Returns query, page number and that page of search results, plus
+    whether another page follows; read from ?q= and ?page=.
+    """
+    query = request.args.get('q', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    # One extra result tells us if there is a next page
+    results = search.search(query, SEARCH_PAGE_SIZE + 1,
+                            (page - 1) * SEARCH_PAGE_SIZE)
+    has_next = len(results) > SEARCH_PAGE_SIZE
+    return query, page, results[:SEARCH_PAGE_SIZE], has_next
+
+
+@catalog.route('/search/json')
+def searchJSON():
+    """ Creates JSON information; part of API
+
+    Ranked item matches for ?q=, paged with ?page=
+    """
+    query, page, results, has_next = searchPage()
+    next_url = None
+    if has_next:
+        next_url = url_for('.searchJSON', q=query, page=page + 1)
+    return jsonify(items=results, next=next_url)
+
+
+@catalog.route('/search')
+@login_required
+def searchItems():
+    """Search form and ranked results, with matches highlighted"""
+    query, page, results, has_next = searchPage()
+    return render_template('search.html', query=query, page=page,
+                           results=results, has_next=has_next,
+                           user_curr=getUser())
 
 
 # Show all user categories
-@app.route('/')
+@catalog.route('/')
 @login_required
 def showCategories():
     """If the user is not signed in, redirect to login. Otherwise, show
     the categories they own sorted alphabetically.
     """
-    user = User.by_email(login_session['email'])
-    categories = Category.by_user(user.user_id)
-    return render_template('category_loop.html', categories=categories,
-                           user_curr=user)
+    user = getUser()
 
+    def build():
+        categories = [category.view()
+                      for category in Category.page_by_user(user.user_id)]
+        return render_template('category_loop.html', categories=categories,
+                               user_curr=user)
 
-@app.route('/category/<int:category_id>/edit/', methods=['GET', 'POST'])
-@app.route('/category/new', methods=['GET', 'POST'])
+    count, updated_at = Category.freshness(user.user_id)
+    return conditional((user.user_id, count, updated_at), updated_at, build)
+
+
+@catalog.route('/category/<int:category_id>/edit/', methods=['GET', 'POST'])
+@catalog.route('/category/new', methods=['GET', 'POST'])
 def adminCategory(category_id=None):
     """ If method is a POST, it sorts through the possibilities, editing
     the category appropriately. Otherwise, the admin page is displayed.
@@ -247,14 +591,19 @@ def categoryDelete(category_id):
 
     Result:
         redirects user to full category list, showing them category is deleted.
+        If the user does not own the category, nothing is deleted.
     """
-    items = Item.by_category_id(category_id)
-    for item in items:
-        session.delete(item)
-        session.commit()
-    category = Category.by_id(category_id)
-    session.delete(category)
-    session.commit()
+    if category_id is None:
+        # User escaped from new category process
+        return redirect('/')
+    # Their rows go with one bulk DELETE, so collect the items' images first
+    item_images = Item.images_by_category_id(category_id)
+    if not Category.delete(category_id, getUser().user_id):
+        return categoryAdminNotAllowed()
+    store = images.store()
+    for image in item_images:
+        store.remove(image)
+    flash("Category deleted.")
     return redirect('/')
 
 
@@ -296,7 +645,7 @@ def adminCategoryGET(category_id=None):
                            user_curr=user)
 
 
-@app.route('/category/<int:category_id>')
+@catalog.route('/category/<int:category_id>')
 @login_required
 def categorySingle(category_id):
     """If user is not logged in, they are redirected to log in page.
@@ -305,16 +654,31 @@ def categorySingle(category_id):
         category_id: used to filter the list. This category, alone,
                      will appear on the page, with its items.
     """
-    user = User.by_email(login_session['email'])
-    if category_id:
-        category = Category.by_id(category_id)
-    return render_template('category_single.html',
-                           category=category,
-                           user_curr=user)
+    user = getUser()
+
+    def build():
+        if category is None:
+            abort(404)
+        # On a hit the row read for the ETag is all the page needs
+        fragment = cached_fragment('category', category_id, updated_at,
+                                   True)
+        if fragment is not None:
+            return render_template('category_single.html',
+                                   fragment=fragment, user_curr=user)
+        page = Category.page_by_id(category_id)
+        if page is None:
+            abort(404)
+        return render_template('category_single.html',
+                               category=page.view(with_items=True),
+                               user_curr=user)
 
+    category = Category.by_id(category_id)
+    updated_at = category.updated_at if category else None
+    return conditional((user.user_id, updated_at), updated_at, build)
 
-@app.route('/item/<int:item_id>/edit/', methods=['GET', 'POST'])
-@app.route('/item/new', methods=['GET', 'POST'])
+
+@catalog.route('/item/<int:item_id>/edit/', methods=['GET', 'POST'])
+@catalog.route('/item/new', methods=['GET', 'POST'])
 @login_required
 def adminItem(item_id=None):
     """If user is not logged in, they are redirected to the log in screen.
@@ -339,16 +703,19 @@ def itemDelete(redirect_category_id, item_id=None):
     1) User clicks delete while on screen to create new item - reload
        to category list page.
     2) User clicks delete while modifying an item - remove item from
-       table and reload to parent category's page.
+       table and reload to parent category's page. Only the item's owner
+       may delete it.
     """
     if item_id is None:
         # User escaped from new item process
         return redirect('/')
     else:
         item = Item.by_id(item_id)
-        if item:
-            session.delete(item)
-            session.commit()
+        image = item.image if item else None
+        if not Item.delete(item_id, getUser().user_id):
+            flash("Action not allowed. User IDs must match.")
+        elif image:
+            images.store().remove(image)
         return redirect('/category/' + redirect_category_id)
 
 
@@ -373,6 +740,9 @@ def itemAddOrUpdate(request, item_id=None):
         if item:
             msg = 'New Item Successfully Updated'
             flash(msg)
+            upload = request.files.get('image')
+            if upload and upload.filename:
+                itemImageUpload(item, upload)
             return redirect('/category/' + category_id)
         else:
             msg = 'An Error Occurred, Item did not update or add'
@@ -381,12 +751,28 @@ def itemAddOrUpdate(request, item_id=None):
             return render_template('item_admin.html',
                                    name=name, category_id=category_id,
                                    description=description,
-                                   user_curr=getUser())
+                                   user_curr=user)
     else:
         msg = 'Please provide a value in all fields'
         flash(msg)
         return render_template('item_admin.html',
-                               user_curr=getUser())
+                               user_curr=user)
+
+
+def itemImageUpload(item, upload):
+    """Stores an uploaded image as the item's own, replacing any earlier
+    one. Problems with the file are flashed to the user.
+    """
+    store = images.store()
+    try:
+        image = store.save_original(item.item_id, upload.stream,
+                                    current_app.config['MAX_CONTENT_LENGTH'])
+    except ValueError as e:
+        flash(str(e))
+        return
+    previous = Item.set_image(item, image)
+    if previous and previous != image:
+        store.remove(previous)
 
 
 def itemAdminFields(request):
@@ -397,10 +783,6 @@ def itemAdminFields(request):
     return name, category_id, description
 
 
-def getUser():
-    return User.by_email(login_session['email'])
-
-
 def itemAdminGET(item_id=None):
     """ Loads item admin page, with correct values, when necessary.
 
@@ -410,12 +792,14 @@ def itemAdminGET(item_id=None):
     Returns:
         item_admin.html page, correctly rendered for type of admin required.
     """
-    item_name, category_id, item_description = itemValuesIfPresent(item_id)
+    item_name, category_id, item_description, item_image = \
+        itemValuesIfPresent(item_id)
     user, categories = getUserCategories()
     return render_template('item_admin.html', user_curr=user,
                            categories=categories, item_name=item_name,
                            category_id=category_id,
-                           item_description=item_description)
+                           item_description=item_description,
+                           item_image=item_image)
 
 
 def itemValuesIfPresent(item_id=None):
@@ -428,27 +812,78 @@ def itemValuesIfPresent(item_id=None):
         item_name: value from Item table or empty string
         category_id: value from Item table or empty string
         item_description: value from Item table or empty string
+        item_image: name of the item's image original, or None
     """
     item_name = ""
     category_id = ""
     item_description = ""
+    item_image = None
     if item_id:
         item = Item.by_id(item_id)
         if item:
             item_name = item.item_name
             category_id = item.category_id
             item_description = item.item_description
-    return item_name, category_id, item_description
+            item_image = item.image
+    return item_name, category_id, item_description, item_image
 
 
 def getUserCategories():
     """ Returns both user and categories for logged in user"""
-    user = User.by_email(login_session['email'])
-    categories = Category.by_user(user.user_id)
+    user = getUser()
+    categories = [category.view()
+                  for category in Category.by_user(user.user_id)]
     return user, categories
 
 
+def compile_templates(app):
+    """Loads every template of app, compiling those not yet in the
+    bytecode cache.
+
+    Returns:
+        number of templates loaded
+    """
+    environment = app.jinja_env
+    names = environment.list_templates()
+    for name in names:
+        environment.get_template(name)
+    return len(names)
+
+
+def create_app(config=Config):
+    """Builds the catalog app. Nothing is read or connected at import; the
+    database engine and OAuth settings are set up here from config, and
+    client_secrets.json is only read at the first sign in.
+
+    Arg:
+        config: settings object, such as config.Config or a subclass
+
+    Returns:
+        Flask application
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+    # Compiled templates are reused across restarts and worker processes
+    app.jinja_options = dict(app.jinja_options, bytecode_cache=(
+        FileSystemBytecodeCache(config.TEMPLATE_CACHE_DIR or None)))
+    app.add_template_global(cached)
+    init_engine(config)
+    oauth_client.configure(config)
+    app.register_blueprint(catalog)
+    assets.init_app(app)
+    images.init_app(app)
+    snapshot.init_app(app)
+    write_queue.init_app(app)
+    instrumentation.init_app(app, *engines())
+    if config.DATABASE_REPLICA_URLS:
+        app.before_request(routeReads)
+        app.after_request(stickToPrimary)
+    app.teardown_appcontext(shutdown_session)
+    return app
+
+
 if __name__ == '__main__':
-    app.secret_key = 'super_secret_key'
+    logging.basicConfig(level=logging.INFO)
+    app = create_app()
     app.debug = True
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,337 @@
+"""Command line tasks for the item catalog.
+
+Usage:
+    python manage.py initdb
+    python manage.py migrate
+    python manage.py import catalog.csv --owner someone@example.com
+    python manage.py export catalog.ndjson [--owner someone@example.com]
+    python manage.py rebuild-search
+    python manage.py check-counts [--repair]
+    python manage.py build-assets
+    python manage.py compile-templates
+
+Catalog files hold one item per row with the fields category_name,
+item_name and item_description, as CSV (with a header row) or NDJSON (one
+JSON object per line). The format is taken from the file extension unless
+--format is given.
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+from sqlalchemy import select
+
+import assets
+import migrations
+import search
+from database_setup import User, Category, Item, session
+from database_setup import get_engine, init_db
+from config import Config
+
+FIELDS = ('category_name', 'item_name', 'item_description')
+PY2 = sys.version_info[0] == 2
+
+
+class Progress(object):
+    """Reports rows handled and throughput to stderr"""
+
+    def __init__(self, verb):
+        self.verb = verb
+        self.count = 0
+        self.started = time.time()
+
+    def add(self, count):
+        self.count += count
+        self.report()
+
+    def report(self, final=False):
+        elapsed = max(time.time() - self.started, 1e-6)
+        print('%s %d items in %.1fs (%d items/s)%s'
+              % (self.verb, self.count, elapsed, self.count / elapsed,
+                 '' if final else '...'),
+              file=sys.stderr)
+
+
+def _format(path, format):
+    """Returns format, or the one implied by the extension of path"""
+    if format:
+        return format
+    return 'ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+def read_rows(path, format):
+    """Yields one dict per item in the catalog file at path"""
+    if format == 'ndjson':
+        with io.open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif PY2:
+        with open(path, 'rb') as f:
+            for row in csv.DictReader(f):
+                yield dict((k, v.decode('utf-8')) for k, v in row.items())
+    else:
+        with io.open(path, encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                yield row
+
+
+def write_rows(path, format, rows):
+    """Writes rows, tuples in FIELDS order, to the catalog file at path"""
+    if format == 'ndjson':
+        with io.open(path, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(u'%s\n' % json.dumps(dict(zip(FIELDS, row))))
+    elif PY2:
+        with open(path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            for row in rows:
+                writer.writerow([v.encode('utf-8') for v in row])
+    else:
+        with io.open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            for row in rows:
+                writer.writerow(row)
+
+
+def import_catalog(path, owner, format=None, batch_size=10000):
+    """Loads every item in the catalog file into the database.
+
+    Categories are matched by name among the owner's categories and created
+    when missing. Items are inserted batch_size at a time, one transaction
+    per batch, so a failure part way keeps all completed batches.
+
+    Args:
+        path: catalog file to read
+        owner: User who will own the new categories and items
+        format: 'csv' or 'ndjson'; taken from the extension if None
+        batch_size: items per insert batch and transaction
+
+    Returns:
+        number of items imported
+    """
+    category_ids = dict(session.query(Category.category_name,
+                                      Category.category_id)
+                        .filter_by(user_id=owner.user_id))
+    progress = Progress('Imported')
+    batch = []
+    for row in read_rows(path, _format(path, format)):
+        name = row['category_name']
+        if name not in category_ids:
+            category = Category(category_name=name, user_id=owner.user_id,
+                                owner_name=owner.user_name)
+            session.add(category)
+            session.flush()
+            category_ids[name] = category.category_id
+        batch.append({'item_name': row['item_name'],
+                      'item_description': row['item_description'],
+                      'category_id': category_ids[name],
+                      'user_id': owner.user_id})
+        if len(batch) == batch_size:
+            _insert_items(batch)
+            progress.add(len(batch))
+            batch = []
+    _insert_items(batch)
+    progress.count += len(batch)
+    progress.report(final=True)
+    return progress.count
+
+
+def _insert_items(batch):
+    """Inserts a batch of item mappings and commits it, counting the items
+    into their categories.
+    """
+    if batch:
+        session.bulk_insert_mappings(Item, batch)
+        counts = Counter(row['category_id'] for row in batch)
+        for category_id, count in counts.items():
+            Category.add_items(category_id, count)
+    session.commit()
+
+
+def export_catalog(path, owner=None, format=None, batch_size=10000):
+    """Writes every item, optionally only the owner's, to a catalog file.
+
+    Rows are streamed from the database batch_size at a time.
+
+    Returns:
+        number of items exported
+    """
+    query = (select([Category.category_name, Item.item_name,
+                     Item.item_description])
+             .select_from(Item.__table__.join(Category.__table__))
+             .order_by(Category.category_name, Item.item_name))
+    if owner is not None:
+        query = query.where(Item.user_id == owner.user_id)
+    result = session.connection().execution_options(
+        stream_results=True).execute(query)
+    progress = Progress('Exported')
+
+    def rows():
+        while True:
+            batch = result.fetchmany(batch_size)
+            if not batch:
+                break
+            for row in batch:
+                yield tuple(row)
+            progress.add(len(batch))
+
+    write_rows(path, _format(path, format), rows())
+    progress.report(final=True)
+    return progress.count
+
+
+def rebuild_search():
+    """Creates the item search index, if missing, and re-indexes every
+    item from the item table.
+    """
+    started = time.time()
+    with get_engine().begin() as connection:
+        if connection.dialect.name != 'sqlite':
+            print('%s search needs no index' % connection.dialect.name,
+                  file=sys.stderr)
+            return
+        search.install(connection)
+        search.rebuild(connection)
+    print('Rebuilt search index in %.1fs' % (time.time() - started),
+          file=sys.stderr)
+
+
+def build_assets():
+    """Builds the fingerprinted static assets and their manifest"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    out_dir = os.path.join(root, Config.ASSETS_DIR)
+    manifest = assets.build(os.path.join(root, 'static'), out_dir)
+    for name, built in sorted(manifest['assets'].items()):
+        path = os.path.join(out_dir, built)
+        sizes = ['%d' % os.path.getsize(path)]
+        for encoding in manifest['encodings'][built]:
+            sizes.append('%s %d' % (encoding, os.path.getsize(
+                path + assets.SUFFIXES[encoding])))
+        print('%s -> %s (%s bytes)' % (name, built, ', '.join(sizes)),
+              file=sys.stderr)
+
+
+def compile_templates():
+    """Compiles every template into the bytecode cache, so new processes
+    start without parsing them.
+    """
+    import main
+    print('Compiled %d templates' % main.compile_templates(main.create_app()),
+          file=sys.stderr)
+
+
+def check_counts(repair=False):
+    """Reports categories whose item count or owner name is wrong, and
+    fixes them if repair is True.
+
+    Returns:
+        number of categories found wrong
+    """
+    with get_engine().begin() as connection:
+        errors = Category.summary_errors(connection)
+        for row in errors:
+            print('Category %d: %d items counted, %d found; owner "%s", '
+                  'should be "%s"' % (row.category_id, row.item_count,
+                                      row.actual_count, row.owner_name,
+                                      row.actual_owner), file=sys.stderr)
+        if errors and repair:
+            repaired = Category.repair_summaries(
+                connection, [row.category_id for row in errors])
+            print('Repaired %d categories' % repaired, file=sys.stderr)
+        elif not errors:
+            print('All category counts and owners are correct',
+                  file=sys.stderr)
+    return len(errors)
+
+
+def create_database():
+    """Creates any missing tables, then applies outstanding migrations"""
+    init_db()
+    migrate()
+
+
+def migrate():
+    """Applies outstanding migrations to the database"""
+    try:
+        applied = migrations.upgrade()
+    except migrations.MigrationError as e:
+        sys.exit(str(e))
+    for number, description in applied:
+        print('Applied %d: %s' % (number, description), file=sys.stderr)
+    if not applied:
+        print('Database is up to date', file=sys.stderr)
+
+
+def _owner(email, required):
+    """Returns the User for email; exits if required and not found"""
+    owner = User.by_email(email) if email else None
+    if owner is None and (required or email):
+        sys.exit('No user with email %s; log in once to create it.' % email)
+    return owner
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Item catalog tasks')
+    commands = parser.add_subparsers(dest='command')
+
+    commands.add_parser('initdb', help='Create and migrate the database')
+    commands.add_parser('migrate', help='Apply outstanding migrations')
+
+    load = commands.add_parser('import', help='Load items from a file')
+    load.add_argument('path')
+    load.add_argument('--owner', required=True,
+                      help='email of the user who will own the items')
+    load.add_argument('--format', choices=('csv', 'ndjson'))
+    load.add_argument('--batch-size', type=int, default=10000)
+
+    dump = commands.add_parser('export', help='Write items to a file')
+    dump.add_argument('path')
+    dump.add_argument('--owner', help='only export this user\'s items')
+    dump.add_argument('--format', choices=('csv', 'ndjson'))
+    dump.add_argument('--batch-size', type=int, default=10000)
+
+    commands.add_parser('rebuild-search', help='Re-index items for search')
+    check = commands.add_parser('check-counts',
+                                help='Check category item counts and owners')
+    check.add_argument('--repair', action='store_true',
+                       help='fix any that are wrong')
+    commands.add_parser('build-assets', help='Build static asset bundles')
+    commands.add_parser('compile-templates',
+                        help='Fill the template bytecode cache')
+
+    args = parser.parse_args(argv)
+    if args.command == 'initdb':
+        create_database()
+    elif args.command == 'migrate':
+        migrate()
+    elif args.command == 'import':
+        import_catalog(args.path, _owner(args.owner, True), args.format,
+                       args.batch_size)
+    elif args.command == 'export':
+        export_catalog(args.path, _owner(args.owner, False), args.format,
+                       args.batch_size)
+    elif args.command == 'rebuild-search':
+        rebuild_search()
+    elif args.command == 'check-counts':
+        if check_counts(args.repair) and not args.repair:
+            sys.exit(1)
+    elif args.command == 'build-assets':
+        build_assets()
+    elif args.command == 'compile-templates':
+        compile_templates()
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
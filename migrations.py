@@ -0,0 +1,174 @@
+"""Versioned schema migrations for existing item catalog databases.
+
+Base.metadata.create_all() builds new databases at the current schema, but
+never alters tables that already exist. Each migration below moves an older
+database forward one step; the highest version applied is recorded in the
+schema_version table. Migrations check before they change anything, so they
+are also safe to run against a freshly created database.
+
+Usage:
+    python migrations.py        (or: python manage.py migrate)
+"""
+from __future__ import print_function
+
+import sys
+from datetime import datetime
+
+from sqlalchemy import DateTime, inspect, text
+
+import search
+from database_setup import Category, get_engine
+
+
+class MigrationError(Exception):
+    """A migration cannot be applied until the data is fixed; the message
+    says what to fix. Nothing has been changed.
+    """
+
+
+def _create_index(connection, name, table, columns, unique=False):
+    """Creates index name on table(columns), unless it already exists"""
+    connection.execute(text('CREATE %sINDEX IF NOT EXISTS %s ON "%s" (%s)'
+                            % ('UNIQUE ' if unique else '', name, table,
+                               ', '.join(columns))))
+
+
+def _add_column(connection, table, name, ddl):
+    """Adds column name, declared as ddl, unless table already has it.
+
+    Returns:
+        True if the column was added
+    """
+    columns = [c['name'] for c in inspect(connection).get_columns(table)]
+    if name in columns:
+        return False
+    connection.execute(text('ALTER TABLE "%s" ADD COLUMN %s %s'
+                            % (table, name, ddl)))
+    return True
+
+
+def _duplicate_emails(connection):
+    """Returns (email, [user ids]) for each email more than one user has,
+    in email order.
+    """
+    rows = connection.execute(text(
+        'SELECT email, user_id FROM "user" WHERE email IN '
+        '(SELECT email FROM "user" GROUP BY email HAVING COUNT(*) > 1) '
+        'ORDER BY email, user_id'))
+    duplicates = []
+    for email, user_id in rows:
+        if not duplicates or duplicates[-1][0] != email:
+            duplicates.append((email, []))
+        duplicates[-1][1].append(user_id)
+    return duplicates
+
+
+def _add_lookup_indexes(connection):
+    """Indexes the columns used by User.by_email, Category.by_user and
+    Item.by_category_id. Emails become unique; databases from before the
+    index may hold duplicates, which must be merged first.
+    """
+    duplicates = _duplicate_emails(connection)
+    if duplicates:
+        raise MigrationError(
+            'Each email must belong to one user before it can be uniquely '
+            'indexed. Shared emails: %s. Merge or change those users, then '
+            'migrate again.' % '; '.join(
+                '%s (user ids %s)' % (email, ', '.join(map(str, user_ids)))
+                for email, user_ids in duplicates))
+    _create_index(connection, 'ix_user_email', 'user', ['email'], unique=True)
+    _create_index(connection, 'ix_category_user_id_name', 'category',
+                  ['user_id', 'category_name'])
+    _create_index(connection, 'ix_item_category_id_name', 'item',
+                  ['category_id', 'item_name'])
+
+
+def _add_updated_at(connection):
+    """Adds modification stamps to category and item; existing rows are
+    stamped with the time of the migration.
+    """
+    now = datetime.utcnow()
+    ddl = DateTime().compile(dialect=connection.dialect)
+    for table in ('category', 'item'):
+        if _add_column(connection, table, 'updated_at', ddl):
+            connection.execute(text('UPDATE "%s" SET updated_at = :now'
+                                    % table), now=now)
+
+
+def _add_item_search(connection):
+    """Creates the full-text index over items and fills it (SQLite only)"""
+    if connection.dialect.name == 'sqlite':
+        search.install(connection)
+        search.rebuild(connection)
+
+
+def _add_item_image(connection):
+    """Adds the name of each item's uploaded image"""
+    _add_column(connection, 'item', 'image', 'VARCHAR(64)')
+
+
+def _add_category_summaries(connection):
+    """Adds the item count and owner name kept on each category, and
+    fills them in.
+    """
+    _add_column(connection, 'category', 'item_count',
+                "INTEGER NOT NULL DEFAULT 0")
+    _add_column(connection, 'category', 'owner_name',
+                "VARCHAR(250) NOT NULL DEFAULT ''")
+    Category.repair_summaries(connection)
+
+
+# (version, description, function) - append only, never renumber
+MIGRATIONS = [
+    (1, 'Index lookup columns', _add_lookup_indexes),
+    (2, 'Track category and item modification times', _add_updated_at),
+    (3, 'Full-text search over items', _add_item_search),
+    (4, 'Item images', _add_item_image),
+    (5, 'Item counts and owner names on categories',
+     _add_category_summaries),
+]
+
+
+def current_version(connection):
+    """Returns the schema version of the database; 0 if never migrated"""
+    if 'schema_version' not in inspect(connection).get_table_names():
+        connection.execute(text('CREATE TABLE schema_version '
+                                '(version INTEGER NOT NULL)'))
+    version = connection.execute(
+        text('SELECT MAX(version) FROM schema_version')).scalar()
+    return version or 0
+
+
+def upgrade(bind=None):
+    """Applies outstanding migrations, in order, in a single transaction.
+
+    Arg:
+        bind: engine for the database to be upgraded; defaults to the
+              database named in config.py
+
+    Returns:
+        list of (version, description) for each migration applied
+    """
+    applied = []
+    with (bind or get_engine()).begin() as connection:
+        version = current_version(connection)
+        for number, description, migrate in MIGRATIONS:
+            if number <= version:
+                continue
+            migrate(connection)
+            connection.execute(
+                text('INSERT INTO schema_version (version) VALUES (:v)'),
+                v=number)
+            applied.append((number, description))
+    return applied
+
+
+if __name__ == '__main__':
+    try:
+        applied = upgrade()
+    except MigrationError as e:
+        sys.exit(str(e))
+    for number, description in applied:
+        print('Applied %d: %s' % (number, description))
+    if not applied:
+        print('Database is up to date')
@@ -0,0 +1,375 @@
+"""Outbound HTTP for the Google OAuth flow used by gconnect/gdisconnect.
+
+Every call goes through one pooled, keep-alive requests session per
+process, with connect/read timeouts and a bounded number of retries on
+connection errors and 5xx responses. Token validation and the user profile
+are fetched concurrently on a small thread pool.
+
+Validated access tokens are remembered in token_cache until they expire,
+and tokens that arrive with an id_token from the code exchange are
+validated from its claims once its signature checks out against the
+provider's published keys, so most sign ins never call tokeninfo.
+
+Provider URLs come from config.py, so the whole flow can be pointed at the
+offline stub in oauth_stub.py for load tests.
+"""
+import base64
+import calendar
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import httplib2
+import requests
+import rsa
+from rsa.transform import bytes2int
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from multiprocessing.pool import ThreadPool
+
+from oauth2client.client import OAuth2WebServerFlow
+
+from config import Config
+from fragment_cache import LRUCache
+
+ID_TOKEN_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+# How long signing keys are kept when the provider gives no max-age
+SIGNING_KEYS_MAX_AGE = 3600
+
+# Replaced by configure(); read at call time
+settings = Config
+
+_lock = threading.Lock()
+_pid = None
+_http_session = None
+_pool = None
+_client_secrets = None
+_flow = None
+_local = threading.local()
+_signing_keys = None  # (keys by kid, time to fetch them again)
+
+
+def configure(config):
+    """Applies the OAuth settings of config; called by create_app()"""
+    global settings, _pid, _client_secrets, _flow, _signing_keys
+    global token_cache
+    with _lock:
+        if _pool is not None and _pid == os.getpid():
+            _pool.close()
+        settings = config
+        _pid = None
+        _client_secrets = None
+        _flow = None
+        _signing_keys = None
+    token_cache = TokenCache(config.TOKEN_CACHE_SIZE,
+                             config.TOKEN_CACHE_MAX_TTL)
+
+
+def client_secrets():
+    """Returns the 'web' section of the client secrets file, read once"""
+    global _client_secrets
+    if _client_secrets is None:
+        with open(settings.CLIENT_SECRETS_FILE) as f:
+            _client_secrets = json.load(f)['web']
+    return _client_secrets
+
+
+def client_id():
+    """Returns this app's OAuth client ID"""
+    return client_secrets()['client_id']
+
+
+def _timeout():
+    return (settings.OAUTH_CONNECT_TIMEOUT, settings.OAUTH_READ_TIMEOUT)
+
+
+def _resources():
+    """Returns this process's HTTP session and thread pool, creating them
+    on first use - and again after a fork, since neither survives one.
+    """
+    global _pid, _http_session, _pool
+    with _lock:
+        if _pid != os.getpid():
+            retry = Retry(total=settings.OAUTH_RETRIES,
+                          backoff_factor=0.1,
+                          status_forcelist=(500, 502, 503, 504))
+            adapter = HTTPAdapter(pool_connections=2,
+                                  pool_maxsize=settings.OAUTH_POOL_SIZE,
+                                  max_retries=retry)
+            _http_session = requests.Session()
+            _http_session.mount('https://', adapter)
+            _http_session.mount('http://', adapter)
+            _pool = ThreadPool(settings.OAUTH_POOL_SIZE)
+            _pid = os.getpid()
+        return _http_session, _pool
+
+
+def _get_json(url, **params):
+    """GETs url through the pooled session; returns the decoded body"""
+    http_session, _ = _resources()
+    return http_session.get(url, params=params, timeout=_timeout()).json()
+
+
+def exchange_code(code):
+    """Upgrades a one-time authorization code into a credentials object.
+
+    oauth2client talks httplib2, which is not thread safe, so each thread
+    keeps its own keep-alive Http instance.
+
+    Raises:
+        FlowExchangeError: if the provider rejects the code
+    """
+    http = getattr(_local, 'http', None)
+    if http is None:
+        http = httplib2.Http(timeout=settings.OAUTH_READ_TIMEOUT)
+        _local.http = http
+    return _oauth_flow().step2_exchange(code, http=http)
+
+
+def _oauth_flow():
+    """Returns the flow for exchanging codes, built once. step2_exchange
+    only reads the flow, so one instance serves every thread.
+    """
+    global _flow
+    if _flow is None:
+        secrets = client_secrets()
+        _flow = OAuth2WebServerFlow(
+            secrets['client_id'], secrets['client_secret'], scope='',
+            redirect_uri='postmessage', auth_uri=secrets['auth_uri'],
+            token_uri=settings.OAUTH_TOKEN_URI or secrets['token_uri'])
+    return _flow
+
+
+def token_info(access_token):
+    """Returns the provider's validation of access_token, as a dict"""
+    return _get_json(settings.OAUTH_API_URL + '/oauth2/v1/tokeninfo',
+                     access_token=access_token)
+
+
+def user_info(access_token):
+    """Returns the profile (name, email, picture) of the token's user"""
+    return _get_json(settings.OAUTH_API_URL + '/oauth2/v1/userinfo',
+                     access_token=access_token, alt='json')
+
+
+def signing_keys():
+    """Returns the keys the provider signs id_tokens with, as a dict of
+    rsa.PublicKey by key ID. They are fetched from its JWKS document and
+    kept for as long as its Cache-Control allows.
+
+    Returns:
+        None if they cannot be fetched
+    """
+    global _signing_keys
+    cached = _signing_keys
+    if cached is not None and cached[1] > time.time():
+        return cached[0]
+    http_session, _ = _resources()
+    try:
+        response = http_session.get(
+            settings.OAUTH_API_URL + '/oauth2/v3/certs', timeout=_timeout())
+        response.raise_for_status()
+        keys = dict((key['kid'], rsa.PublicKey(_b64int(key['n']),
+                                               _b64int(key['e'])))
+                    for key in response.json()['keys']
+                    if key.get('kty') == 'RSA')
+    except (requests.RequestException, ValueError, KeyError):
+        return None
+    max_age = re.search(r'max-age=(\d+)',
+                        response.headers.get('Cache-Control', ''))
+    max_age = int(max_age.group(1)) if max_age else SIGNING_KEYS_MAX_AGE
+    _signing_keys = (keys, time.time() + max_age)
+    return keys
+
+
+def _b64decode(segment):
+    """Decodes unpadded base64url, as JWTs and JWKs use"""
+    segment = segment.encode('ascii')
+    return base64.urlsafe_b64decode(segment + b'=' * (-len(segment) % 4))
+
+
+def _b64int(segment):
+    return bytes2int(_b64decode(segment))
+
+
+def verify_id_token(id_token, keys):
+    """Returns the claims of id_token if it is signed (RS256) by one of
+    keys, issued by the provider for this app, and not expired.
+
+    Args:
+        id_token: the JWT, as the token endpoint returned it
+        keys: rsa.PublicKey by key ID; see signing_keys()
+
+    Returns:
+        claims dict; None if id_token fails any check
+    """
+    try:
+        header, payload, signature = id_token.split('.')
+        key = keys.get(json.loads(_b64decode(header).decode('utf-8'))
+                       .get('kid'))
+        if key is None:
+            return None
+        method = rsa.verify(('%s.%s' % (header, payload)).encode('ascii'),
+                            _b64decode(signature), key)
+        claims = json.loads(_b64decode(payload).decode('utf-8'))
+    except (ValueError, TypeError, AttributeError, rsa.VerificationError):
+        return None
+    if (method != 'SHA-256' or claims.get('iss') not in ID_TOKEN_ISSUERS or
+            claims.get('aud') != client_id() or
+            claims.get('exp', 0) <= time.time()):
+        return None
+    return claims
+
+
+class TokenCache(object):
+    """Validated access tokens, keyed by a hash of the token so the cache
+    never holds usable credentials. Entries are dropped when the token
+    expires, or sooner if the cache is full.
+    """
+
+    def __init__(self, max_entries=10000, max_ttl=3600):
+        self._entries = LRUCache(max_entries, max_ttl)
+
+    @staticmethod
+    def _key(access_token):
+        return hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+
+    def get(self, access_token):
+        """Returns the cached validation of access_token; None if it is
+        unknown or has expired.
+        """
+        entry = self._entries.get(self._key(access_token))
+        if entry is None or entry['expires_at'] <= time.time():
+            return None
+        return entry
+
+    def put(self, access_token, user_id, issued_to, expires_at):
+        """Remembers a validated token until expires_at (epoch seconds)"""
+        self._entries.set(self._key(access_token),
+                          {'user_id': user_id, 'issued_to': issued_to,
+                           'expires_at': expires_at})
+
+    def discard(self, access_token):
+        self._entries.delete(self._key(access_token))
+
+
+token_cache = TokenCache(Config.TOKEN_CACHE_SIZE,
+                         Config.TOKEN_CACHE_MAX_TTL)
+
+
+def validate_token(access_token, id_token=None, token_expiry=None):
+    """Returns the validation of access_token, shaped like tokeninfo's
+    response (user_id, issued_to; or error).
+
+    Checks, in order: token_cache; the id_token returned with the token by
+    the code exchange, if its signature verifies against the provider's
+    keys; and finally the remote tokeninfo endpoint, which also covers
+    id_tokens that do not verify and keys that cannot be fetched.
+    Successful validations are cached.
+
+    Args:
+        access_token: token to be validated
+        id_token: the id_token JWT from the exchange, if any
+        token_expiry: naive UTC datetime at which access_token expires
+    """
+    cached = token_cache.get(access_token)
+    if cached is not None:
+        return cached
+    now = time.time()
+    if token_expiry is not None:
+        expires_at = calendar.timegm(token_expiry.utctimetuple())
+    else:
+        expires_at = now + settings.TOKEN_CACHE_MAX_TTL
+    claims = None
+    if id_token:
+        keys = signing_keys()
+        if keys:
+            claims = verify_id_token(id_token, keys)
+    if claims is not None:
+        result = {'user_id': claims['sub'],
+                  'issued_to': claims.get('azp', claims.get('aud'))}
+    else:
+        result = token_info(access_token)
+        if result.get('error') is not None:
+            return result
+        if 'expires_in' in result:
+            expires_at = now + int(result['expires_in'])
+    expires_at = min(expires_at, now + settings.TOKEN_CACHE_MAX_TTL)
+    token_cache.put(access_token, result['user_id'], result['issued_to'],
+                    expires_at)
+    return result
+
+
+def token_and_user_info(access_token, id_token=None, token_expiry=None):
+    """Validates access_token while fetching user_info concurrently.
+
+    Returns:
+        (validation, user_info) dicts; see validate_token
+
+    Raises:
+        multiprocessing.TimeoutError: if user_info takes too long
+    """
+    _, pool = _resources()
+    profile = pool.apply_async(user_info, (access_token,))
+    validation = validate_token(access_token, id_token, token_expiry)
+    return validation, profile.get(settings.OAUTH_READ_TIMEOUT * 2)
+
+
+def revoke(access_token):
+    """Revokes access_token; returns True if the provider accepted"""
+    token_cache.discard(access_token)
+    http_session, _ = _resources()
+    response = http_session.get(
+        settings.OAUTH_ACCOUNTS_URL + '/o/oauth2/revoke',
+        params={'token': access_token}, timeout=_timeout())
+    return response.status_code == 200
+
+
+class LatencyRecorder(object):
+    """Keeps the most recent durations and reports percentiles of them"""
+
+    def __init__(self, size=10000):
+        self.size = size
+        self._samples = []
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            if len(self._samples) > self.size:
+                del self._samples[:len(self._samples) - self.size]
+
+    def time(self):
+        """Context manager recording the duration of its block"""
+        return _Timer(self)
+
+    def percentiles(self, points=(50, 95, 99)):
+        """Returns {point: seconds} for the recorded samples; {} if none"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {}
+        return dict((p, samples[min(len(samples) - 1,
+                                    int(len(samples) * p / 100.0))])
+                    for p in points)
+
+
+class _Timer(object):
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.add(time.time() - self.started)
+
+
+# Durations of complete gconnect calls
+login_latency = LatencyRecorder()
@@ -0,0 +1,193 @@
+"""Offline stand-in for Google's OAuth endpoints, for load testing sign in.
+
+Serve the stub and point the app at it:
+    python oauth_stub.py serve --port 5001
+    CATALOG_OAUTH_API_URL=http://127.0.0.1:5001 \\
+    CATALOG_OAUTH_ACCOUNTS_URL=http://127.0.0.1:5001 \\
+    CATALOG_OAUTH_TOKEN_URI=http://127.0.0.1:5001/token python main.py
+
+Or drive gconnect in-process against it and report latency percentiles:
+    python oauth_stub.py drive --logins 500 --threads 8
+
+Any authorization code is accepted; the code picks one of a few stub users,
+so repeated runs reuse the same User rows. Use a scratch database
+(CATALOG_DATABASE_URL) when driving, as sign in creates those users.
+"""
+from __future__ import print_function
+
+import argparse
+import base64
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import rsa
+from flask import Flask, jsonify, request
+from rsa.transform import int2bytes
+
+STUB_USERS = 10
+TOKEN_LIFETIME = 3600
+# Small, as pure Python key generation is slow and this key guards nothing
+KEY_BITS = 1024
+KEY_ID = 'stub'
+
+stub = Flask(__name__)
+_tokens = {}
+_key_lock = threading.Lock()
+_keys = []  # (public, private) once made
+
+
+def _client_id():
+    from oauth_client import client_id
+    return client_id()
+
+
+def _key_pair():
+    """Returns the stub's signing key pair, made on first use"""
+    with _key_lock:
+        if not _keys:
+            _keys.append(rsa.newkeys(KEY_BITS))
+        return _keys[0]
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _id_token(claims):
+    """Returns claims as a JWT signed (RS256) with the stub's key, which
+    /oauth2/v3/certs publishes.
+    """
+    def part(value):
+        return _b64(json.dumps(value).encode('utf-8'))
+    signed = '%s.%s' % (part({'alg': 'RS256', 'kid': KEY_ID}), part(claims))
+    signature = rsa.sign(signed.encode('ascii'), _key_pair()[1], 'SHA-256')
+    return '%s.%s' % (signed, _b64(signature))
+
+
+@stub.route('/oauth2/v3/certs')
+def certs():
+    public = _key_pair()[0]
+    response = jsonify(keys=[{'kty': 'RSA', 'alg': 'RS256', 'use': 'sig',
+                              'kid': KEY_ID, 'n': _b64(int2bytes(public.n)),
+                              'e': _b64(int2bytes(public.e))}])
+    response.headers['Cache-Control'] = 'public, max-age=%d' % TOKEN_LIFETIME
+    return response
+
+
+@stub.route('/token', methods=['POST'])
+def token():
+    code = request.form.get('code', '')
+    user = 'stub-%d' % (hash(code) % STUB_USERS)
+    access_token = uuid.uuid4().hex
+    expires = int(time.time()) + TOKEN_LIFETIME
+    _tokens[access_token] = user
+    client_id = _client_id()
+    return jsonify(access_token=access_token, token_type='Bearer',
+                   expires_in=TOKEN_LIFETIME,
+                   id_token=_id_token({'iss': 'accounts.google.com',
+                                       'sub': user, 'aud': client_id,
+                                       'azp': client_id, 'exp': expires,
+                                       'iat': int(time.time()),
+                                       'email': '%s@example.com' % user}))
+
+
+@stub.route('/oauth2/v1/tokeninfo')
+def tokeninfo():
+    user = _tokens.get(request.args.get('access_token'))
+    if user is None:
+        return jsonify(error='invalid_token'), 400
+    return jsonify(user_id=user, issued_to=_client_id(),
+                   expires_in=TOKEN_LIFETIME)
+
+
+@stub.route('/oauth2/v1/userinfo')
+def userinfo():
+    user = _tokens.get(request.args.get('access_token'))
+    if user is None:
+        return jsonify(error='invalid_token'), 401
+    return jsonify(id=user, name='Stub User %s' % user,
+                   email='%s@example.com' % user,
+                   picture='/static/img/placeholder_200px.jpg')
+
+
+@stub.route('/o/oauth2/revoke')
+def revoke():
+    _tokens.pop(request.args.get('token'), None)
+    return ''
+
+
+def _serve_in_background(port):
+    """Starts the stub on a daemon thread; returns its base URL"""
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', port, stub, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://127.0.0.1:%d' % server.server_port
+
+
+def drive(logins, threads, port):
+    """Signs in logins times, from threads threads, against the stub and
+    prints gconnect latency percentiles.
+    """
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    base_url = _serve_in_background(port)
+    # Settings are read at import, so point them at the stub first
+    os.environ['CATALOG_OAUTH_API_URL'] = base_url
+    os.environ['CATALOG_OAUTH_ACCOUNTS_URL'] = base_url
+    os.environ['CATALOG_OAUTH_TOKEN_URI'] = base_url + '/token'
+    import main
+    import oauth_client
+    app = main.create_app()
+    remaining = [logins]
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                code = 'code-%d' % remaining[0]
+            response = client.post('/gconnect?state=stub', data=code)
+            if response.status_code != 200:
+                print('gconnect returned %d' % response.status_code)
+
+    started = time.time()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - started
+    percentiles = oauth_client.login_latency.percentiles()
+    print('%d logins in %.1fs (%.1f/s)' % (logins, elapsed, logins / elapsed))
+    for point in sorted(percentiles):
+        print('p%d: %.1f ms' % (point, percentiles[point] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline OAuth provider')
+    commands = parser.add_subparsers(dest='command')
+    serve = commands.add_parser('serve', help='Run the stub provider')
+    serve.add_argument('--port', type=int, default=5001)
+    load = commands.add_parser('drive', help='Load test gconnect')
+    load.add_argument('--logins', type=int, default=200)
+    load.add_argument('--threads', type=int, default=8)
+    load.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+    if args.command == 'serve':
+        stub.run(port=args.port, threaded=True)
+    elif args.command == 'drive':
+        drive(args.logins, args.threads, args.port)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Full-text search over item names and descriptions, using SQLite FTS5.
+
+item_fts is an external-content FTS5 index over the item table. Triggers
+keep it in step with every insert, update and delete - including bulk
+imports and set-based deletes that bypass the ORM - so the model methods
+need no search-specific code. install() and rebuild() are run by the
+migrations and by 'python manage.py rebuild-search'.
+
+Other databases have no FTS5; there search falls back to matching each
+word anywhere in the name or description with ILIKE, which scans the
+item table but needs no index.
+"""
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import and_, case, or_, text
+
+from database_setup import Item, session
+
+SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5(
+           item_name, item_description,
+           content='item', content_rowid='item_id',
+           tokenize='unicode61 remove_diacritics 1', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS item_fts_insert AFTER INSERT ON item
+       BEGIN
+           INSERT INTO item_fts (rowid, item_name, item_description)
+           VALUES (new.item_id, new.item_name, new.item_description);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS item_fts_delete AFTER DELETE ON item
+       BEGIN
+           INSERT INTO item_fts (item_fts, rowid, item_name,
+                                 item_description)
+           VALUES ('delete', old.item_id, old.item_name,
+                   old.item_description);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS item_fts_update
+       AFTER UPDATE OF item_name, item_description ON item
+       BEGIN
+           INSERT INTO item_fts (item_fts, rowid, item_name,
+                                 item_description)
+           VALUES ('delete', old.item_id, old.item_name,
+                   old.item_description);
+           INSERT INTO item_fts (rowid, item_name, item_description)
+           VALUES (new.item_id, new.item_name, new.item_description);
+       END""",
+]
+
+# Name matches count ten times as much as description matches
+SEARCH_SQL = text("""
+    SELECT item.item_id, item.item_name, item.category_id,
+           snippet(item_fts, 1, :mark, :unmark, ' ... ', 16) AS snippet,
+           bm25(item_fts, 10.0, 1.0) AS rank
+    FROM item_fts JOIN item ON item.item_id = item_fts.rowid
+    WHERE item_fts MATCH :query
+    ORDER BY rank
+    LIMIT :limit OFFSET :offset""")
+
+# Control characters do not occur in item text, so they can mark
+# matches until the snippet has been escaped
+MARK, UNMARK = u'\x02', u'\x03'
+text_type = type(u'')
+
+# Words either side of the first match in a fallback snippet
+SNIPPET_CONTEXT = 8
+
+
+def install(connection):
+    """Creates the FTS5 index and the triggers that maintain it"""
+    for statement in SCHEMA:
+        connection.execute(text(statement))
+
+
+def rebuild(connection):
+    """Re-indexes every item; for databases indexed before install()"""
+    connection.execute(text("INSERT INTO item_fts (item_fts) "
+                            "VALUES ('rebuild')"))
+
+
+def query_words(query):
+    """Returns the words of free text query"""
+    return re.findall(r'\w+', query, re.UNICODE)
+
+
+def match_expression(query):
+    """Turns free text into an FTS5 query matching all of its words, each
+    as a prefix. Quoting every word keeps FTS5 syntax out of user input.
+
+    Returns:
+        FTS5 MATCH expression; None if query has no words
+    """
+    words = query_words(query)
+    if not words:
+        return None
+    return u' '.join(u'"%s"*' % word for word in words)
+
+
+def search(query, limit=20, offset=0):
+    """Returns items matching query, best match first.
+
+    Args:
+        query: words typed by the user
+        limit: most results to return
+        offset: results to skip, for later pages
+
+    Returns:
+        list of dicts with item_id, item_name, category_id, rank and
+        snippet - an HTML excerpt of the description with matches in <mark>
+    """
+    if session.get_bind().dialect.name != 'sqlite':
+        return _search_like(query_words(query), limit, offset)
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    rows = session.execute(SEARCH_SQL, {'query': expression,
+                                        'mark': MARK, 'unmark': UNMARK,
+                                        'limit': limit, 'offset': offset})
+    results = []
+    for row in rows:
+        # Escape the text first; only our own markers become tags
+        snippet = Markup(text_type(escape(row.snippet))
+                         .replace(MARK, u'<mark>')
+                         .replace(UNMARK, u'</mark>'))
+        results.append({'item_id': row.item_id,
+                        'item_name': row.item_name,
+                        'category_id': row.category_id,
+                        'rank': row.rank,
+                        'snippet': snippet})
+    return results
+
+
+def _search_like(words, limit, offset):
+    """search() for databases without FTS5: items holding every word in
+    their name or description, those with more words in the name first.
+    """
+    if not words:
+        return []
+    matches = []
+    name_matches = []
+    for word in words:
+        # Words are letters, digits and _; only _ is special to LIKE
+        pattern = u'%%%s%%' % word.replace(u'_', u'\\_')
+        in_name = Item.item_name.ilike(pattern, escape=u'\\')
+        matches.append(or_(in_name, Item.item_description.ilike(
+            pattern, escape=u'\\')))
+        name_matches.append(case([(in_name, 1)], else_=0))
+    # Lower ranks are better, as with bm25()
+    rank = -sum(name_matches)
+    rows = (session.query(Item.item_id, Item.item_name, Item.category_id,
+                          Item.item_description, rank.label('rank'))
+            .filter(and_(*matches)).order_by(rank, Item.item_id)
+            .limit(limit).offset(offset))
+    return [{'item_id': row.item_id,
+             'item_name': row.item_name,
+             'category_id': row.category_id,
+             'rank': row.rank,
+             'snippet': _snippet(row.item_description, words)}
+            for row in rows]
+
+
+def _snippet(description, words):
+    """Returns an HTML excerpt of description around the first of words
+    found, with every occurrence of them in <mark>.
+    """
+    finder = re.compile(u'|'.join(re.escape(word) for word in words),
+                        re.IGNORECASE | re.UNICODE)
+    tokens = description.split()
+    first = next((i for i, token in enumerate(tokens)
+                  if finder.search(token)), 0)
+    start = max(0, first - SNIPPET_CONTEXT)
+    excerpt = u' '.join(tokens[start:first + SNIPPET_CONTEXT + 1])
+    marked = finder.sub(lambda m: MARK + m.group(0) + UNMARK, excerpt)
+    snippet = text_type(escape(marked)).replace(MARK, u'<mark>')
+    snippet = snippet.replace(UNMARK, u'</mark>')
+    if start > 0:
+        snippet = u'... ' + snippet
+    if first + SNIPPET_CONTEXT + 1 < len(tokens):
+        snippet += u' ...'
+    return Markup(snippet)
@@ -0,0 +1,103 @@
+"""Rows and encodings for the JSON API.
+
+Rows are built straight from Core result tuples - the columns each model
+lists in serialized_fields - rather than from loaded ORM instances, and
+encoded with orjson when it is installed, otherwise with the json module.
+Either way the output is compact JSON with sorted keys, as jsonify gives.
+
+Clients that send Accept: application/msgpack get MessagePack instead, if
+the msgpack package is installed. ?stream= responses are always JSON.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from flask import Response, request
+from sqlalchemy import select
+
+JSON = 'application/json'
+NDJSON = 'application/x-ndjson'
+MSGPACK = 'application/msgpack'
+
+
+def select_fields(model, *columns):
+    """Returns a Core select of model's serialized_fields, followed by
+    any other columns given.
+    """
+    table = model.__table__
+    return select([table.c[name] for name in model.serialized_fields] +
+                  list(columns))
+
+
+def rows(model, result):
+    """Returns dicts, as model.serialize gives, from the result rows of a
+    select_fields() query; any columns past the serialized ones are left
+    out.
+    """
+    fields = model.serialized_fields
+    return [dict(zip(fields, row)) for row in result]
+
+
+def stream_rows(model, result, batch_size=1000):
+    """Yields rows() of a streamed result, fetched batch_size at a time"""
+    while True:
+        batch = result.fetchmany(batch_size)
+        if not batch:
+            return
+        for row in rows(model, batch):
+            yield row
+
+
+def json_dumps(obj):
+    """Returns obj as compact JSON bytes, with sorted keys, from the json
+    module; dumps() uses it if orjson is not installed.
+    """
+    return json.dumps(obj, sort_keys=True,
+                      separators=(',', ':')).encode('utf-8')
+
+
+if orjson is not None:
+    def dumps(obj):
+        """Returns obj as compact JSON bytes, with sorted keys"""
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+else:
+    dumps = json_dumps
+
+
+def packb(obj):
+    """Returns obj as MessagePack bytes"""
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def mimetype(accept=None):
+    """Returns MSGPACK if the client prefers it to JSON and msgpack is
+    installed; otherwise JSON.
+
+    Arg:
+        accept: parsed Accept header; by default the request's
+    """
+    if msgpack is None:
+        return JSON
+    if accept is None:
+        accept = request.accept_mimetypes
+    return MSGPACK if accept.best_match([JSON, MSGPACK]) == MSGPACK else JSON
+
+
+def encode(obj, mimetype=JSON):
+    """Returns obj encoded as mimetype, as a response body"""
+    if mimetype == MSGPACK:
+        return packb(obj)
+    return dumps(obj) + b'\n'
+
+
+def response(obj, mimetype=JSON):
+    """Returns a response carrying obj, encoded as mimetype"""
+    return Response(encode(obj, mimetype), mimetype=mimetype)
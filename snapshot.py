@@ -0,0 +1,271 @@
+"""In-process snapshot of the catalog for the JSON API.
+
+With API_SNAPSHOT on, each process keeps every category and item in
+memory, already encoded as JSON and indexed by id and by category. The
+category and item JSON endpoints then answer from it: a page is a slice of
+encoded objects joined together, with no query and no per-object
+serializing.
+
+The snapshot is loaded whole on first use. After that the model write
+methods report each commit (see database_setup.on_change), and only the
+categories they touched are reloaded, on the next read. Writes made by
+other processes are caught by comparing Category.freshness() on the
+primary database with the snapshot's own, at most every
+API_SNAPSHOT_CHECK_INTERVAL seconds; on a difference the categories
+updated since the snapshot's newest are reloaded, or everything if
+categories were deleted. So a process sees its own writes at once, and
+those of others within the interval. The snapshot always reads the
+primary, never a replica.
+"""
+import bisect
+import threading
+import time
+import weakref
+
+from flask import current_app
+from sqlalchemy import func
+
+import serializers
+from database_setup import Category, Item, new_session, on_change
+
+# Above this many changed categories a full reload is cheaper
+MAX_PARTIAL_RELOAD = 500
+
+_snapshots = weakref.WeakSet()
+
+# Rows read per fetch while loading
+LOAD_BATCH = 1000
+
+
+def page(ids, encoded, after_id, limit):
+    """Returns up to limit of the encoded objects whose id follows
+    after_id, and the id of the last one returned.
+
+    Args:
+        ids: sorted object ids
+        encoded: encoded objects, in the same order as ids
+        after_id: last id already seen; None for the first page
+        limit: most objects to return
+    """
+    start = 0 if after_id is None else bisect.bisect_right(ids, after_id)
+    rows = encoded[start:start + limit]
+    return rows, ids[start + len(rows) - 1] if rows else None
+
+
+class Snapshot(object):
+    """Every category and item, encoded, as of the last refresh()"""
+
+    def __init__(self, check_interval=5):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._dirty_lock = threading.Lock()
+        self._dirty = set()  # categories changed since the last reload
+        self._stamp = None  # (count, newest updated_at); None until loaded
+        self._checked_at = 0
+        self._categories = {}  # category_id: (updated_at, encoded)
+        self._category_list = ([], [])  # sorted ids, encoded categories
+        self._items = {}  # category_id: (sorted item ids, encoded items)
+        self._item_category = {}  # item_id: category_id
+        _snapshots.add(self)
+
+    def changed(self, model, object_ids):
+        """Marks the categories of changed objects for reloading. Ids may
+        come as the strings posted by a form; they are held as ints, as
+        the rows have them.
+        """
+        with self._dirty_lock:
+            for object_id in object_ids:
+                object_id = int(object_id)
+                if model == 'category':
+                    self._dirty.add(object_id)
+                elif object_id in self._item_category:
+                    self._dirty.add(self._item_category[object_id])
+
+    def refresh(self):
+        """Brings the snapshot up to date, loading it first if need be"""
+        now = time.time()
+        check = now - self._checked_at >= self.check_interval
+        if self._stamp is not None and not check and not self._dirty:
+            return
+        with self._lock:
+            dirty = self._take_dirty()
+            if self._stamp is None:
+                self._load()
+            elif dirty:
+                self._reload(dirty)
+            if check:
+                self._checked_at = now
+                if self._primary_stamp() != self._stamp:
+                    self._catch_up()
+
+    def _take_dirty(self):
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def _primary_stamp(self):
+        """Returns Category.freshness() as the primary database has it;
+        replicas may lag behind writes the snapshot has already seen.
+        """
+        db = new_session(primary=True)
+        try:
+            return tuple(db.query(func.count(Category.category_id),
+                                  func.max(Category.updated_at)).one())
+        finally:
+            db.close()
+
+    def _catch_up(self):
+        """Reloads the categories changed since the newest one held, as
+        those written by other processes are. If the count is still off,
+        as after a delete, reloads everything.
+        """
+        newest = self._stamp[1]
+        db = new_session(primary=True)
+        try:
+            query = db.query(Category.category_id)
+            if newest is not None:
+                query = query.filter(Category.updated_at >= newest)
+            category_ids = set(category_id for category_id, in query)
+        finally:
+            db.close()
+        self._reload(category_ids)
+        if self._primary_stamp() != self._stamp:
+            self._load()
+
+    def _load(self):
+        """Loads every category and item"""
+        db = new_session(primary=True)
+        try:
+            categories = {}
+            items = {}
+            for row, encoded in _encoded(db, Category, _category_query()):
+                categories[row.category_id] = (row.updated_at, encoded)
+                items[row.category_id] = ([], [])
+            for row, encoded in _encoded(db, Item, _item_query()):
+                ids, encoded_items = items.setdefault(row.category_id,
+                                                      ([], []))
+                ids.append(row.item_id)
+                encoded_items.append(encoded)
+        finally:
+            db.close()
+        self._categories = categories
+        self._items = items
+        self._item_category = dict((item_id, category_id)
+                                   for category_id, (ids, _) in items.items()
+                                   for item_id in ids)
+        self._index()
+
+    def _reload(self, category_ids):
+        """Loads again the given categories and their items"""
+        if len(category_ids) > MAX_PARTIAL_RELOAD:
+            return self._load()
+        db = new_session(primary=True)
+        try:
+            reloaded = dict(
+                (row.category_id, (row.updated_at, encoded))
+                for row, encoded in _encoded(
+                    db, Category, _category_query().where(
+                        Category.category_id.in_(category_ids))))
+            reloaded_items = dict((category_id, ([], []))
+                                  for category_id in category_ids)
+            for row, encoded in _encoded(db, Item, _item_query().where(
+                    Item.category_id.in_(category_ids))):
+                ids, encoded_items = reloaded_items[row.category_id]
+                ids.append(row.item_id)
+                encoded_items.append(encoded)
+        finally:
+            db.close()
+        # Replace entries one at a time, so readers never miss one
+        for category_id in category_ids:
+            old_ids = self._items.get(category_id, ([], []))[0]
+            if category_id in reloaded:
+                self._categories[category_id] = reloaded[category_id]
+                self._items[category_id] = reloaded_items[category_id]
+            else:
+                self._categories.pop(category_id, None)
+                self._items.pop(category_id, None)
+            for item_id in old_ids:
+                self._item_category.pop(item_id, None)
+            for item_id in reloaded_items[category_id][0]:
+                self._item_category[item_id] = category_id
+        self._index()
+
+    def _index(self):
+        """Rebuilds the category list and stamp from _categories"""
+        ids = sorted(self._categories)
+        self._category_list = (ids, [self._categories[category_id][1]
+                                     for category_id in ids])
+        stamps = [entry[0] for entry in self._categories.values()
+                  if entry[0] is not None]
+        self._stamp = (len(ids), max(stamps) if stamps else None)
+
+    def stamp(self):
+        """Returns the count and newest updated_at of all categories, as
+        Category.freshness() does.
+        """
+        return self._stamp
+
+    def category(self, category_id):
+        """Returns (updated_at, encoded category); None if there is no
+        such category.
+        """
+        return self._categories.get(category_id)
+
+    def categories(self):
+        """Returns sorted category ids and the encoded categories"""
+        return self._category_list
+
+    def items(self, category_id):
+        """Returns sorted item ids and the encoded items of a category"""
+        return self._items.get(category_id, ([], []))
+
+
+def _category_query():
+    """Serialized categories, with updated_at"""
+    return serializers.select_fields(Category, Category.updated_at)
+
+
+def _item_query():
+    """Serialized items, with their category ids, in item_id order"""
+    return serializers.select_fields(Item, Item.category_id).order_by(
+        Item.item_id)
+
+
+def _encoded(db, model, query):
+    """Yields each row of query, with its serialized form encoded. Rows
+    are read in batches, straight from the table.
+    """
+    result = db.execute(query.execution_options(stream_results=True))
+    dumps = serializers.dumps
+    while True:
+        batch = result.fetchmany(LOAD_BATCH)
+        if not batch:
+            return
+        for row, serialized in zip(batch, serializers.rows(model, batch)):
+            yield row, dumps(serialized)
+
+
+def _notify(model, object_ids):
+    for snapshot in list(_snapshots):
+        snapshot.changed(model, object_ids)
+
+
+on_change(_notify)
+
+
+def current():
+    """Returns the current app's snapshot, refreshed; None if API_SNAPSHOT
+    is off.
+    """
+    snapshot = current_app.extensions.get('snapshot')
+    if snapshot is not None:
+        snapshot.refresh()
+    return snapshot
+
+
+def init_app(app):
+    """Sets up the snapshot, if app.config['API_SNAPSHOT'] is on"""
+    app.extensions['snapshot'] = None
+    if app.config['API_SNAPSHOT']:
+        app.extensions['snapshot'] = Snapshot(
+            app.config['API_SNAPSHOT_CHECK_INTERVAL'])
@@ -0,0 +1,3 @@
+"""Tests for the item catalog; run with python -m unittest discover tests
+(or pytest) from the repository root.
+"""
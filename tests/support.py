@@ -0,0 +1,48 @@
+"""A seeded scratch catalog for the tests, built as benchmark.py builds
+its own.
+"""
+import shutil
+import tempfile
+import unittest
+
+import benchmark
+from database_setup import User, dispose_engines, session
+
+
+class CatalogTestCase(unittest.TestCase):
+    """Runs each test against the catalog app on a new scratch database,
+    seeded with USERS users, CATEGORIES categories and ITEMS items.
+    Settings from settings() override the scratch ones.
+    """
+    USERS = 2
+    CATEGORIES = 4
+    ITEMS = 20
+    CONFIG = {}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        config = type('TestConfig',
+                      (benchmark.scratch_config(self.directory),),
+                      self.settings())
+        self.app = benchmark.scratch_app(self.directory, config=config)
+        self.user_ids = benchmark.seed(self.USERS, self.CATEGORIES,
+                                       self.ITEMS)
+        self.client = self.app.test_client()
+
+    def settings(self):
+        """Returns the settings to override, as a dict; by default
+        CONFIG
+        """
+        return dict(self.CONFIG)
+
+    def tearDown(self):
+        session.remove()
+        dispose_engines()
+        shutil.rmtree(self.directory)
+
+    def login(self, user_id=1):
+        """Signs the test client in as the seeded user user_id"""
+        with self.app.app_context():
+            user = session.query(User).get(user_id)
+            session.remove()
+        benchmark.login(self.client, user)
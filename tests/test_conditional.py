@@ -0,0 +1,25 @@
+from tests.support import CatalogTestCase
+
+
+class ConditionalTest(CatalogTestCase):
+
+    def setUp(self):
+        super(ConditionalTest, self).setUp()
+        self.login()
+        self.etag = self.client.get('/').headers['ETag']
+
+    def revalidate(self):
+        return self.client.get('/', headers={'If-None-Match': self.etag})
+
+    def test_unchanged_page_is_not_modified(self):
+        self.assertEqual(self.revalidate().status_code, 304)
+
+    def test_pending_flash_is_shown_not_revalidated(self):
+        with self.client.session_transaction() as login_session:
+            login_session['_flashes'] = [('message', 'Category deleted.')]
+        response = self.revalidate()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Category deleted.', response.data)
+        self.assertNotIn('ETag', response.headers)
+        # Shown once; the page can be revalidated again afterwards
+        self.assertEqual(self.revalidate().status_code, 304)
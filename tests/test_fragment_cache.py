@@ -0,0 +1,85 @@
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import event
+
+import manage
+from database_setup import Category, User, get_engine, session
+from fragment_cache import fragment_cache
+from tests.support import CatalogTestCase
+
+
+class FragmentVersionTest(CatalogTestCase):
+    """Cached category fragments must follow changes this process was
+    never told about: another worker's writes, or manage.py's.
+    """
+
+    def setUp(self):
+        super(FragmentVersionTest, self).setUp()
+        # Category 1 belongs to user 2
+        self.login(2)
+
+    def test_write_from_another_process(self):
+        self.assertIn(b'Category 0001', self.client.get('/').data)
+        # As another worker would: straight to the database, no events
+        category = Category.__table__
+        with self.app.app_context():
+            session.execute(category.update().where(
+                category.c.category_id == 1).values(
+                category_name='Renamed elsewhere',
+                updated_at=datetime.utcnow()))
+            session.commit()
+            session.remove()
+        page = self.client.get('/').data
+        self.assertIn(b'Renamed elsewhere', page)
+        self.assertNotIn(b'Category 0001', page)
+
+    def test_manage_import(self):
+        self.assertNotIn(b'Imported item',
+                         self.client.get('/category/1').data)
+        path = os.path.join(self.directory, 'catalog.ndjson')
+        with open(path, 'w') as f:
+            f.write(json.dumps({'category_name': 'Category 0001',
+                                'item_name': 'Imported item',
+                                'item_description': 'From a file'}))
+        with self.app.app_context():
+            manage.import_catalog(path, session.query(User).get(2))
+            session.remove()
+        self.assertIn(b'Imported item', self.client.get('/category/1').data)
+
+
+class CategoryPageHitTest(CatalogTestCase):
+    """A category page whose fragment is cached is served without loading
+    the category's items.
+    """
+
+    def setUp(self):
+        super(CategoryPageHitTest, self).setUp()
+        self.login(2)
+        fragment_cache.backend.clear()
+        self.statements = []
+        event.listen(get_engine(), 'before_cursor_execute', self.record)
+
+    def tearDown(self):
+        event.remove(get_engine(), 'before_cursor_execute', self.record)
+        super(CategoryPageHitTest, self).tearDown()
+
+    def record(self, conn, cursor, statement, parameters, context,
+               executemany):
+        self.statements.append(' '.join(statement.split()))
+
+    def item_queries(self):
+        return [statement for statement in self.statements
+                if statement.startswith('SELECT item.')]
+
+    def test_hit_skips_item_queries(self):
+        miss = self.client.get('/category/1')
+        self.assertEqual(miss.status_code, 200)
+        self.assertTrue(self.item_queries())
+        del self.statements[:]
+        hit = self.client.get('/category/1')
+        self.assertEqual(hit.status_code, 200)
+        self.assertEqual(self.item_queries(), [])
+        self.assertEqual(hit.data, miss.data)
+        self.assertIn(b'Item 4', hit.data)
@@ -0,0 +1,44 @@
+import io
+import os
+import unittest
+
+import images
+from database_setup import Item, session
+from tests.support import CatalogTestCase
+
+
+@unittest.skipIf(images.Image is None, 'needs Pillow')
+class CategoryDeleteImagesTest(CatalogTestCase):
+
+    def add_image(self, item_id):
+        """Stores an image for item_id and makes a variant of it;
+        returns the files written
+        """
+        content = io.BytesIO()
+        images.Image.new('RGB', (400, 300), 'red').save(content, 'PNG')
+        content.seek(0)
+        with self.app.app_context():
+            store = images.store()
+            name = store.save_original(item_id, content, 10 ** 7)
+            Item.set_image(Item.by_id(item_id), name)
+            variant = store.variant(name, images.WIDTHS[0], 'jpeg')
+            session.remove()
+        return [os.path.join(store.originals, name), variant]
+
+    def test_delete_removes_item_images(self):
+        # Category 1 and its items belong to user 2
+        files = self.add_image(4) + self.add_image(8)
+        kept = self.add_image(5)
+        self.login(2)
+        response = self.client.post('/category/1/edit/',
+                                    data={'submit': 'delete'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual([path for path in files if os.path.exists(path)],
+                         [])
+        self.assertTrue(all(os.path.exists(path) for path in kept))
+
+    def test_refused_delete_keeps_images(self):
+        files = self.add_image(4)
+        self.login(1)
+        self.client.post('/category/1/edit/', data={'submit': 'delete'})
+        self.assertTrue(all(os.path.exists(path) for path in files))
@@ -0,0 +1,25 @@
+import instrumentation
+from tests.support import CatalogTestCase
+
+
+class RenderTimingTest(CatalogTestCase):
+    CONFIG = {'SERVER_TIMING': True}
+
+    def render_seconds(self, route):
+        totals = instrumentation.render_seconds.totals()
+        return totals.get((route, 'GET', '200'), (0.0, 0))
+
+    def test_page_render_is_timed(self):
+        self.login()
+        before, count = self.render_seconds('/')
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        after, new_count = self.render_seconds('/')
+        self.assertEqual(new_count, count + 1)
+        self.assertGreater(after - before, 0)
+        self.assertIn('render;dur=', response.headers['Server-Timing'])
+
+    def test_json_api_renders_nothing(self):
+        before, _ = self.render_seconds('/category/JSON')
+        self.client.get('/category/JSON')
+        self.assertEqual(self.render_seconds('/category/JSON')[0], before)
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import inspect, text
+
+import migrations
+from database_setup import make_engine
+
+# The tables as the first release created them: no indexes, and nothing
+# stopping two users from sharing an email
+FIRST_RELEASE_SCHEMA = [
+    """CREATE TABLE user (
+           user_id INTEGER NOT NULL PRIMARY KEY,
+           user_name VARCHAR(250) NOT NULL,
+           email VARCHAR(250) NOT NULL,
+           picture VARCHAR(250))""",
+    """CREATE TABLE category (
+           category_id INTEGER NOT NULL PRIMARY KEY,
+           category_name VARCHAR(250) NOT NULL,
+           user_id INTEGER REFERENCES user (user_id))""",
+    """CREATE TABLE item (
+           item_id INTEGER NOT NULL PRIMARY KEY,
+           item_name VARCHAR(250) NOT NULL,
+           item_description VARCHAR(1000) NOT NULL,
+           category_id INTEGER REFERENCES category (category_id),
+           user_id INTEGER REFERENCES user (user_id))""",
+]
+
+
+class UpgradeFirstReleaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.engine = make_engine(
+            'sqlite:///' + os.path.join(self.directory, 'old.db'))
+        with self.engine.begin() as connection:
+            for statement in FIRST_RELEASE_SCHEMA:
+                connection.execute(text(statement))
+            for user_id, email in [(1, 'a@example.com'),
+                                   (2, 'b@example.com'),
+                                   (3, 'a@example.com')]:
+                connection.execute(text(
+                    "INSERT INTO user (user_id, user_name, email) "
+                    "VALUES (:user_id, 'User', :email)"),
+                    user_id=user_id, email=email)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def user_indexes(self):
+        return [index['name'] for index in
+                inspect(self.engine).get_indexes('user')]
+
+    def test_duplicate_emails_are_listed(self):
+        with self.assertRaises(migrations.MigrationError) as raised:
+            migrations.upgrade(self.engine)
+        self.assertIn('a@example.com (user ids 1, 3)', str(raised.exception))
+        self.assertNotIn('b@example.com', str(raised.exception))
+        self.assertNotIn('ix_user_email', self.user_indexes())
+
+    def test_upgrade_once_emails_are_unique(self):
+        with self.engine.begin() as connection:
+            connection.execute(text(
+                "UPDATE user SET email = 'c@example.com' WHERE user_id = 3"))
+        applied = migrations.upgrade(self.engine)
+        self.assertEqual([number for number, _ in applied],
+                         [number for number, _, _ in migrations.MIGRATIONS])
+        self.assertIn('ix_user_email', self.user_indexes())
@@ -0,0 +1,59 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import oauth_client
+import oauth_stub
+from config import Config
+
+
+class VerifyIdTokenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        secrets = os.path.join(self.directory, 'client_secrets.json')
+        with open(secrets, 'w') as f:
+            json.dump({'web': {'client_id': 'catalog'}}, f)
+        oauth_client.configure(type('TestConfig', (Config,),
+                                    {'CLIENT_SECRETS_FILE': secrets}))
+        self.keys = {oauth_stub.KEY_ID: oauth_stub._key_pair()[0]}
+        self.claims = {'iss': 'accounts.google.com', 'sub': 'user-1',
+                       'aud': 'catalog', 'exp': int(time.time()) + 60}
+
+    def tearDown(self):
+        oauth_client.configure(Config)
+        shutil.rmtree(self.directory)
+
+    def verify(self, **changes):
+        id_token = oauth_stub._id_token(dict(self.claims, **changes))
+        return oauth_client.verify_id_token(id_token, self.keys)
+
+    def test_signed_token(self):
+        self.assertEqual(self.verify()['sub'], 'user-1')
+
+    def test_changed_claims(self):
+        # user-1's signature over user-2's claims
+        header, _, signature = oauth_stub._id_token(self.claims).split('.')
+        payload = oauth_stub._id_token(
+            dict(self.claims, sub='user-2')).split('.')[1]
+        self.assertIsNone(oauth_client.verify_id_token(
+            '%s.%s.%s' % (header, payload, signature), self.keys))
+
+    def test_unknown_key(self):
+        self.assertIsNone(oauth_client.verify_id_token(
+            oauth_stub._id_token(self.claims), {}))
+
+    def test_other_audience(self):
+        self.assertIsNone(self.verify(aud='another-app'))
+
+    def test_other_issuer(self):
+        self.assertIsNone(self.verify(iss='https://example.com'))
+
+    def test_expired(self):
+        self.assertIsNone(self.verify(exp=int(time.time()) - 1))
+
+    def test_not_a_jwt(self):
+        self.assertIsNone(oauth_client.verify_id_token('x.y', self.keys))
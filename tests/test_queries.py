@@ -0,0 +1,101 @@
+from sqlalchemy import event
+
+import instrumentation
+from database_setup import Category, Item, User, get_engine, session
+from fragment_cache import fragment_cache
+from tests.support import CatalogTestCase
+
+
+class PageQueriesTest(CatalogTestCase):
+    """Pages load their categories and items in a fixed number of queries,
+    not one more per category or item shown.
+    """
+
+    def setUp(self):
+        super(PageQueriesTest, self).setUp()
+        self.login()
+        # Leave out anything only the first request does
+        self.client.get('/')
+
+    def queries(self, path, route):
+        """Returns the number of statements run to serve path, with every
+        fragment rendered afresh.
+        """
+        fragment_cache.backend.clear()
+        labels = (route, 'GET', '200')
+        before = instrumentation.request_queries.totals().get(
+            labels, (0, 0))[0]
+        self.assertEqual(self.client.get(path).status_code, 200)
+        return instrumentation.request_queries.totals()[labels][0] - before
+
+    def grow(self):
+        """Gives user 1 ten more categories, and those and category 2 a
+        hundred more items each, owned by ten more users.
+        """
+        with self.app.app_context():
+            session.bulk_insert_mappings(User, [
+                {'user_id': n, 'user_name': 'User %d' % n,
+                 'email': 'user%d@example.com' % n} for n in range(101, 111)])
+            session.bulk_insert_mappings(Category, [
+                {'category_id': n, 'category_name': 'Category %d' % n,
+                 'user_id': 1} for n in range(101, 111)])
+            category_ids = [2] + list(range(101, 111))
+            session.bulk_insert_mappings(Item, [
+                {'item_id': n, 'item_name': 'Item %d' % n,
+                 'item_description': 'Added item %d' % n,
+                 'category_id': category_ids[n % 11],
+                 'user_id': 101 + n % 10} for n in range(1001, 2101)])
+            Category.repair_summaries(session)
+            session.commit()
+            session.remove()
+
+    def test_home_page(self):
+        count = self.queries('/', '/')
+        self.assertEqual(count, 3)
+        self.grow()
+        self.assertEqual(self.queries('/', '/'), count)
+
+    def test_category_page(self):
+        route = '/category/<int:category_id>'
+        count = self.queries('/category/2', route)
+        self.assertEqual(count, 4)
+        self.grow()
+        self.assertEqual(self.queries('/category/2', route), count)
+
+
+class ItemEditQueriesTest(CatalogTestCase):
+    """An item edit updates its categories' summaries in one statement per
+    category it affects.
+    """
+
+    def setUp(self):
+        super(ItemEditQueriesTest, self).setUp()
+        self.login()
+        self.statements = []
+        event.listen(get_engine(), 'before_cursor_execute', self.record)
+
+    def tearDown(self):
+        event.remove(get_engine(), 'before_cursor_execute', self.record)
+        super(ItemEditQueriesTest, self).tearDown()
+
+    def record(self, conn, cursor, statement, parameters, context,
+               executemany):
+        self.statements.append(' '.join(statement.split()))
+
+    def category_updates(self, category_id):
+        """Edits item 1, of category 2 and user 1, moving it to
+        category_id; returns the UPDATE statements run on category.
+        """
+        del self.statements[:]
+        response = self.client.post('/item/1/edit/', data={
+            'submit': 'submit', 'category_id': str(category_id),
+            'name': 'Item 1', 'description': 'Edited'})
+        self.assertEqual(response.status_code, 302)
+        return [statement for statement in self.statements
+                if statement.startswith('UPDATE category ')]
+
+    def test_edit_within_category(self):
+        self.assertEqual(len(self.category_updates(2)), 1)
+
+    def test_move_to_another_category(self):
+        self.assertEqual(len(self.category_updates(4)), 2)
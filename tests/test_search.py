@@ -0,0 +1,27 @@
+import os
+
+from tests.support import CatalogTestCase
+
+
+class SearchThroughReplicaTest(CatalogTestCase):
+    """Search asks the session for its bind, which goes through
+    RoutingSession.get_bind() with a replica configured.
+    """
+
+    def settings(self):
+        settings = super(SearchThroughReplicaTest, self).settings()
+        # The same file stands in for a replica
+        settings['DATABASE_REPLICA_URLS'] = [
+            'sqlite:///' + os.path.join(self.directory, 'bench.db')]
+        return settings
+
+    def test_search_json(self):
+        response = self.client.get('/search/json?q=item')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()['items'])
+
+    def test_search_page(self):
+        self.login()
+        response = self.client.get('/search?q=item')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<mark>', response.data)
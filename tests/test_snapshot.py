@@ -0,0 +1,39 @@
+import json
+
+from tests.support import CatalogTestCase
+
+
+class SnapshotFormWriteTest(CatalogTestCase):
+    # Long enough that only the write itself can bring the snapshot up to
+    # date
+    CONFIG = {'API_SNAPSHOT': True, 'API_SNAPSHOT_CHECK_INTERVAL': 3600}
+
+    def setUp(self):
+        super(SnapshotFormWriteTest, self).setUp()
+        self.login()
+
+    def item_ids(self, category_id):
+        response = self.client.get('/category/%d/items/json' % category_id)
+        self.assertEqual(response.status_code, 200)
+        return [item['item_id'] for item in
+                json.loads(response.data.decode('utf-8'))['items']]
+
+    def post_item(self, category_id, path='/item/new'):
+        response = self.client.post(path, data={
+            'submit': 'submit', 'category_id': str(category_id),
+            'name': 'Form item', 'description': 'Written through the form'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_added_item_is_served(self):
+        before = self.item_ids(2)
+        self.post_item(2)
+        after = self.item_ids(2)
+        self.assertEqual(len(after), len(before) + 1)
+        self.assertEqual(self.item_ids(2), after)
+
+    def test_moved_item_is_served(self):
+        item_id = self.item_ids(2)[0]
+        self.item_ids(4)
+        self.post_item(4, '/item/%d/edit/' % item_id)
+        self.assertNotIn(item_id, self.item_ids(2))
+        self.assertIn(item_id, self.item_ids(4))
@@ -0,0 +1,237 @@
+"""Group commit for the model write methods.
+
+SQLite allows one writer at a time and every commit is its own fsync, so
+concurrent edits queue up on the database lock and, under load, time out.
+With WRITE_QUEUE on, the write methods in database_setup (those marked
+@_queued) are not run by the request thread. They are handed to a single
+writer thread, which runs whatever has queued up - at most
+WRITE_QUEUE_MAX_BATCH writes, after waiting up to WRITE_QUEUE_MAX_DELAY
+seconds for more - in one transaction with one commit. Each request waits
+for the result of its own write, or its error.
+
+If any write in a batch fails, the batch is rolled back and its writes run
+again one at a time, each committed on its own, so a bad write only fails
+its own request.
+
+Model instances cross between threads by identity: the writer loads its
+own copies of those passed in, and the caller gets back copies loaded in
+its session, so no session is ever used by two threads.
+
+The batch sizes and the time writes wait in the queue are histograms on
+/metrics.
+"""
+import logging
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from sqlalchemy import inspect
+
+import instrumentation
+from database_setup import Base, session, start_batch, end_batch
+from database_setup import use_write_queue
+
+log = logging.getLogger(__name__)
+
+batch_size = instrumentation.Histogram(
+    'catalog_write_batch_size', 'Writes per write queue transaction; '
+    '"split" batches failed and were retried one write at a time.',
+    ('outcome',), (1, 2, 4, 8, 16, 32, 64, 128))
+queue_wait_seconds = instrumentation.Histogram(
+    'catalog_write_queue_wait_seconds', 'Time writes wait for the writer '
+    'thread.', ('method',), instrumentation.SECONDS_BUCKETS)
+instrumentation.register(batch_size, queue_wait_seconds)
+
+
+class WriteTimeout(Exception):
+    """A queued write was not done in time; it may still be made"""
+
+
+class Future(object):
+    """Result of a queued write, set by the writer thread"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_exception(self, error):
+        self._error = error
+        self._done.set()
+
+    def result(self, timeout=None):
+        """Returns the result, or raises the write's error, once done"""
+        if not self._done.wait(timeout):
+            raise WriteTimeout('Write not done after %s seconds' % timeout)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class _Ref(object):
+    """A model instance, by class and primary key"""
+
+    __slots__ = ('model', 'identity')
+
+    def __init__(self, model, identity):
+        self.model = model
+        self.identity = identity
+
+
+def _detach(value):
+    """Replaces model instances in value with _Refs"""
+    if isinstance(value, Base):
+        return _Ref(type(value), inspect(value).identity)
+    if isinstance(value, (tuple, list)):
+        return type(value)(_detach(v) for v in value)
+    if isinstance(value, dict):
+        return dict((k, _detach(v)) for k, v in value.items())
+    return value
+
+
+def _attach(value):
+    """Replaces _Refs in value with instances from this thread's session"""
+    if isinstance(value, _Ref):
+        return session.query(value.model).get(value.identity)
+    if isinstance(value, (tuple, list)):
+        return type(value)(_attach(v) for v in value)
+    if isinstance(value, dict):
+        return dict((k, _attach(v)) for k, v in value.items())
+    return value
+
+
+class _Write(object):
+    """One call of a write method, waiting in the queue"""
+
+    def __init__(self, method, cls, args, kwargs):
+        self.method = method
+        self.cls = cls
+        self.args = _detach(args)
+        self.kwargs = _detach(kwargs)
+        self.name = '%s.%s' % (cls.__name__, method.__name__)
+        self.future = Future()
+        self.queued_at = time.time()
+
+    def run(self):
+        return _detach(self.method(self.cls, *_attach(self.args),
+                                   **_attach(self.kwargs)))
+
+
+class WriteQueue(object):
+    """Runs write methods on one writer thread, in batched transactions"""
+
+    def __init__(self, max_batch=64, max_delay=0, timeout=30):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def _writes(self):
+        """Returns this process's queue; the writer thread is started on
+        first use, and again after a fork.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run,
+                                                name='write-queue')
+                self._thread.daemon = True
+                self._thread.start()
+                self._pid = os.getpid()
+        return self._queue
+
+    def is_writer(self):
+        """True on the writer thread, where write methods run directly"""
+        return threading.current_thread() is self._thread
+
+    def call(self, method, cls, args, kwargs):
+        """Queues method(cls, *args, **kwargs) and returns its result.
+
+        Raises:
+            the write's own error, or WriteTimeout
+        """
+        write = _Write(method, cls, args, kwargs)
+        self._writes().put(write)
+        result = write.future.result(self.timeout)
+        # The writer's commit is newer than anything loaded here
+        session.expire_all()
+        session.info['wrote'] = True
+        return _attach(result)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                wait = deadline - time.time()
+                try:
+                    batch.append(self._queue.get(wait > 0, max(wait, 0)))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception:
+                log.exception('Write queue batch failed')
+            finally:
+                session.remove()
+
+    def _write(self, batch):
+        now = time.time()
+        for write in batch:
+            queue_wait_seconds.observe(now - write.queued_at, write.name)
+        # Writes check what they read; replicas may be behind
+        session.info['primary'] = True
+        if len(batch) == 1:
+            batch_size.observe(1, 'committed')
+            return self._write_one(batch[0])
+        start_batch()
+        try:
+            results = [write.run() for write in batch]
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            end_batch(committed=False)
+            log.info('Retrying %d batched writes one at a time after %r',
+                     len(batch), e)
+            batch_size.observe(len(batch), 'split')
+            for write in batch:
+                self._write_one(write)
+            return
+        end_batch(committed=True)
+        batch_size.observe(len(batch), 'committed')
+        for write, result in zip(batch, results):
+            write.future.set_result(result)
+
+    def _write_one(self, write):
+        """Runs one write by itself; it commits its own transaction"""
+        try:
+            result = write.run()
+        except Exception as e:
+            session.rollback()
+            write.future.set_exception(e)
+        else:
+            write.future.set_result(result)
+
+
+def init_app(app):
+    """Sends the write methods through a WriteQueue if
+    app.config['WRITE_QUEUE'] is on; otherwise they run in the calling
+    thread. The queue is shared by the whole process.
+    """
+    config = app.config
+    use_write_queue(WriteQueue(config['WRITE_QUEUE_MAX_BATCH'],
+                               config['WRITE_QUEUE_MAX_DELAY'],
+                               config['WRITE_QUEUE_TIMEOUT'])
+                    if config['WRITE_QUEUE'] else None)
@@ -0,0 +1,47 @@
+"""WSGI entry point for production servers:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is built once, at import. With gunicorn's preload_app that happens
+in the master process, before the workers are forked, so what is loaded
+here - code, compiled templates and, with API_SNAPSHOT on, the catalog
+snapshot - is shared by all workers copy-on-write instead of being loaded
+again by each. The database connections used for that are closed before
+any worker starts; see also gunicorn.conf.py.
+"""
+import gc
+
+import main
+import snapshot
+from config import Config, DEV_SECRET_KEY
+from database_setup import dispose_engines
+
+
+def preload(app):
+    """Does the loading every worker would otherwise repeat, then closes
+    the connections it used, so no worker inherits one.
+    """
+    main.compile_templates(app)
+    if app.config['API_SNAPSHOT']:
+        with app.app_context():
+            snapshot.current()
+    dispose_engines()
+    # Keep the collector from writing to every preloaded object, and so
+    # copying its page, in each worker (Python 3.7+)
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+
+def create_app(config=Config):
+    """Returns the catalog app, preloaded. Sessions must be signed with a
+    real key, from CATALOG_SECRET_KEY.
+    """
+    if config.SECRET_KEY in ('', DEV_SECRET_KEY):
+        raise RuntimeError('Set CATALOG_SECRET_KEY; the development key '
+                           'is not safe to serve with')
+    app = main.create_app(config)
+    preload(app)
+    return app
+
+
+app = create_app()